@@ -14,7 +14,7 @@ from typing import Any, List, Type, cast
 import joulehunter
 import joulehunter.energy as energy
 from joulehunter import Profiler, renderers
-from joulehunter.frame import BaseFrame
+from joulehunter.frame import METRICS, BaseFrame
 from joulehunter.processors import ProcessorOptions
 from joulehunter.renderers.html import HTMLRenderer
 from joulehunter.session import Session
@@ -208,8 +208,9 @@ def main():
         dest="package",
         action="store",
         default='0',
-        help="select the package (CPU) to analyze (by ID or name - "
-             "default is 0)",
+        help="select the package (CPU) to analyze (by ID or name, 'all' for "
+             "every package of the machine, or 'auto' for the packages this "
+             "process may run on - default is 0)",
     )
 
     parser.add_option(
@@ -221,6 +222,139 @@ def main():
              "specified, the entire package will be selected)",
     )
 
+    parser.add_option(
+        "",
+        "--energy-backend",
+        dest="energy_backend",
+        action="store",
+        metavar="NAME",
+        help="the source of the energy readings, one of: %s. Defaults to the %s "
+             "environment variable, or else energyd if joulehunter-energyd is updating its "
+             "counters, then powercap, then hwmon, or else the model backend, with a "
+             "warning" % (", ".join(energy.BACKENDS), energy.BACKEND_ENV_VAR),
+    )
+
+    parser.add_option(
+        "",
+        "--domains",
+        dest="domains",
+        action="store",
+        metavar="DOMAINS",
+        help="measure several domains in one run, as a comma-separated list "
+             "of package[/component] (e.g. 0,0/dram). Overrides --package "
+             "and --component",
+    )
+
+    parser.add_option(
+        "",
+        "--energy-on-change",
+        dest="energy_on_change",
+        action="store_true",
+        default=False,
+        help="only record samples once the energy counter changes, and share "
+             "each change between the samples taken since the previous one, "
+             "by wall-clock time",
+    )
+
+    parser.add_option(
+        "",
+        "--thread-cpu-weighting",
+        dest="thread_cpu_weighting",
+        action="store_true",
+        default=False,
+        help="only charge the profiled thread with its share of the energy, "
+             "by its CPU time over the CPU time of the whole process",
+    )
+
+    parser.add_option(
+        "",
+        "--cgroup-apportioning",
+        dest="cgroup_apportioning",
+        action="store_true",
+        default=False,
+        help="also record each domain's energy apportioned to this process's "
+             "cgroup (e.g. its container), by the cgroup's share of the host's "
+             "busy CPU time. The apportioned domains follow the others, see "
+             "--render-domain",
+    )
+
+    parser.add_option(
+        "",
+        "--calibrate-idle",
+        dest="calibrate_idle",
+        action="store_true",
+        default=False,
+        help="measure the idle power of each domain before running (or reuse "
+             "this host's measurement from the last day), and also record "
+             "each domain's dynamic energy, i.e. without the idle power. The "
+             "dynamic domains follow the others, see --render-domain",
+    )
+
+    parser.add_option(
+        "",
+        "--metric",
+        dest="metric",
+        action="store",
+        type="choice",
+        choices=list(METRICS),
+        default="energy",
+        metavar="METRIC",
+        help="what to sort and colour frames by: energy, time (wall-clock) or "
+             "power (mean watts) - default is energy",
+    )
+
+    parser.add_option(
+        "",
+        "--record-frequency",
+        dest="record_frequency",
+        action="store_true",
+        default=False,
+        help="also record the core and the CPU frequency of each sample. The "
+             "json renderer then includes each frame's samples per frequency",
+    )
+
+    parser.add_option(
+        "",
+        "--sample-buffer-size",
+        dest="sample_buffer_size",
+        action="store",
+        type="int",
+        default=0,
+        metavar="COUNT",
+        help="record samples natively, and hand them to the profiler in "
+             "batches of COUNT, which makes sampling cheaper. Can't be used "
+             "with options that read something on every sample, like "
+             "--thread-cpu-weighting",
+    )
+
+    parser.add_option(
+        "",
+        "--sampler",
+        dest="sampler",
+        action="store",
+        type="choice",
+        choices=["setprofile", "signal", "threads"],
+        default="setprofile",
+        metavar="SAMPLER",
+        help="how to sample the program: setprofile, on function calls and "
+             "returns; signal, from a SIGPROF timer, which also samples loops "
+             "that make no calls and has no per-call overhead (Unix only, "
+             "main thread only); or threads, from a background thread that "
+             "samples every thread of the process - default is setprofile",
+    )
+
+    parser.add_option(
+        "",
+        "--render-domain",
+        dest="render_domain",
+        action="store",
+        type="int",
+        default=0,
+        metavar="INDEX",
+        help="when several domains were measured, the index of the domain "
+             "to render - default is 0",
+    )
+
     if not sys.argv[1:]:
         parser.print_help()
         sys.exit(2)
@@ -229,8 +363,12 @@ def main():
     # work around a type checking bug...
     args = cast(List[str], args)
 
+    if options.energy_backend is not None and options.energy_backend not in energy.BACKENDS:
+        parser.error(
+            "--energy-backend must be one of: %s" % ", ".join(energy.BACKENDS))
+
     if options.list:
-        available_domains = energy.available_domains()
+        available_domains = energy.available_domains(options.energy_backend)
         print(energy.stringify_domains(available_domains))
         sys.exit(0)
 
@@ -300,7 +438,16 @@ def main():
         profiler = Profiler(
             async_mode="disabled",
             package=options.package,
-            component=options.component
+            component=options.component,
+            domains=options.domains.split(",") if options.domains else None,
+            backend=options.energy_backend,
+            calibrate_idle=options.calibrate_idle,
+            energy_on_change=options.energy_on_change,
+            thread_cpu_weighting=options.thread_cpu_weighting,
+            cgroup_apportioning=options.cgroup_apportioning,
+            record_frequency=options.record_frequency,
+            sample_buffer_size=options.sample_buffer_size,
+            sampler=options.sampler,
         )
 
         profiler.start()
@@ -332,6 +479,12 @@ def main():
     if options.timeline is not None:
         renderer_kwargs["timeline"] = options.timeline
 
+    if not 0 <= options.render_domain < len(session.domains):
+        parser.error(
+            f"--render-domain must be between 0 and {len(session.domains) - 1}")
+    renderer_kwargs["domain"] = options.render_domain
+    renderer_kwargs["metric"] = options.metric
+
     if options.renderer == "text":
         unicode_override = options.unicode is not None
         color_override = options.color is not None
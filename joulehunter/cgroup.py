@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import os
+
+PROC_DIR = "/proc"
+CGROUP_DIR = "/sys/fs/cgroup"
+
+
+class CgroupCpuShare:
+    """
+    Tracks the share of the host's busy CPU time that is used by the cgroup
+    of this process, e.g. its container. Energy counters measure the whole
+    package, which other tenants of the host share, so scaling the energy by
+    this share only charges the cgroup with the energy of its own work.
+
+    The cgroup's usage is read from its ``cpu.stat`` (cgroup v2) or
+    ``cpuacct.usage`` (cgroup v1), and the host's from ``/proc/stat``. Idle
+    and iowait time don't count as busy.
+    """
+
+    def __init__(self, proc_dir: str | None = None, cgroup_dir: str | None = None) -> None:
+        """
+        :param proc_dir: The procfs mount, defaults to :data:`PROC_DIR`.
+        :param cgroup_dir: The cgroup filesystem mount, defaults to
+            :data:`CGROUP_DIR`.
+        """
+        self._usage_fd = self._stat_fd = -1
+        proc_dir = proc_dir or PROC_DIR
+        cgroup_dir = cgroup_dir or CGROUP_DIR
+
+        self._usage_path, self._usage_is_v1 = cgroup_usage_path(proc_dir, cgroup_dir)
+        self._usage_fd = os.open(self._usage_path, os.O_RDONLY)
+        self._stat_fd = os.open(os.path.join(proc_dir, "stat"), os.O_RDONLY)
+        self._clock_ticks = os.sysconf("SC_CLK_TCK")
+
+        self._last_usage = self.read_usage()
+        # /proc/stat only updates every clock tick, so until the host's time
+        # has moved, the cgroup is assumed to use all of it
+        self._last_share = 1.0
+
+    def read_usage(self) -> tuple[int, int]:
+        """
+        Returns the CPU time used by the cgroup and the busy CPU time of the
+        host, in microseconds.
+        """
+        usage_text = os.pread(self._usage_fd, 4096, 0).decode()
+        if self._usage_is_v1:
+            cgroup_usage = int(usage_text) // 1000
+        else:
+            cgroup_usage = parse_cpu_stat(usage_text)["usage_usec"]
+
+        stat_text = os.pread(self._stat_fd, 4096, 0).decode()
+        host_usage = parse_busy_jiffies(stat_text) * 10**6 // self._clock_ticks
+        return cgroup_usage, host_usage
+
+    def share(self) -> float:
+        """
+        Returns the cgroup's share of the host's busy CPU time since the
+        previous call.
+        """
+        cgroup_usage, host_usage = self.read_usage()
+        last_cgroup_usage, last_host_usage = self._last_usage
+
+        # the cgroup's usage is only compared with the host's once the host's
+        # has moved, a clock tick later, so the baseline stays put until then
+        if host_usage > last_host_usage:
+            self._last_usage = (cgroup_usage, host_usage)
+            self._last_share = min(
+                1.0, (cgroup_usage - last_cgroup_usage) / (host_usage - last_host_usage)
+            )
+        return self._last_share
+
+    def close(self) -> None:
+        for fd in (self._usage_fd, self._stat_fd):
+            if fd >= 0:
+                os.close(fd)
+        self._usage_fd = self._stat_fd = -1
+
+    def __del__(self) -> None:
+        self.close()
+
+
+def cgroup_usage_path(proc_dir: str, cgroup_dir: str) -> tuple[str, bool]:
+    """
+    Returns the file holding the CPU usage of this process's cgroup, and
+    whether it's a cgroup v1 ``cpuacct.usage`` file rather than a v2
+    ``cpu.stat``.
+    """
+    with open(os.path.join(proc_dir, "self", "cgroup")) as file:
+        lines = file.read().splitlines()
+
+    candidates = []
+    for line in lines:
+        hierarchy_id, controllers, path = line.split(":", 2)
+        path = path.lstrip("/")
+        if hierarchy_id == "0" and controllers == "":
+            # the unified hierarchy, mounted under unified/ on hybrid hosts
+            candidates.append((os.path.join(cgroup_dir, path, "cpu.stat"), False))
+            candidates.append((os.path.join(cgroup_dir, "unified", path, "cpu.stat"), False))
+        elif "cpuacct" in controllers.split(","):
+            candidates.append((os.path.join(cgroup_dir, controllers, path, "cpuacct.usage"), True))
+
+    for candidate in candidates:
+        if os.path.exists(candidate[0]):
+            return candidate
+
+    raise RuntimeError("The CPU usage of this process's cgroup is not available")
+
+
+def parse_cpu_stat(text: str) -> dict[str, int]:
+    return {key: int(value) for key, value in (line.split() for line in text.splitlines() if line)}
+
+
+def parse_busy_jiffies(text: str) -> int:
+    """
+    Returns the busy CPU time of the host from the aggregate ``cpu`` line of
+    ``/proc/stat``, in clock ticks.
+    """
+    for line in text.splitlines():
+        fields = line.split()
+        if fields and fields[0] == "cpu":
+            # user nice system idle iowait irq softirq steal [guest guest_nice]
+            times = [int(field) for field in fields[1:9]]
+            return sum(times) - times[3] - times[4]
+    raise RuntimeError("No cpu line in /proc/stat")
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import os
+
+PROC_DIR = "/proc"
+CPU_SYSFS_DIR = "/sys/devices/system/cpu"
+
+# the position of the "processor" field in /proc/<pid>/task/<tid>/stat,
+# counted from the field after the command name, see proc(5)
+STAT_PROCESSOR_FIELD = 36
+
+
+class CpuFrequencyReader:
+    """
+    Reads the core that the calling thread last ran on, from
+    ``/proc/thread-self/stat``, and that core's current frequency, from its
+    ``cpufreq/scaling_cur_freq``. The files are opened once and read with
+    ``pread``, so each reading is two system calls.
+
+    The stat file belongs to the thread that creates the reader, so it must
+    be read on that thread.
+    """
+
+    def __init__(self, proc_dir: str | None = None, cpu_dir: str | None = None) -> None:
+        """
+        :param proc_dir: The procfs mount, defaults to :data:`PROC_DIR`.
+        :param cpu_dir: The sysfs CPU directory, defaults to
+            :data:`CPU_SYSFS_DIR`.
+        """
+        self._stat_fd = -1
+        self._frequency_fds: dict[int, int] = {}
+        self._cpu_dir = cpu_dir or CPU_SYSFS_DIR
+        self._stat_fd = os.open(
+            os.path.join(proc_dir or PROC_DIR, "thread-self", "stat"), os.O_RDONLY)
+
+    def read(self) -> tuple[int, int]:
+        """
+        Returns the core, and its frequency in kHz, or 0 if the core doesn't
+        report its frequency, e.g. in most VMs.
+        """
+        cpu = parse_processor(os.pread(self._stat_fd, 4096, 0).decode())
+
+        fd = self._frequency_fds.get(cpu)
+        if fd is None:
+            try:
+                fd = os.open(
+                    os.path.join(self._cpu_dir, f"cpu{cpu}", "cpufreq", "scaling_cur_freq"),
+                    os.O_RDONLY,
+                )
+            except OSError:
+                fd = -1
+            self._frequency_fds[cpu] = fd
+        if fd < 0:
+            return cpu, 0
+
+        return cpu, int(os.pread(fd, 64, 0))
+
+    def close(self) -> None:
+        for fd in [self._stat_fd, *self._frequency_fds.values()]:
+            if fd >= 0:
+                os.close(fd)
+        self._stat_fd = -1
+        self._frequency_fds = {}
+
+    def __del__(self) -> None:
+        self.close()
+
+
+def parse_processor(text: str) -> int:
+    """
+    Returns the core from the contents of a ``stat`` file of procfs. The
+    command name, in parentheses, can contain spaces, so the fields are
+    counted from the last parenthesis.
+    """
+    return int(text[text.rindex(")") + 1:].split()[STAT_PROCESSOR_FIELD])
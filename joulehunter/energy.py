@@ -1,44 +1,831 @@
 # Allows the use of standard collection type hinting from Python 3.7 onwards
 from __future__ import annotations
 
-from collections.abc import Generator
+import json
+import mmap
 import os
-from typing import Any
+import re
+import socket
+import struct
+import threading
+import time
+import warnings
+from typing import Any, Callable, NamedTuple
+
+from joulehunter.low_level import energy_poller
+from joulehunter.low_level.stat_profile import read_energy_counters
 
 RAPL_API_DIR = "/sys/devices/virtual/powercap/intel-rapl"
 
+# overrides the root of the powercap tree, e.g. for containers that mount the
+# host's /sys somewhere else
+POWERCAP_ROOT_ENV_VAR = "JOULEHUNTER_POWERCAP_ROOT"
+
+HWMON_DIR = "/sys/class/hwmon"
+
+# overrides the hwmon class directory, like JOULEHUNTER_POWERCAP_ROOT
+HWMON_ROOT_ENV_VAR = "JOULEHUNTER_HWMON_ROOT"
+
+# the shared memory segment published by joulehunter-energyd
+ENERGYD_PATH = "/dev/shm/joulehunter-energy"
+
+# overrides the path of the joulehunter-energyd segment
+ENERGYD_PATH_ENV_VAR = "JOULEHUNTER_ENERGYD_PATH"
+
+# selects the energy backend by name, see get_backend()
+BACKEND_ENV_VAR = "JOULEHUNTER_ENERGY_BACKEND"
+
+# the power drawn by one busy core, in watts, for the model backend
+MODEL_WATTS_ENV_VAR = "JOULEHUNTER_MODEL_WATTS"
+
+# a rough figure for one busy core of a desktop or server CPU, used when the
+# model backend isn't configured or calibrated
+DEFAULT_MODEL_WATTS = 10.0
+
+# how long the idle power is measured for, in seconds
+IDLE_CALIBRATION_DURATION = 1.0
+
+# idle power calibrations are cached per host and domain in this file, and
+# reused until they're older than IDLE_CALIBRATION_MAX_AGE seconds
+IDLE_CALIBRATION_CACHE = os.path.join(
+    os.path.expanduser("~"), ".cache", "joulehunter", "idle_power.json")
+IDLE_CALIBRATION_MAX_AGE = 24 * 60 * 60
+
+# the package that selects every package of the machine, summed
+ALL_PACKAGES = "all"
+
+# the package that selects the packages this process may run on, summed
+AUTO_PACKAGE = "auto"
+
+CPU_SYSFS_DIR = "/sys/devices/system/cpu"
+
+
+class RaplDomain(NamedTuple):
+    """
+    A package, or a component of a package, that has an energy counter.
+    """
+
+    dirnames: tuple[str, ...]
+    name: str
+    max_energy_range: int
+    """
+    The raw value at which the energy counter wraps around to 0, or 0 if it's
+    unknown.
+    """
+    components: tuple[RaplDomain, ...] = ()
+    counter_path: str = ""
+    """
+    The file holding the energy counter, for file-based backends.
+    """
+
+    @property
+    def id(self) -> str:
+        """
+        The ID of the domain within its parent, e.g. ``1`` for
+        ``intel-rapl:0:1``.
+        """
+        return self.dirnames[-1].split(":")[-1]
+
+
+class RaplTopology(NamedTuple):
+    """
+    An immutable snapshot of the energy domains of the machine. Discovering
+    them can take a listdir and a few reads per domain, so the snapshot is
+    taken once per backend and shared, see :func:`get_topology`.
+    """
+
+    root: str
+    """
+    Identifies where the domains were discovered, e.g. the powercap
+    directory.
+    """
+    packages: tuple[RaplDomain, ...]
+
+    def find(self, dirnames: list[str]) -> RaplDomain:
+        """
+        Returns the domain at ``dirnames``, e.g. ``["intel-rapl:0",
+        "intel-rapl:0:1"]``.
+        """
+        domains = self.packages
+        domain = None
+        for dirname in dirnames:
+            domain = next((d for d in domains if d.dirnames[-1] == dirname), None)
+            if domain is None:
+                break
+            domains = domain.components
+        if domain is None:
+            raise RuntimeError("Domain not found")
+        return domain
+
+    def as_dicts(self) -> list[dict[str, Any]]:
+        """
+        Returns the domains in the format of :func:`available_domains`.
+        """
+        return [
+            {"dirname": package.dirnames[-1],
+             "name": package.name,
+             "components": [
+                 {"dirname": component.dirnames[-1], "name": component.name}
+                 for component in package.components]}
+            for package in self.packages]
+
+
+class EnergyBackend:
+    """
+    Abstract base class for the sources of energy readings.
+
+    A backend discovers the energy domains of the machine, opens a handle to
+    the counter of a domain, and reads many handles in one call. Readings are
+    raw integer counter values, in units of :attr:`energy_unit` joules, which
+    wrap around to 0 at each domain's
+    :attr:`RaplDomain.max_energy_range`.
+    """
+
+    name: str = ""
+
+    energy_unit: float = 1e-6
+    """
+    The energy of one unit of the raw readings, in joules.
+    """
+
+    native: bool = False
+    """
+    True if the handles are file descriptors of powercap-style counter
+    files. Only these can be read by the native sampler and poller, which
+    the ``energy_interval`` and ``energy_poll_interval`` options require.
+    """
+
+    share_handles: bool = True
+    """
+    True if reading a handle has no side effects, so that the counters of
+    the same domain can share one, see :class:`CounterPool`.
+    """
+
+    _topology: RaplTopology | None = None
+
+    def discover(self) -> RaplTopology:
+        """
+        Walks the energy domains of the machine. Use :meth:`topology`
+        instead, which caches the result.
+        """
+        raise NotImplementedError()
+
+    def topology_is_stale(self, topology: RaplTopology) -> bool:
+        return False
+
+    def topology(self) -> RaplTopology:
+        """
+        Returns the domains of this backend, discovering them on first use.
+        """
+        topology = self._topology
+        if topology is None or self.topology_is_stale(topology):
+            topology = self.refresh_topology()
+        return topology
+
+    def refresh_topology(self) -> RaplTopology:
+        """
+        Discovers the domains again, e.g. after a CPU was hotplugged.
+        """
+        with _topology_lock:
+            self._topology = self.discover()
+            return self._topology
+
+    def open(self, dirnames: list[str]) -> int:
+        """
+        Returns a handle to the counter of a domain, to pass to :meth:`read`.
+        """
+        raise NotImplementedError()
+
+    def read(self, handles: list[int]) -> list[int]:
+        """
+        Reads the raw value of each of ``handles``, in one batch.
+        """
+        raise NotImplementedError()
+
+    def close(self, handle: int) -> None:
+        pass
+
+
+class PowercapBackend(EnergyBackend):
+    """
+    Reads the Linux powercap interface to Intel RAPL, e.g.
+    ``/sys/devices/virtual/powercap/intel-rapl``. Counters are read natively,
+    see :func:`~joulehunter.low_level.stat_profile.read_energy_counters`.
+    """
+
+    name = "powercap"
+    energy_unit = 1e-6
+    native = True
+
+    def __init__(self, root: str | None = None) -> None:
+        """
+        :param root: The powercap directory. Defaults to the
+            ``JOULEHUNTER_POWERCAP_ROOT`` environment variable, or the
+            standard location.
+        """
+        self._root = root
+
+    @property
+    def root(self) -> str:
+        return self._root or os.environ.get(POWERCAP_ROOT_ENV_VAR) or RAPL_API_DIR
+
+    def topology_is_stale(self, topology: RaplTopology) -> bool:
+        # the root can be changed after the first discovery
+        return topology.root != self.root
+
+    def discover(self) -> RaplTopology:
+        root = self.root
+        if not os.path.exists(root):
+            raise RuntimeError("RAPL API is not available on this machine")
+
+        def read_domain(dirnames: tuple[str, ...], components: tuple[RaplDomain, ...] = ()):
+            domain_dir = os.path.join(root, *dirnames)
+            name = read_sysfs_line(os.path.join(domain_dir, "name"))
+            max_range_path = os.path.join(domain_dir, "max_energy_range_uj")
+            max_energy_range = 0
+            if os.path.exists(max_range_path):
+                max_energy_range = int(read_sysfs_line(max_range_path))
+            return RaplDomain(dirnames, name, max_energy_range, components,
+                              os.path.join(domain_dir, "energy_uj"))
+
+        packages = []
+        for package_dirname in sorted(os.listdir(root)):
+            if not package_dirname.startswith("intel-rapl"):
+                continue
+            components = tuple(
+                read_domain((package_dirname, dirname))
+                for dirname in sorted(os.listdir(os.path.join(root, package_dirname)))
+                if dirname.startswith("intel-rapl")
+            )
+            packages.append(read_domain((package_dirname,), components))
+
+        return RaplTopology(root, tuple(packages))
+
+    def open(self, dirnames: list[str]) -> int:
+        return os.open(self.topology().find(dirnames).counter_path, os.O_RDONLY)
+
+    def read(self, handles: list[int]) -> list[int]:
+        return read_energy_counters(handles)
+
+    def close(self, handle: int) -> None:
+        os.close(handle)
+
+
+class HwmonBackend(EnergyBackend):
+    """
+    Reads the energy sensors of the hwmon interface, e.g.
+    ``/sys/class/hwmon/hwmon*/energy*_input`` as exposed by ``amd_energy``
+    or SCMI. Like powercap, these are microjoule counter files, so they're
+    read natively.
 
-def available_domains() -> list[dict[str, Any]]:
-    if not os.path.exists(RAPL_API_DIR):
-        raise RuntimeError("RAPL API is not available on this machine")
+    hwmon has no notion of packages, so channels are mapped onto them: every
+    channel labelled as a socket (e.g. ``Esocket0``) is a package, and the
+    other channels of its device (e.g. ``Ecore000``) are split evenly
+    between the device's sockets, in order, as their components. The
+    channels of a device without sockets are each a package.
+    """
 
-    packages = [
-        {"dirname": dirname,
-         "name": domain_name([dirname]),
-         "components": []}
-        for dirname in sorted(os.listdir(RAPL_API_DIR))
-        if dirname.startswith("intel-rapl")]
+    name = "hwmon"
+    energy_unit = 1e-6
+    native = True
 
-    for package in packages:
-        package["components"] = [
-            {"dirname": dirname,
-             "name": domain_name([package["dirname"], dirname])}
-            for dirname
-            in sorted(os.listdir(os.path.join(RAPL_API_DIR,
-                                              package["dirname"])))
-            if dirname.startswith("intel-rapl")]
+    def __init__(self, root: str | None = None) -> None:
+        """
+        :param root: The hwmon class directory. Defaults to the
+            ``JOULEHUNTER_HWMON_ROOT`` environment variable, or the standard
+            location.
+        """
+        self._root = root
 
-    return packages
+    @property
+    def root(self) -> str:
+        return self._root or os.environ.get(HWMON_ROOT_ENV_VAR) or HWMON_DIR
 
+    def topology_is_stale(self, topology: RaplTopology) -> bool:
+        return topology.root != self.root
 
-def domain_name(dirnames: list[str]) -> str:
-    rapl_name_path = os.path.join(RAPL_API_DIR, *dirnames, "name")
-    if not os.path.exists(rapl_name_path):
-        raise RuntimeError("Domain not found")
-    with open(rapl_name_path, "r") as file:
+    def channels(self) -> list[tuple[str, list[tuple[str, str]]]]:
+        """
+        Returns the name and the energy channels of each hwmon device, as
+        (label, counter path) pairs.
+        """
+        root = self.root
+        if not os.path.exists(root):
+            return []
+
+        devices = []
+        for device_dirname in sorted(os.listdir(root), key=natural_sort_key):
+            device_dir = os.path.join(root, device_dirname)
+            inputs = sorted(
+                (filename for filename in os.listdir(device_dir)
+                 if re.fullmatch(r"energy\d+_input", filename)),
+                key=natural_sort_key)
+            if not inputs:
+                continue
+
+            channels = []
+            for input_filename in inputs:
+                channel = input_filename[:-len("_input")]
+                label_path = os.path.join(device_dir, channel + "_label")
+                label = read_sysfs_line(label_path) if os.path.exists(label_path) else channel
+                channels.append((label, os.path.join(device_dir, input_filename)))
+
+            name_path = os.path.join(device_dir, "name")
+            name = read_sysfs_line(name_path) if os.path.exists(name_path) else device_dirname
+            devices.append((name, channels))
+
+        return devices
+
+    def discover(self) -> RaplTopology:
+        devices = self.channels()
+        if not devices:
+            raise RuntimeError("No hwmon energy sensors are available on this machine")
+
+        packages: list[RaplDomain] = []
+        for _, channels in devices:
+            sockets = [channel for channel in channels if is_socket_label(channel[0])]
+            others = [channel for channel in channels if not is_socket_label(channel[0])]
+
+            if not sockets:
+                for label, path in others:
+                    packages.append(self._domain([len(packages)], label, path))
+                continue
+
+            components_per_socket = -(-len(others) // len(sockets))
+            for socket_num, (label, path) in enumerate(sockets):
+                package_num = len(packages)
+                socket_channels = others[socket_num * components_per_socket:
+                                         (socket_num + 1) * components_per_socket]
+                components = tuple(
+                    self._domain([package_num, component_num], component_label, component_path)
+                    for component_num, (component_label, component_path)
+                    in enumerate(socket_channels))
+                packages.append(self._domain([package_num], label, path, components))
+
+        return RaplTopology(self.root, tuple(packages))
+
+    @staticmethod
+    def _domain(nums: list[int], label: str, path: str,
+                components: tuple[RaplDomain, ...] = ()) -> RaplDomain:
+        dirnames = tuple(
+            "hwmon:" + ":".join(str(num) for num in nums[:index + 1])
+            for index in range(len(nums)))
+        # hwmon energy counters are 64 bits wide, they don't wrap in practice
+        return RaplDomain(dirnames, label, 0, components, path)
+
+    def open(self, dirnames: list[str]) -> int:
+        return os.open(self.topology().find(dirnames).counter_path, os.O_RDONLY)
+
+    def read(self, handles: list[int]) -> list[int]:
+        return read_energy_counters(handles)
+
+    def close(self, handle: int) -> None:
+        os.close(handle)
+
+
+def read_sysfs_line(path: str) -> str:
+    with open(path, "r") as file:
         return file.readline().strip()
 
 
+def natural_sort_key(name: str) -> list[Any]:
+    # sorts hwmon10 after hwmon9, and energy10_input after energy9_input
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", name)]
+
+
+def is_socket_label(label: str) -> bool:
+    return re.search(r"socket|package|pkg", label, re.IGNORECASE) is not None
+
+
+class ScriptedBackend(EnergyBackend):
+    """
+    An in-memory backend, whose counters follow a script instead of the
+    hardware. Readings are deterministic, so it can stand in for RAPL in
+    tests and benchmarks on machines that don't have it.
+    """
+
+    name = "scripted"
+    energy_unit = 1e-6
+    # the script is run for each handle separately
+    share_handles = False
+
+    def __init__(
+        self,
+        packages: dict[str, list[str]] | None = None,
+        script: Callable[[tuple[str, ...], int], int] | None = None,
+        max_energy_range: int = 0,
+    ) -> None:
+        """
+        :param packages: The names of the packages, mapped to the names of
+            their components. Defaults to one package with a core and a
+            dram component.
+        :param script: Returns the value of a counter, in microjoules, given
+            the domain's dirnames and the number of times the counter was
+            read before. By default, every read adds 1000 µJ.
+        :param max_energy_range: The value at which the counters wrap around
+            to 0, or 0 if they never do.
+        """
+        if packages is None:
+            packages = {"package-0": ["core", "dram"]}
+        self.packages = packages
+        self.script = script or (lambda dirnames, read_count: read_count * 1000)
+        self.max_energy_range = max_energy_range
+        # a closed handle's slot is None, until a later open reuses it
+        self._handles: list[tuple[str, ...] | None] = []
+        self._read_counts: list[int] = []
+
+    def discover(self) -> RaplTopology:
+        packages = []
+        for package_num, (package_name, component_names) in enumerate(self.packages.items()):
+            package_dirname = f"scripted:{package_num}"
+            components = tuple(
+                RaplDomain((package_dirname, f"scripted:{package_num}:{component_num}"),
+                           component_name, self.max_energy_range)
+                for component_num, component_name in enumerate(component_names))
+            packages.append(
+                RaplDomain((package_dirname,), package_name, self.max_energy_range, components))
+        return RaplTopology("scripted", tuple(packages))
+
+    def open(self, dirnames: list[str]) -> int:
+        self.topology().find(dirnames)
+        try:
+            handle = self._handles.index(None)
+        except ValueError:
+            self._handles.append(None)
+            self._read_counts.append(0)
+            handle = len(self._handles) - 1
+        self._handles[handle] = tuple(dirnames)
+        self._read_counts[handle] = 0
+        return handle
+
+    def read(self, handles: list[int]) -> list[int]:
+        values = []
+        for handle in handles:
+            dirnames = self._handles[handle]
+            assert dirnames is not None
+            value = self.script(dirnames, self._read_counts[handle])
+            self._read_counts[handle] += 1
+            if self.max_energy_range:
+                value %= self.max_energy_range
+            values.append(value)
+        return values
+
+    def close(self, handle: int) -> None:
+        self._handles[handle] = None
+
+
+class ModelBackend(EnergyBackend):
+    """
+    Estimates energy from CPU time, for machines without energy counters,
+    e.g. VMs and containers. Every second of CPU time counts as ``watts``
+    joules, so the estimate only covers the dynamic power of the cores that
+    the process keeps busy - not the idle power of the machine, its memory
+    or its other processes.
+
+    There's one package, ``process``, which counts the CPU time of every
+    thread of the process, with one component, ``thread``, which counts the
+    CPU time of the thread that reads it. The profiler reads the counter
+    from the profiled thread, so ``thread`` leaves out the work of other
+    threads.
+    """
+
+    name = "model"
+    energy_unit = 1e-9
+
+    def __init__(self, watts: float | None = None) -> None:
+        """
+        :param watts: The power drawn by one busy core, in watts. Defaults to
+            the ``JOULEHUNTER_MODEL_WATTS`` environment variable, or
+            :data:`DEFAULT_MODEL_WATTS`. See :meth:`calibrate` to measure it.
+        """
+        if watts is None:
+            watts = float(os.environ.get(MODEL_WATTS_ENV_VAR) or DEFAULT_MODEL_WATTS)
+        if watts <= 0:
+            raise ValueError("The model's power must be positive")
+        self.watts = watts
+        # one handle per clock, the package's and the component's
+        self._clocks: tuple[Callable[[], int], ...] = (time.process_time_ns, time.thread_time_ns)
+
+    def discover(self) -> RaplTopology:
+        thread = RaplDomain(("model:0", "model:0:0"), "thread", 0)
+        return RaplTopology("model", (RaplDomain(("model:0",), "process", 0, (thread,)),))
+
+    def open(self, dirnames: list[str]) -> int:
+        self.topology().find(dirnames)
+        return 1 if len(dirnames) > 1 else 0
+
+    def read(self, handles: list[int]) -> list[int]:
+        # CPU nanoseconds times watts gives nanojoules
+        return [int(self._clocks[handle]() * self.watts) for handle in handles]
+
+    @staticmethod
+    def calibrate(reference: EnergyBackend | str | None = None, duration: float = 1.0) -> float:
+        """
+        Measures the power drawn by one busy core, in watts, by keeping this
+        thread busy for ``duration`` seconds while reading the first package
+        of a backend with real counters - on a machine like the one the
+        model will stand in for. Pass the result as ``watts``.
+
+        The package's idle power is included, so this overestimates on an
+        idle machine with many cores, and underestimates on a busy one.
+        """
+        counter = Energy(package_domains(reference)[0], reference)
+        try:
+            start_energy = counter.current_energy()
+            start_cpu_time = time.thread_time()
+            end = time.monotonic() + duration
+            while time.monotonic() < end:
+                pass
+            energy = counter.current_energy() - start_energy
+            cpu_time = time.thread_time() - start_cpu_time
+        finally:
+            counter.close()
+        return energy / cpu_time
+
+
+# the header of the joulehunter-energyd segment: magic, version, number of
+# counters, seqlock sequence number, monotonic_ns time of the last update,
+# and the offset and length of the topology. The counters follow, as
+# microjoule uint64s, then the topology as JSON.
+ENERGYD_MAGIC = b"JHENERGY"
+ENERGYD_VERSION = 1
+ENERGYD_HEADER = struct.Struct("=8sIIQQII")
+ENERGYD_SEQ_OFFSET = 16
+ENERGYD_TIMESTAMP_OFFSET = 24
+
+# the segment is considered abandoned if it wasn't updated for this long, in
+# seconds
+ENERGYD_MAX_AGE = 1.0
+
+
+class EnergydBackend(EnergyBackend):
+    """
+    Reads the counters that the ``joulehunter-energyd`` helper publishes in
+    a shared memory segment, see :mod:`joulehunter.energyd`. The helper can
+    run as root while the profiled program doesn't, and reading a counter is
+    a memory load rather than a system call.
+
+    The segment is protected by a seqlock: the helper makes the sequence
+    number odd while it updates the counters, so readers retry until they
+    see the same even number before and after reading them. The helper
+    corrects wraparounds, so the counters only ever increase.
+    """
+
+    name = "energyd"
+    energy_unit = 1e-6
+
+    def __init__(self, path: str | None = None) -> None:
+        """
+        :param path: The shared memory segment. Defaults to the
+            ``JOULEHUNTER_ENERGYD_PATH`` environment variable, or
+            :data:`ENERGYD_PATH`.
+        """
+        self._path = path
+        self._mmap: mmap.mmap | None = None
+        self._values: struct.Struct | None = None
+        self._indexes: dict[tuple[str, ...], int] = {}
+        self._inode = -1
+
+    @property
+    def path(self) -> str:
+        return self._path or os.environ.get(ENERGYD_PATH_ENV_VAR) or ENERGYD_PATH
+
+    def is_running(self) -> bool:
+        """
+        Returns whether a helper is publishing its counters at :attr:`path`:
+        the segment belongs to root or to this user, and was updated in the
+        last :data:`ENERGYD_MAX_AGE` seconds. A helper that was killed leaves
+        its segment behind, which isn't.
+        """
+        try:
+            with open(self.path, "rb") as file:
+                owner = os.fstat(file.fileno()).st_uid
+                header = file.read(ENERGYD_HEADER.size)
+        except OSError:
+            return False
+        if owner not in (0, os.getuid()) or len(header) < ENERGYD_HEADER.size:
+            return False
+
+        magic, version, _, _, timestamp, _, _ = ENERGYD_HEADER.unpack(header)
+        return (
+            magic == ENERGYD_MAGIC
+            and version == ENERGYD_VERSION
+            and time.monotonic_ns() - timestamp <= ENERGYD_MAX_AGE * 10**9
+        )
+
+    def is_publishing(self) -> bool:
+        """
+        Like :meth:`is_running`, but once the segment is mapped, only checks
+        that it's still updated: a memory load rather than opening the file.
+        """
+        if self._mmap is None:
+            return self.is_running()
+        [timestamp] = struct.unpack_from("=Q", self._mmap, ENERGYD_TIMESTAMP_OFFSET)
+        return time.monotonic_ns() - timestamp <= ENERGYD_MAX_AGE * 10**9
+
+    def topology_is_stale(self, topology: RaplTopology) -> bool:
+        # the helper was restarted, or another one was chosen
+        return topology.root != self.path or self._segment_was_replaced()
+
+    def _segment_was_replaced(self) -> bool:
+        try:
+            return os.stat(self.path).st_ino != self._inode
+        except OSError:
+            return False
+
+    def discover(self) -> RaplTopology:
+        path = self.path
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError as e:
+            raise RuntimeError(f"joulehunter-energyd is not running ({path}: {e.strerror})")
+        try:
+            self._inode = os.fstat(fd).st_ino
+            segment = mmap.mmap(fd, 0, prot=mmap.PROT_READ)
+        finally:
+            os.close(fd)
+
+        magic, version, count, _, timestamp, topology_offset, topology_length = (
+            ENERGYD_HEADER.unpack_from(segment, 0))
+        if magic != ENERGYD_MAGIC or version != ENERGYD_VERSION:
+            raise RuntimeError(f"{path} is not a joulehunter-energyd segment")
+        if time.monotonic_ns() - timestamp > ENERGYD_MAX_AGE * 10**9:
+            raise RuntimeError("joulehunter-energyd is not updating its counters")
+
+        packages_info = json.loads(segment[topology_offset:topology_offset + topology_length])
+        self._mmap = segment
+        self._values = struct.Struct(f"={count}Q")
+        self._indexes = {}
+
+        packages = []
+        for package_num, package_info in enumerate(packages_info):
+            package_dirname = f"energyd:{package_num}"
+            components = []
+            for component_num, component_info in enumerate(package_info["components"]):
+                dirnames = (package_dirname, f"{package_dirname}:{component_num}")
+                self._indexes[dirnames] = component_info["index"]
+                components.append(RaplDomain(dirnames, component_info["name"], 0))
+            self._indexes[(package_dirname,)] = package_info["index"]
+            packages.append(RaplDomain(
+                (package_dirname,), package_info["name"], 0, tuple(components)))
+
+        return RaplTopology(path, tuple(packages))
+
+    def open(self, dirnames: list[str]) -> int:
+        self.topology().find(dirnames)
+        return self._indexes[tuple(dirnames)]
+
+    def read(self, handles: list[int]) -> list[int]:
+        segment, values_struct = self._mmap, self._values
+        assert segment is not None and values_struct is not None
+        for _ in range(100000):
+            [seq] = struct.unpack_from("=Q", segment, ENERGYD_SEQ_OFFSET)
+            if seq & 1:
+                continue
+            values = values_struct.unpack_from(segment, ENERGYD_HEADER.size)
+            if struct.unpack_from("=Q", segment, ENERGYD_SEQ_OFFSET)[0] == seq:
+                return [values[handle] for handle in handles]
+        # the helper must have died while it was updating the counters
+        raise RuntimeError("joulehunter-energyd's counters are locked")
+
+
+BACKENDS: dict[str, type[EnergyBackend]] = {
+    PowercapBackend.name: PowercapBackend,
+    HwmonBackend.name: HwmonBackend,
+    ScriptedBackend.name: ScriptedBackend,
+    ModelBackend.name: ModelBackend,
+    EnergydBackend.name: EnergydBackend,
+}
+
+_backend: EnergyBackend | None = None
+# whether _backend was chosen by default, rather than by set_backend
+_backend_is_default = False
+_named_backends: dict[str, EnergyBackend] = {}
+_topology_lock = threading.Lock()
+
+
+def get_backend(backend: EnergyBackend | str | None = None) -> EnergyBackend:
+    """
+    Returns an energy backend. ``backend`` can be a backend, or the name of
+    one in :data:`BACKENDS`. If it's ``None``, the process-wide backend is
+    returned, see :func:`set_backend`.
+
+    By default, that's the backend named by the
+    ``JOULEHUNTER_ENERGY_BACKEND`` environment variable. Otherwise, it's
+    the counters of ``joulehunter-energyd`` if it's running (see
+    :meth:`EnergydBackend.is_running`), then powercap if the machine has it,
+    or hwmon if it has energy sensors. If it has none, energy is estimated
+    from CPU time by the model backend, with a warning.
+
+    The default is chosen on first use, and kept until :func:`set_backend`
+    or :func:`refresh_topology` is called, or the chosen energyd helper stops
+    updating its counters.
+    """
+    if isinstance(backend, EnergyBackend):
+        return backend
+    if backend is not None:
+        if backend not in BACKENDS:
+            raise ValueError(
+                f"Unknown energy backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+        # named backends are shared, so that they discover their domains once
+        if backend not in _named_backends:
+            _named_backends[backend] = BACKENDS[backend]()
+        return _named_backends[backend]
+
+    global _backend, _backend_is_default
+    if _backend is not None and not (
+        _backend_is_default
+        and isinstance(_backend, EnergydBackend)
+        and not _backend.is_publishing()
+    ):
+        return _backend
+    _backend = _default_backend()
+    _backend_is_default = True
+    return _backend
+
+
+def _default_backend() -> EnergyBackend:
+    if os.environ.get(BACKEND_ENV_VAR):
+        return get_backend(os.environ[BACKEND_ENV_VAR])
+
+    energyd_backend = get_backend(EnergydBackend.name)
+    if isinstance(energyd_backend, EnergydBackend) and energyd_backend.is_running():
+        return energyd_backend
+    powercap_backend = get_backend(PowercapBackend.name)
+    if os.path.exists(powercap_backend.root):
+        return powercap_backend
+    hwmon_backend = get_backend(HwmonBackend.name)
+    try:
+        hwmon_backend.topology()
+    except RuntimeError:
+        warnings.warn(
+            "No energy counters are available on this machine, estimating energy from CPU "
+            f"time instead. Set {BACKEND_ENV_VAR} to choose a backend.")
+        return get_backend(ModelBackend.name)
+    return hwmon_backend
+
+
+def set_backend(backend: EnergyBackend | str | None) -> None:
+    """
+    Sets the process-wide energy backend. ``None`` restores the default.
+    """
+    global _backend, _backend_is_default
+    _backend = None if backend is None else get_backend(backend)
+    _backend_is_default = False
+
+
+def get_topology(backend: EnergyBackend | str | None = None) -> RaplTopology:
+    """
+    Returns the energy domains of the machine, discovering them on first use.
+    The snapshot is shared by the whole process, call
+    :func:`refresh_topology` if the domains have changed since.
+    """
+    return get_backend(backend).topology()
+
+
+def refresh_topology(backend: EnergyBackend | str | None = None) -> RaplTopology:
+    """
+    Discovers the energy domains of the machine again, and shares the new
+    snapshot.
+    """
+    if backend is None and _backend_is_default:
+        # e.g. joulehunter-energyd was started since, choose again
+        set_backend(None)
+    return get_backend(backend).refresh_topology()
+
+
+def available_domains(backend: EnergyBackend | str | None = None) -> list[dict[str, Any]]:
+    return get_topology(backend).as_dicts()
+
+
+def domain_name(dirnames: list[str], backend: EnergyBackend | str | None = None) -> str:
+    return get_topology(backend).find(dirnames).name
+
+
+def domain_names(domain: list[str], backend: EnergyBackend | str | None = None) -> list[str]:
+    """
+    Returns the names of the package and, if any, the component of a domain.
+    """
+    if domain in ([ALL_PACKAGES], [AUTO_PACKAGE]):
+        return domain
+    return [domain_name(domain[:index + 1], backend) for index in range(len(domain))]
+
+
+def max_energy_range(dirnames: list[str], backend: EnergyBackend | str | None = None) -> int:
+    """
+    Returns the raw value at which the energy counter of a domain wraps
+    around to 0, or 0 if it's unknown.
+    """
+    return get_topology(backend).find(dirnames).max_energy_range
+
+
+def package_domains(backend: EnergyBackend | str | None = None) -> list[list[str]]:
+    """
+    Returns the domain of every package of the machine.
+    """
+    return [list(package.dirnames) for package in get_topology(backend).packages]
+
+
 def stringify_domains(domains: list[dict[str, Any]]) -> str:
     text = ""
     for package_num, package in enumerate(domains):
@@ -77,40 +864,497 @@ def dirnames_to_names(domains: list[dict[str, Any]],
     return names
 
 
-def parse_domain(package, component):
-    available_domains_ = available_domains()
+_cpu_packages: dict[int, int] = {}
+
+
+def cpu_package(cpu: int) -> int:
+    """
+    Returns the physical package (socket) of a CPU. The CPU topology rarely
+    changes, so this is cached.
+    """
+    package = _cpu_packages.get(cpu)
+    if package is None:
+        package = int(read_sysfs_line(os.path.join(
+            CPU_SYSFS_DIR, f"cpu{cpu}", "topology", "physical_package_id")))
+        _cpu_packages[cpu] = package
+    return package
+
+
+def affinity_package_domains(backend: EnergyBackend | str | None = None) -> list[list[str]]:
+    """
+    Returns the domain of every package that this process may run on,
+    according to its CPU affinity. This is cheap enough to check again
+    before each profile: the affinity is one system call, and the package of
+    each CPU is cached.
 
+    The packages are matched to the CPUs' physical package IDs by name, as
+    the kernel names them ``package-<id>``, or ``package-<id>-die-<die>`` on
+    parts with several dies, each of which is then included. If a CPU's
+    package has no domain, e.g. the backend only has one package for the
+    whole machine, every package is returned, with a warning.
+    """
+    packages = get_topology(backend).packages
+    all_domains = [list(package.dirnames) for package in packages]
+    if not hasattr(os, "sched_getaffinity"):
+        return all_domains
+
+    package_ids = sorted({cpu_package(cpu) for cpu in os.sched_getaffinity(0)})
+    domains = []
+    for package_id in package_ids:
+        package_domains = [
+            list(package.dirnames) for package in packages
+            if package.name == f"package-{package_id}"
+            or package.name.startswith(f"package-{package_id}-die-")
+        ]
+        if not package_domains:
+            warnings.warn(
+                f"No energy domain of package {package_id} was found, measuring every "
+                "package instead.")
+            return all_domains
+        domains.extend(package_domains)
+    return domains
+
+
+def parse_domain(package, component, backend: EnergyBackend | str | None = None):
+    """
+    Returns the domain of a package and, optionally, one of its components,
+    each given by ID or name.
+
+    The :data:`ALL_PACKAGES` package selects every package. The
+    :data:`AUTO_PACKAGE` package selects the packages of the CPUs that this
+    process may run on: the package itself if there's only one, or else
+    their sum.
+    """
     package = str(package)
-    if not package.isnumeric():
-        package = package_name_to_num(available_domains_, package)
+    if package == ALL_PACKAGES:
+        if component is not None:
+            raise ValueError("A component can't be selected with all packages")
+        return [ALL_PACKAGES]
 
-    domain = [f'intel-rapl:{package}']
+    topology = get_topology(backend)
+
+    if package == AUTO_PACKAGE:
+        auto_domains = affinity_package_domains(backend)
+        if len(auto_domains) > 1:
+            if component is not None:
+                raise ValueError(
+                    "A component can't be selected when the process runs on several packages")
+            return [AUTO_PACKAGE]
+        package = auto_domains[0][-1]
+
+    package_domain = next(
+        (p for p in topology.packages if package in (p.id, p.name, p.dirnames[-1])), None)
+    if package_domain is None:
+        raise RuntimeError("Package not found")
+    domain = [package_domain.dirnames[-1]]
 
     if component is not None:
         component = str(component)
-        if not component.isnumeric():
-            component = component_name_to_num(available_domains_, component)
-        domain.append(f'intel-rapl:{package}:{component}')
+        component_domain = next(
+            (c for c in package_domain.components if component in (c.id, c.name)), None)
+        if component_domain is None:
+            raise RuntimeError("Component not found")
+        domain.append(component_domain.dirnames[-1])
 
     return domain
 
 
+def parse_domains(domains: list[Any], backend: EnergyBackend | str | None = None) -> list[list[str]]:
+    """
+    Parses a list of domains. Each domain is either a package (by ID or
+    name), a ``(package, component)`` tuple, or a ``"package/component"``
+    string.
+    """
+    parsed = []
+    for domain in domains:
+        if isinstance(domain, str) and "/" in domain:
+            domain = tuple(domain.split("/", 1))
+        if isinstance(domain, (tuple, list)):
+            package, component = domain
+        else:
+            package, component = domain, None
+        parsed.append(parse_domain(package, component, backend))
+
+    if not parsed:
+        raise ValueError("At least one domain must be given")
+
+    return parsed
+
+
+class CounterPool:
+    """
+    The open counter handles of the process, shared by the :class:`Energy`
+    counters of the same domain. A handle is opened by the first counter of
+    its domain, and closed when the last one is closed, so profilers that
+    are created often, e.g. one per request, don't each open their own
+    counter files. Thread-safe.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # (backend ID, dirnames) -> [backend, handle, reference count]. The
+        # backend is kept alive while it has handles, so its ID isn't reused
+        self._entries: dict[tuple[int, tuple[str, ...]], list[Any]] = {}
+
+    def acquire(self, backend: EnergyBackend, dirnames: list[str]) -> int:
+        """
+        Returns a handle to the counter of a domain, opening it if it isn't
+        open yet. Give it back with :meth:`release`.
+        """
+        if not backend.share_handles:
+            return backend.open(dirnames)
+
+        key = (id(backend), tuple(dirnames))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = [backend, backend.open(dirnames), 0]
+                self._entries[key] = entry
+            entry[2] += 1
+            return entry[1]
+
+    def release(self, backend: EnergyBackend, dirnames: list[str], handle: int) -> None:
+        """
+        Gives back a handle from :meth:`acquire`, closing it if it was the
+        last user.
+        """
+        if not backend.share_handles:
+            backend.close(handle)
+            return
+
+        key = (id(backend), tuple(dirnames))
+        with self._lock:
+            entry = self._entries[key]
+            entry[2] -= 1
+            if entry[2] == 0:
+                del self._entries[key]
+                backend.close(handle)
+
+    def __len__(self) -> int:
+        """
+        The number of open handles.
+        """
+        return len(self._entries)
+
+
+counter_pool = CounterPool()
+
+
 class Energy:
-    def __init__(self, dirnames: list[str]) -> None:
-        self.generator = Energy.current_energy_generator(dirnames)
+    """
+    An open energy counter, read through an :class:`EnergyBackend`. With a
+    native backend, the counter's file descriptors can be handed to
+    ``setstatprofile`` so that sampling never calls back into Python.
 
-    @staticmethod
-    def current_energy_generator(dirnames: list[str]) -> Generator[
-            float, None, None]:
-        rapl_energy_path = os.path.join(RAPL_API_DIR, *dirnames, 'energy_uj')
+    The :data:`ALL_PACKAGES` domain opens the counter of every package, and
+    reads their sum. The :data:`AUTO_PACKAGE` domain does the same for the
+    packages this process may run on.
 
-        if not os.path.exists(rapl_energy_path):
-            raise RuntimeError("Domain not found")
-        with open(rapl_energy_path, 'r') as file:
-            while True:
-                energy = float(file.readline()[:-1]) / 10**6
-                file.seek(0)
-                yield energy
+    The handles of the counters are borrowed from :data:`counter_pool`, so
+    counters of the same domain share them. Call :meth:`close` to give them
+    back.
+
+    Counters wrap around to 0 once they reach their
+    :attr:`RaplDomain.max_energy_range`. Readings are corrected for this, so
+    they only ever increase, as long as the counter is read at least once per
+    wrap.
+    """
+
+    fds: list[int]
+    parts: list[list[str]]
+    last_values: list[int]
+
+    def __init__(self, dirnames: list[str], backend: EnergyBackend | str | None = None) -> None:
+        self.fds = []
+        self.parts = []
+        self.last_values = []
+        self.backend = get_backend(backend)
+        self.domain = dirnames
+        if dirnames == [ALL_PACKAGES]:
+            self.parts = package_domains(self.backend)
+        elif dirnames == [AUTO_PACKAGE]:
+            self.parts = affinity_package_domains(self.backend)
+        else:
+            self.parts = [dirnames]
+
+        topology = self.backend.topology()
+        rapl_domains = [topology.find(part) for part in self.parts]
+        for part in self.parts:
+            self.fds.append(counter_pool.acquire(self.backend, part))
+
+        self.max_ranges = [rapl_domain.max_energy_range for rapl_domain in rapl_domains]
+        self._last_raw_values = [-1] * len(self.parts)
+        self._offsets = [0] * len(self.parts)
+
+    @property
+    def native(self) -> bool:
+        """
+        True if :attr:`fds` are file descriptors that the native sampler and
+        poller can read, see :attr:`EnergyBackend.native`.
+        """
+        return self.backend.native
+
+    @property
+    def is_aggregate(self) -> bool:
+        """
+        True if this counter sums the counters of several packages.
+        """
+        return len(self.parts) > 1
+
+    def read(self) -> list[int]:
+        """
+        Reads the counter of each part of the domain in one batch, returning
+        their values in microjoules. The values are kept in
+        :attr:`last_values`.
+        """
+        return self._accumulate(self.backend.read(self.fds))
 
     def current_energy(self) -> float:
-        return next(self.generator)
+        return sum(self.read()) / 10**6
+
+    def _accumulate(self, raw_values: list[int]) -> list[int]:
+        # the same correction as the C extension's EnergyAccumulator
+        values = []
+        for index, raw_value in enumerate(raw_values):
+            if self.max_ranges[index] > 0 and raw_value < self._last_raw_values[index]:
+                self._offsets[index] += self.max_ranges[index]
+            self._last_raw_values[index] = raw_value
+            values.append(raw_value + self._offsets[index])
+        if self.backend.energy_unit != 1e-6:
+            values = [round(value * self.backend.energy_unit * 10**6) for value in values]
+        self.last_values = values
+        return values
+
+    def column_names(self) -> list[list[str]]:
+        """
+        The names of the domains recorded for this counter in each sample:
+        the domain itself, then each of its parts if it's an aggregate.
+        """
+        names = [domain_names(self.domain, self.backend)]
+        if self.is_aggregate:
+            names += [domain_names(part, self.backend) for part in self.parts]
+        return names
+
+    # pylint: disable=W0212
+    @staticmethod
+    def read_all(counters: list[Energy]) -> list[list[int]]:
+        """
+        Reads several counters, returning the values of each counter's parts
+        in microjoules. Counters of the same backend are read in one batch.
+        """
+        if len({id(counter.backend) for counter in counters}) > 1:
+            return [counter.read() for counter in counters]
+        if not counters:
+            return []
+
+        raw_values = counters[0].backend.read(
+            [fd for counter in counters for fd in counter.fds])
+        readings = []
+        for counter in counters:
+            readings.append(counter._accumulate(raw_values[:len(counter.fds)]))
+            raw_values = raw_values[len(counter.fds):]
+        return readings
+
+    def close(self) -> None:
+        for part, fd in zip(self.parts, self.fds):
+            counter_pool.release(self.backend, part, fd)
+        self.fds = []
+
+    def __del__(self) -> None:
+        self.close()
+
+
+class EnergyPoller:
+    """
+    Reads energy counters from a native background thread, at a fixed rate,
+    into a buffer of timestamped readings. This takes the counter reads off
+    the profiled thread - samples only need a timestamp, and their energy is
+    interpolated from the buffer with :func:`interpolate`.
+    """
+
+    def __init__(self, counters: list[Energy], interval: float = 0.001,
+                 capacity: int = 65536, max_capacity: int = 1048576) -> None:
+        """
+        :param counters: The energy counters to poll.
+        :param interval: The time between each reading, in seconds.
+        :param capacity: The number of readings the buffer starts with room
+            for. It doubles whenever it's full.
+        :param max_capacity: The number of readings the buffer can grow to,
+            about 16 MB per counter by default, or 17 minutes of readings
+            every millisecond. Once it's full, every other reading is
+            dropped and the interval doubles, see :attr:`dropped`. The
+            readings are cumulative, so the energy between the remaining
+            readings is still exact, only at a coarser resolution.
+        """
+        if not all(counter.native for counter in counters):
+            raise ValueError("Energy can only be polled from a native backend, e.g. powercap")
+        self.counters = counters
+        self._poller = energy_poller.EnergyPoller(
+            [fd for counter in counters for fd in counter.fds], interval, capacity,
+            [max_range for counter in counters for max_range in counter.max_ranges],
+            max_capacity)
+
+    def start(self) -> None:
+        self._poller.start()
+
+    def stop(self) -> None:
+        self._poller.stop()
+
+    @property
+    def dropped(self) -> int:
+        """
+        The number of readings that were dropped to downsample the buffer,
+        once it was full.
+        """
+        return self._poller.dropped
+
+    @property
+    def interval(self) -> float:
+        """
+        The time between readings, in seconds. It doubles each time the
+        buffer is downsampled.
+        """
+        return self._poller.interval
+
+    def interpolate(self, timestamps: list[int]) -> list[list[float]]:
+        """
+        Returns the energy, in joules, of each part of each counter (see
+        :attr:`Energy.parts`) at each of ``timestamps``. The poller must be
+        stopped.
+
+        :param timestamps: Sorted ``time.monotonic_ns()`` timestamps.
+        """
+        record_timestamps, record_values = self._poller.records()
+        return [interpolate_energy(record_timestamps, values, timestamps)
+                for values in record_values]
+
+    def interpolate_columns(self, timestamps: list[int]) -> list[list[float]]:
+        """
+        Like :meth:`interpolate`, but returns the values recorded for each
+        sample at each of ``timestamps``, see :func:`energy_columns`.
+        """
+        part_energies = self.interpolate(timestamps)
+        columns = []
+        for index in range(len(timestamps)):
+            readings = []
+            offset = 0
+            for counter in self.counters:
+                readings.append([part_energies[offset + part][index]
+                                 for part in range(len(counter.fds))])
+                offset += len(counter.fds)
+            columns.append(energy_columns(self.counters, readings))
+        return columns
+
+
+def energy_columns(counters: list[Energy], readings: list[list[float]]) -> list[float]:
+    """
+    Lays out readings of the parts of each counter, as returned by
+    :meth:`Energy.read_all`, into the values recorded for each sample: the
+    total of each counter, followed by its parts if it's an aggregate. See
+    :meth:`Energy.column_names`.
+    """
+    columns: list[float] = []
+    for counter, values in zip(counters, readings):
+        columns.append(sum(values))
+        if counter.is_aggregate:
+            columns.extend(values)
+    return columns
+
+
+def interpolate_energy(record_timestamps: list[int], record_values: list[int],
+                       timestamps: list[int]) -> list[float]:
+    """
+    Linearly interpolates the readings of an energy counter, in microjoules,
+    at each of the sorted ``timestamps``, returning joules.
+
+    RAPL only updates its counters about every millisecond, so consecutive
+    readings are often equal. Only the readings where the counter changed are
+    used, so each increment is spread over the time it accumulated in rather
+    than landing all at once.
+    """
+    points: list[tuple[int, int]] = []
+    for timestamp, value in zip(record_timestamps, record_values):
+        if not points or value != points[-1][1]:
+            points.append((timestamp, value))
+    if not points:
+        raise RuntimeError("No energy readings were recorded")
+    if record_timestamps[-1] != points[-1][0]:
+        # keep the end of the buffer, the counter was flat until then
+        points.append((record_timestamps[-1], record_values[-1]))
+
+    energies: list[float] = []
+    index = 0
+    for timestamp in timestamps:
+        while index < len(points) - 1 and points[index + 1][0] <= timestamp:
+            index += 1
+
+        start_time, start_value = points[index]
+        if timestamp <= start_time or index == len(points) - 1:
+            energy = start_value
+        else:
+            end_time, end_value = points[index + 1]
+            energy = start_value + (end_value - start_value) * (
+                (timestamp - start_time) / (end_time - start_time))
+
+        energies.append(energy / 10**6)
+
+    return energies
+
+
+def measure_idle_power(counters: list[Energy],
+                       duration: float = IDLE_CALIBRATION_DURATION) -> list[float]:
+    """
+    Measures the power of each domain recorded for ``counters`` (see
+    :func:`energy_columns`), in watts, while this thread sleeps for
+    ``duration`` seconds. Run it while the machine is otherwise quiet.
+    """
+    start_time = time.monotonic()
+    start_readings = Energy.read_all(counters)
+    time.sleep(duration)
+    readings = Energy.read_all(counters)
+    elapsed = time.monotonic() - start_time
+
+    deltas = [
+        [(value - start_value) / 10**6 for value, start_value in zip(values, start_values)]
+        for values, start_values in zip(readings, start_readings)
+    ]
+    return [column / elapsed for column in energy_columns(counters, deltas)]
+
+
+def idle_power(counters: list[Energy], duration: float = IDLE_CALIBRATION_DURATION,
+               cache_path: str | None = None) -> list[float]:
+    """
+    Returns the idle power of each domain recorded for ``counters``, in
+    watts, see :func:`measure_idle_power`. Measurements of hardware counters
+    are cached per host in ``cache_path`` (by default
+    :data:`IDLE_CALIBRATION_CACHE`), so that only the first run of the day
+    waits for the calibration.
+    """
+    if not all(counter.native for counter in counters):
+        return measure_idle_power(counters, duration)
+
+    cache_path = cache_path or IDLE_CALIBRATION_CACHE
+    key = "|".join(
+        [socket.gethostname(), counters[0].backend.name]
+        + ["/".join(names) for counter in counters for names in counter.column_names()])
+
+    try:
+        with open(cache_path) as file:
+            cache = json.load(file)
+    except (OSError, ValueError):
+        cache = {}
+
+    entry = cache.get(key)
+    if entry and time.time() - entry["time"] < IDLE_CALIBRATION_MAX_AGE:
+        return entry["watts"]
+
+    watts = measure_idle_power(counters, duration)
+    cache[key] = {"time": time.time(), "watts": watts}
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path, "w") as file:
+            json.dump(cache, file, indent=2)
+    except OSError:
+        # e.g. a read-only home directory, the calibration is just redone
+        pass
+    return watts
@@ -0,0 +1,206 @@
+"""
+``joulehunter-energyd``, a helper that publishes the energy counters of the
+machine in a shared memory segment, which any user can read with the
+``energyd`` backend (see :class:`~joulehunter.energy.EnergydBackend`).
+
+Recent kernels only let root read the RAPL counters. Running this helper as
+root lets the profiled program run unprivileged, and reading the segment is
+cheaper than reading the counter files.
+"""
+
+from __future__ import annotations
+
+import json
+import mmap
+import optparse
+import os
+import signal
+import struct
+import tempfile
+import threading
+import time
+from typing import Any
+
+import joulehunter.energy as energy
+
+# pyright: strict
+
+
+class EnergyPublisher:
+    """
+    Reads the counter of every package and component of a backend, and
+    publishes their values in the shared memory segment at ``path``.
+    """
+
+    def __init__(
+        self,
+        path: str | None = None,
+        backend: energy.EnergyBackend | str | None = None,
+        interval: float = 0.001,
+    ) -> None:
+        """
+        :param path: The shared memory segment. Defaults to
+            :data:`~joulehunter.energy.ENERGYD_PATH`.
+        :param backend: The backend to read, see
+            :func:`~joulehunter.energy.get_backend`.
+        :param interval: The time between each update, in seconds. The
+            counters must be read at least once per wraparound.
+        """
+        self.path = path or os.environ.get(energy.ENERGYD_PATH_ENV_VAR) or energy.ENERGYD_PATH
+        self.backend = energy.get_backend(backend)
+        if isinstance(self.backend, energy.EnergydBackend):
+            raise ValueError("joulehunter-energyd can't publish its own counters")
+        self.interval = interval
+
+        self.counters: list[energy.Energy] = []
+        topology: list[dict[str, Any]] = []
+        for package in self.backend.topology().packages:
+            self.counters.append(energy.Energy(list(package.dirnames), self.backend))
+            package_info: dict[str, Any] = {
+                "name": package.name, "index": len(self.counters) - 1, "components": []}
+            for component in package.components:
+                self.counters.append(energy.Energy(list(component.dirnames), self.backend))
+                package_info["components"].append(
+                    {"name": component.name, "index": len(self.counters) - 1})
+            topology.append(package_info)
+
+        topology_json = json.dumps(topology).encode()
+        self._values = struct.Struct(f"={len(self.counters)}Q")
+        values_offset = energy.ENERGYD_HEADER.size
+        topology_offset = values_offset + self._values.size
+        size = topology_offset + len(topology_json)
+
+        # the segment is filled in under a temporary name, so that readers
+        # never see it half written. The name is unpredictable and created
+        # exclusively, as the directory is usually world-writable: another
+        # user could have left a file or a symlink at a predictable one
+        fd, temporary_path = tempfile.mkstemp(
+            prefix=os.path.basename(self.path) + ".", dir=os.path.dirname(self.path) or ".")
+        try:
+            os.fchmod(fd, 0o644)
+            os.ftruncate(fd, size)
+            self._inode = os.fstat(fd).st_ino
+            self._mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        energy.ENERGYD_HEADER.pack_into(
+            self._mmap, 0, energy.ENERGYD_MAGIC, energy.ENERGYD_VERSION, len(self.counters),
+            0, 0, topology_offset, len(topology_json))
+        self._mmap[topology_offset:size] = topology_json
+        self._seq = 0
+        self.publish()
+        try:
+            os.rename(temporary_path, self.path)
+        except OSError:
+            self._mmap.close()
+            os.unlink(temporary_path)
+            raise
+
+    def publish(self) -> None:
+        """
+        Reads the counters, and updates the segment.
+        """
+        values = [reading[0] for reading in energy.Energy.read_all(self.counters)]
+
+        self._seq += 1
+        struct.pack_into("=Q", self._mmap, energy.ENERGYD_SEQ_OFFSET, self._seq)
+        self._values.pack_into(self._mmap, energy.ENERGYD_HEADER.size, *values)
+        struct.pack_into("=Q", self._mmap, energy.ENERGYD_TIMESTAMP_OFFSET, time.monotonic_ns())
+        self._seq += 1
+        struct.pack_into("=Q", self._mmap, energy.ENERGYD_SEQ_OFFSET, self._seq)
+
+    def run(self, stop_event: threading.Event) -> None:
+        """
+        Publishes the counters every :attr:`interval` seconds, until
+        ``stop_event`` is set.
+        """
+        next_time = time.monotonic()
+        while not stop_event.is_set():
+            self.publish()
+            next_time += self.interval
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                stop_event.wait(delay)
+            else:
+                # fell behind, e.g. the machine was suspended
+                next_time = time.monotonic()
+
+    def close(self) -> None:
+        """
+        Removes the segment, unless another helper has replaced it.
+        """
+        try:
+            if os.stat(self.path).st_ino == self._inode:
+                os.unlink(self.path)
+        except OSError:
+            pass
+        self._mmap.close()
+        for counter in self.counters:
+            counter.close()
+
+
+def main():
+    parser = optparse.OptionParser(usage="usage: joulehunter-energyd [options]")
+    parser.add_option(
+        "",
+        "--path",
+        dest="path",
+        action="store",
+        metavar="PATH",
+        help="the shared memory segment to publish the counters in (default "
+             "is %s, or the %s environment variable)" % (
+                 energy.ENERGYD_PATH, energy.ENERGYD_PATH_ENV_VAR),
+    )
+    parser.add_option(
+        "",
+        "--energy-backend",
+        dest="energy_backend",
+        action="store",
+        metavar="NAME",
+        help="the counters to publish, one of: %s (default is powercap, or "
+             "hwmon on machines without it, or the %s environment variable)" % (
+                 ", ".join(name for name in energy.BACKENDS if name != energy.EnergydBackend.name),
+                 energy.BACKEND_ENV_VAR),
+    )
+    parser.add_option(
+        "-i",
+        "--interval",
+        dest="interval",
+        action="store",
+        type="float",
+        default=0.001,
+        help="the time between each update, in seconds - default is 0.001",
+    )
+    options, args = parser.parse_args()
+    if args:
+        parser.error("joulehunter-energyd takes no arguments")
+    if options.energy_backend is not None and options.energy_backend not in energy.BACKENDS:
+        parser.error(
+            "--energy-backend must be one of: %s" % ", ".join(energy.BACKENDS))
+
+    backend = options.energy_backend
+    if backend is None and not os.environ.get(energy.BACKEND_ENV_VAR):
+        # the default backend would be the segment of a previous helper
+        powercap_backend = energy.get_backend(energy.PowercapBackend.name)
+        backend = powercap_backend if os.path.exists(powercap_backend.root) else "hwmon"
+
+    try:
+        publisher = EnergyPublisher(options.path, backend, options.interval)
+    except (ValueError, RuntimeError) as e:
+        parser.error(str(e))
+    stop_event = threading.Event()
+
+    def stop(signum: int, frame: Any):
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        publisher.run(stop_event)
+    finally:
+        publisher.close()
+
+
+if __name__ == "__main__":
+    main()
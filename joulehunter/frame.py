@@ -7,13 +7,24 @@ from typing import Sequence
 
 # pyright: strict
 
+# the quantities that frames can be compared by, see BaseFrame.metric()
+METRICS = ("energy", "time", "power")
+
 
 class BaseFrame:
     group: FrameGroup | None
 
-    def __init__(self, parent: Frame | None = None, self_time: float = 0):
+    def __init__(
+        self,
+        parent: Frame | None = None,
+        self_time: float = 0,
+        self_domain_times: Sequence[float] = (),
+        self_wall_time: float = 0,
+    ):
         self.parent = parent
         self._self_time = self_time
+        self._self_domain_times = tuple(self_domain_times)
+        self._self_wall_time = self_wall_time
         self.group = None
 
     def remove_from_parent(self):
@@ -65,6 +76,43 @@ class BaseFrame:
         self._self_time = self_time
         self._invalidate_time_caches()
 
+    @property
+    def self_domain_times(self) -> tuple[float, ...]:
+        """
+        The self time of this frame in each of the session's energy domains,
+        when more than one domain was recorded. Otherwise, an empty tuple.
+        """
+        return self._self_domain_times
+
+    @self_domain_times.setter
+    def self_domain_times(self, self_domain_times: Sequence[float]):
+        self._self_domain_times = tuple(self_domain_times)
+        self._invalidate_time_caches()
+
+    @property
+    def self_wall_time(self) -> float:
+        """
+        The wall-clock time of the samples of this frame, in seconds.
+        """
+        return self._self_wall_time
+
+    @self_wall_time.setter
+    def self_wall_time(self, self_wall_time: float):
+        self._self_wall_time = self_wall_time
+        self._invalidate_time_caches()
+
+    def add_self_time(
+        self, self_time: float, domain_times: Sequence[float] = (), wall_time: float = 0
+    ):
+        """
+        Adds to the self time of this frame, to its per-domain self times and
+        to its wall-clock time. Processors use this to move the time of a
+        frame they remove to another frame.
+        """
+        self._self_domain_times = add_domain_times(self._self_domain_times, domain_times)
+        self._self_wall_time += wall_time
+        self.self_time += self_time
+
     # invalidates the cache for the time() function.
     # called whenever self_time or _children is modified.
     def _invalidate_time_caches(self):
@@ -83,6 +131,61 @@ class BaseFrame:
     def await_time(self) -> float:
         raise NotImplementedError()
 
+    def domain_times(self) -> tuple[float, ...]:
+        """
+        The time spent in the function in each of the session's energy
+        domains, or an empty tuple if only one domain was recorded.
+        """
+        raise NotImplementedError()
+
+    def wall_time(self) -> float:
+        """
+        Wall-clock time spent in the function, in seconds.
+        """
+        raise NotImplementedError()
+
+    def energy(self) -> float:
+        """
+        Energy consumed in the function, in joules. The same as :meth:`time`.
+        """
+        return self.time()
+
+    def mean_power(self) -> float:
+        """
+        The mean power drawn while in the function, in watts, i.e. its
+        energy over its wall-clock time. Zero if no wall-clock time was
+        recorded, as in sessions saved by older versions.
+        """
+        wall_time = self.wall_time()
+        if not wall_time:
+            return 0.0
+        return self.energy() / wall_time
+
+    def metric(self, metric: str) -> float:
+        """
+        Returns one of :data:`METRICS`: the energy, the wall-clock time or
+        the mean power of the function.
+        """
+        if metric == "energy":
+            return self.energy()
+        elif metric == "time":
+            return self.wall_time()
+        elif metric == "power":
+            return self.mean_power()
+        raise ValueError(f"Unknown metric {metric!r}, expected one of {', '.join(METRICS)}")
+
+    def domain_time(self, domain: int) -> float:
+        """
+        The time spent in the function in the energy domain at index
+        ``domain`` of the session's domains.
+        """
+        domain_times = self.domain_times()
+        if not domain_times:
+            if domain != 0:
+                raise IndexError("this frame has only one energy domain")
+            return self.time()
+        return domain_times[domain]
+
     @property
     def identifier(self) -> str:
         raise NotImplementedError()
@@ -124,6 +227,8 @@ class Frame(BaseFrame):
     _children: list[BaseFrame]
     _time: float | None
     _await_time: float | None
+    _domain_times: tuple[float, ...] | None
+    _wall_time: float | None
     _identifier: str
 
     def __init__(
@@ -132,14 +237,23 @@ class Frame(BaseFrame):
         parent: Frame | None = None,
         children: Sequence[BaseFrame] | None = None,
         self_time: float = 0,
+        self_domain_times: Sequence[float] = (),
+        self_wall_time: float = 0,
     ):
-        super().__init__(parent=parent, self_time=self_time)
+        super().__init__(
+            parent=parent,
+            self_time=self_time,
+            self_domain_times=self_domain_times,
+            self_wall_time=self_wall_time,
+        )
 
         self._identifier = identifier
         self._children = []
 
         self._time = None
         self._await_time = None
+        self._domain_times = None
+        self._wall_time = None
 
         if children:
             for child in children:
@@ -279,16 +393,42 @@ class Frame(BaseFrame):
 
         return self._await_time
 
+    def domain_times(self):
+        if self._domain_times is None:
+            domain_times = self.self_domain_times
+
+            for child in self.children:
+                domain_times = add_domain_times(domain_times, child.domain_times())
+
+            self._domain_times = domain_times
+
+        return self._domain_times
+
+    def wall_time(self):
+        if self._wall_time is None:
+            wall_time = self.self_wall_time
+
+            for child in self.children:
+                wall_time += child.wall_time()
+
+            self._wall_time = wall_time
+
+        return self._wall_time
+
     # pylint: disable=W0212
     def _invalidate_time_caches(self):
         self._time = None
         self._await_time = None
+        self._domain_times = None
+        self._wall_time = None
         # null all the parent's caches also.
         frame = self
         while frame.parent is not None:
             frame = frame.parent
             frame._time = None
             frame._await_time = None
+            frame._domain_times = None
+            frame._wall_time = None
 
     def __repr__(self):
         return "Frame(identifier=%s, time=%f, len(children)=%d), group=%r" % (
@@ -309,6 +449,12 @@ class DummyFrame(BaseFrame):
     def _children(self) -> list[BaseFrame]:
         return []
 
+    def domain_times(self):
+        return self.self_domain_times
+
+    def wall_time(self):
+        return self.self_wall_time
+
     @property
     def children(self) -> list[BaseFrame]:
         return []
@@ -400,6 +546,18 @@ class OutOfContextFrame(DummyFrame):
 OUT_OF_CONTEXT_FRAME_IDENTIFIER = "[out-of-context]\x00<out-of-context>\x000"
 
 
+def add_domain_times(a: Sequence[float], b: Sequence[float]) -> tuple[float, ...]:
+    """
+    Adds two per-domain time vectors. An empty vector means there's no
+    per-domain information, and is treated as zeros.
+    """
+    if not a:
+        return tuple(b)
+    if not b:
+        return tuple(a)
+    return tuple(x + y for x, y in zip(a, b))
+
+
 class FrameGroup:
     _libraries: list[str] | None
     _frames: list[BaseFrame]
@@ -0,0 +1,82 @@
+#ifndef JOULEHUNTER_ENERGY_COUNTER_H
+#define JOULEHUNTER_ENERGY_COUNTER_H
+
+/*
+Energy counters are exposed by the kernel (e.g. powercap's energy_uj) as a
+file containing an ASCII integer. We read them with pread so that no seek or
+buffering is needed, and parse the integer directly.
+
+This doesn't touch any Python state, so it's safe to call without the GIL.
+*/
+
+#if !defined(MS_WINDOWS)
+
+#include <errno.h>
+#include <unistd.h>
+
+/**
+ * Reads the integer counter at the start of the file `fd` into `value`.
+ * Returns 0 on success, or an errno value on failure (EINVAL if the file
+ * doesn't start with an integer).
+ */
+static int
+energy_counter_read(int fd, long long *value)
+{
+    char buf[32];
+    ssize_t size = pread(fd, buf, sizeof(buf), 0);
+
+    if (size < 0) {
+        return errno;
+    }
+
+    long long result = 0;
+    ssize_t i;
+    for (i = 0; i < size && buf[i] >= '0' && buf[i] <= '9'; i++) {
+        result = result * 10 + (buf[i] - '0');
+    }
+
+    if (i == 0) {
+        return EINVAL;
+    }
+
+    *value = result;
+    return 0;
+}
+
+/*
+RAPL counters wrap around to 0 once they reach their max_energy_range_uj, which
+on a busy package happens every few minutes. An accumulator turns the readings
+of one counter into a monotonic value, by adding the range every time the
+counter goes backwards.
+*/
+
+typedef struct energy_accumulator {
+    long long max_range;  // the counter's max_energy_range_uj, or 0 if unknown
+    long long last_value;  // the last reading, or -1 before the first one
+    long long offset;      // the total of the ranges added for wraps so far
+} EnergyAccumulator;
+
+static void
+energy_accumulator_init(EnergyAccumulator *accumulator, long long max_range)
+{
+    accumulator->max_range = max_range;
+    accumulator->last_value = -1;
+    accumulator->offset = 0;
+}
+
+/**
+ * Returns the monotonic value of a counter, given its latest reading.
+ */
+static long long
+energy_accumulator_add(EnergyAccumulator *accumulator, long long value)
+{
+    if (accumulator->max_range > 0 && value < accumulator->last_value) {
+        accumulator->offset += accumulator->max_range;
+    }
+    accumulator->last_value = value;
+    return value + accumulator->offset;
+}
+
+#endif  /* !MS_WINDOWS */
+
+#endif  /* JOULEHUNTER_ENERGY_COUNTER_H */
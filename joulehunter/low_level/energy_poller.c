@@ -0,0 +1,463 @@
+#include <Python.h>
+
+#include "energy_counter.h"
+
+/*
+A background thread that reads energy counters at a fixed rate into a
+buffer of (timestamp, counter values) records. The buffer doubles whenever
+it's full, up to max_capacity records. Past that (or if memory runs out),
+every other record is dropped and the polling interval doubles, so memory
+stays bounded however long the poller runs. The values are cumulative, so
+the energy between any two remaining records is still exact, only at a
+coarser resolution.
+
+The thread is a native thread that never takes the GIL, so polling doesn't
+compete with the profiled program. Timestamps are CLOCK_MONOTONIC
+nanoseconds, the same clock as Python's time.monotonic_ns(). Values are
+accumulated across wraparounds of the counters, so they only ever increase.
+*/
+
+#if !defined(MS_WINDOWS)
+
+#include <pthread.h>
+#include <stdint.h>
+#include <time.h>
+
+//////////////////
+// EnergyPoller //
+//////////////////
+
+typedef struct energy_poller {
+    PyObject_HEAD
+    int *fds;
+    EnergyAccumulator *accumulators;  // fd_count
+    Py_ssize_t fd_count;
+    int64_t interval_ns;  // doubles each time the buffer is downsampled
+    Py_ssize_t capacity;
+    Py_ssize_t max_capacity;
+    int64_t *timestamps;  // capacity
+    int64_t *values;      // capacity * fd_count
+    int growable;  // cleared once the buffer can't grow any more
+    Py_ssize_t record_count;
+    Py_ssize_t dropped;  // records dropped by downsampling
+    int error;
+    int running;
+    int stop_requested;
+    pthread_t thread;
+} EnergyPoller;
+
+static int64_t monotonic_ns(void) {
+    struct timespec t;
+    clock_gettime(CLOCK_MONOTONIC, &t);
+    return (int64_t)t.tv_sec * 1000000000 + t.tv_nsec;
+}
+
+/**
+ * Doubles the capacity of the buffer, up to max_capacity. Runs without the
+ * GIL, so the buffer is allocated with the raw allocator. Returns 0 if the
+ * buffer couldn't grow.
+ */
+static int EnergyPoller_Grow(EnergyPoller *self) {
+    if (self->capacity >= self->max_capacity) {
+        return 0;
+    }
+    Py_ssize_t capacity = self->capacity * 2;
+    if (capacity > self->max_capacity) {
+        capacity = self->max_capacity;
+    }
+    if (capacity > PY_SSIZE_T_MAX / (Py_ssize_t)sizeof(int64_t) / self->fd_count) {
+        return 0;
+    }
+
+    int64_t *timestamps = PyMem_RawRealloc(self->timestamps, capacity * sizeof(int64_t));
+    if (!timestamps) {
+        return 0;
+    }
+    self->timestamps = timestamps;
+
+    int64_t *values = PyMem_RawRealloc(self->values, capacity * self->fd_count * sizeof(int64_t));
+    if (!values) {
+        return 0;
+    }
+    self->values = values;
+
+    __atomic_store_n(&self->capacity, capacity, __ATOMIC_RELEASE);
+    return 1;
+}
+
+/**
+ * Makes room in a full buffer that can't grow, by keeping every other
+ * record, from the first, and polling half as often from then on.
+ */
+static void EnergyPoller_Downsample(EnergyPoller *self) {
+    Py_ssize_t kept = 0;
+    for (Py_ssize_t r = 0; r < self->record_count; r += 2, kept++) {
+        self->timestamps[kept] = self->timestamps[r];
+        memmove(self->values + kept * self->fd_count, self->values + r * self->fd_count,
+                self->fd_count * sizeof(int64_t));
+    }
+
+    __atomic_store_n(&self->dropped, self->dropped + self->record_count - kept, __ATOMIC_RELEASE);
+    __atomic_store_n(&self->record_count, kept, __ATOMIC_RELEASE);
+    __atomic_store_n(&self->interval_ns, self->interval_ns * 2, __ATOMIC_RELEASE);
+}
+
+/**
+ * Reads every counter into the next slot of the buffer. Returns 0 on
+ * success, or an errno value.
+ */
+static int EnergyPoller_Poll(EnergyPoller *self) {
+    if (self->record_count == self->capacity) {
+        if (self->growable && !EnergyPoller_Grow(self)) {
+            self->growable = 0;
+        }
+        if (!self->growable) {
+            EnergyPoller_Downsample(self);
+        }
+    }
+    Py_ssize_t record_count = self->record_count;
+    int64_t *values = self->values + record_count * self->fd_count;
+
+    self->timestamps[record_count] = monotonic_ns();
+
+    for (Py_ssize_t i = 0; i < self->fd_count; i++) {
+        long long value = 0;
+        int error = energy_counter_read(self->fds[i], &value);
+        if (error) {
+            return error;
+        }
+        values[i] = energy_accumulator_add(&self->accumulators[i], value);
+    }
+
+    // publish the record only once it's complete
+    __atomic_store_n(&self->record_count, record_count + 1, __ATOMIC_RELEASE);
+    return 0;
+}
+
+static void *EnergyPoller_Run(void *arg) {
+    EnergyPoller *self = (EnergyPoller *)arg;
+    int64_t next_ns = monotonic_ns();
+
+    while (!__atomic_load_n(&self->stop_requested, __ATOMIC_ACQUIRE)) {
+        int error = EnergyPoller_Poll(self);
+        if (error) {
+            self->error = error;
+            break;
+        }
+
+        // sleep until the next tick. Ticks that were missed are skipped
+        // rather than polled in a burst.
+        next_ns += __atomic_load_n(&self->interval_ns, __ATOMIC_ACQUIRE);
+        int64_t sleep_ns = next_ns - monotonic_ns();
+        if (sleep_ns <= 0) {
+            next_ns -= sleep_ns;
+            continue;
+        }
+
+        struct timespec remaining = {sleep_ns / 1000000000, sleep_ns % 1000000000};
+        while (nanosleep(&remaining, &remaining) == -1 && errno == EINTR) {}
+    }
+
+    return NULL;
+}
+
+static void EnergyPoller_Join(EnergyPoller *self) {
+    if (!self->running) {
+        return;
+    }
+
+    __atomic_store_n(&self->stop_requested, 1, __ATOMIC_RELEASE);
+
+    Py_BEGIN_ALLOW_THREADS
+    pthread_join(self->thread, NULL);
+    Py_END_ALLOW_THREADS
+
+    self->running = 0;
+}
+
+static int EnergyPoller_Init(EnergyPoller *self, PyObject *args, PyObject *kwds) {
+    static char *kwlist[] = {"fds", "interval", "capacity", "max_ranges", "max_capacity", NULL};
+    PyObject *fds = NULL;
+    double interval = 0.001;
+    Py_ssize_t capacity = 65536;
+    PyObject *max_ranges = NULL;
+    Py_ssize_t max_capacity = 1048576;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|dnOn", kwlist, &fds, &interval, &capacity, &max_ranges, &max_capacity))
+        return -1;
+
+    if (self->fds) {
+        PyErr_SetString(PyExc_RuntimeError, "EnergyPoller is already initialised");
+        return -1;
+    }
+
+    if (interval <= 0) {
+        PyErr_SetString(PyExc_ValueError, "interval must be positive");
+        return -1;
+    }
+
+    if (capacity < 2) {
+        PyErr_SetString(PyExc_ValueError, "capacity must be at least 2");
+        return -1;
+    }
+
+    if (max_capacity < capacity) {
+        PyErr_SetString(PyExc_ValueError, "max_capacity must be at least capacity");
+        return -1;
+    }
+
+    PyObject *fds_seq = PySequence_Fast(fds, "fds must be a sequence of file descriptors");
+    if (fds_seq == NULL) {
+        return -1;
+    }
+
+    Py_ssize_t fd_count = PySequence_Fast_GET_SIZE(fds_seq);
+    if (fd_count == 0) {
+        Py_DECREF(fds_seq);
+        PyErr_SetString(PyExc_ValueError, "fds must not be empty");
+        return -1;
+    }
+
+    PyObject *max_ranges_seq = NULL;
+    if (max_ranges && max_ranges != Py_None) {
+        max_ranges_seq = PySequence_Fast(max_ranges, "max_ranges must be a sequence of integers");
+        if (max_ranges_seq == NULL) {
+            Py_DECREF(fds_seq);
+            return -1;
+        }
+        if (PySequence_Fast_GET_SIZE(max_ranges_seq) != fd_count) {
+            Py_DECREF(fds_seq);
+            Py_DECREF(max_ranges_seq);
+            PyErr_SetString(PyExc_ValueError, "max_ranges must have one range per fd");
+            return -1;
+        }
+    }
+
+    self->fds = PyMem_New(int, fd_count);
+    self->accumulators = PyMem_New(EnergyAccumulator, fd_count);
+    self->timestamps = PyMem_RawMalloc(capacity * sizeof(int64_t));
+    self->values = PyMem_RawMalloc(capacity * fd_count * sizeof(int64_t));
+    if (!self->fds || !self->accumulators || !self->timestamps || !self->values) {
+        Py_XDECREF(max_ranges_seq);
+        Py_DECREF(fds_seq);
+        PyErr_NoMemory();
+        return -1;
+    }
+
+    for (Py_ssize_t i = 0; i < fd_count; i++) {
+        int fd = _PyLong_AsInt(PySequence_Fast_GET_ITEM(fds_seq, i));
+        if (fd == -1 && PyErr_Occurred()) {
+            Py_DECREF(fds_seq);
+            Py_XDECREF(max_ranges_seq);
+            return -1;
+        }
+        self->fds[i] = fd;
+
+        long long max_range = 0;
+        if (max_ranges_seq) {
+            max_range = PyLong_AsLongLong(PySequence_Fast_GET_ITEM(max_ranges_seq, i));
+            if (max_range == -1 && PyErr_Occurred()) {
+                Py_DECREF(fds_seq);
+                Py_DECREF(max_ranges_seq);
+                return -1;
+            }
+        }
+        energy_accumulator_init(&self->accumulators[i], max_range);
+    }
+    Py_DECREF(fds_seq);
+    Py_XDECREF(max_ranges_seq);
+
+    self->fd_count = fd_count;
+    self->interval_ns = (int64_t)(interval * 1e9);
+    self->capacity = capacity;
+    self->max_capacity = max_capacity;
+    self->growable = 1;
+    return 0;
+}
+
+static PyObject *EnergyPoller_Start(EnergyPoller *self, PyObject *noargs) {
+    if (self->running) {
+        PyErr_SetString(PyExc_RuntimeError, "EnergyPoller is already running");
+        return NULL;
+    }
+
+    // take the first reading on this thread, so that errors are raised here
+    int error = EnergyPoller_Poll(self);
+    if (error) {
+        errno = error;
+        return PyErr_SetFromErrno(PyExc_OSError);
+    }
+
+    self->error = 0;
+    self->stop_requested = 0;
+
+    error = pthread_create(&self->thread, NULL, EnergyPoller_Run, self);
+    if (error) {
+        errno = error;
+        return PyErr_SetFromErrno(PyExc_OSError);
+    }
+
+    self->running = 1;
+    Py_RETURN_NONE;
+}
+
+static PyObject *EnergyPoller_Stop(EnergyPoller *self, PyObject *noargs) {
+    EnergyPoller_Join(self);
+
+    // take a last reading, so that samples up to now can be interpolated
+    int error = self->error ? self->error : EnergyPoller_Poll(self);
+    if (error) {
+        errno = error;
+        return PyErr_SetFromErrno(PyExc_OSError);
+    }
+
+    Py_RETURN_NONE;
+}
+
+/**
+ * Returns the records currently in the buffer, oldest first, as a tuple of
+ * (timestamps, values), where values has one list per counter.
+ */
+static PyObject *EnergyPoller_Records(EnergyPoller *self, PyObject *noargs) {
+    if (self->running) {
+        PyErr_SetString(PyExc_RuntimeError, "EnergyPoller must be stopped to read its records");
+        return NULL;
+    }
+
+    Py_ssize_t size = self->record_count;
+
+    PyObject *timestamps = PyList_New(size);
+    PyObject *values = PyList_New(self->fd_count);
+    if (!timestamps || !values) {
+        goto error;
+    }
+
+    for (Py_ssize_t i = 0; i < self->fd_count; i++) {
+        PyObject *counter_values = PyList_New(size);
+        if (!counter_values) {
+            goto error;
+        }
+        PyList_SET_ITEM(values, i, counter_values);
+    }
+
+    for (Py_ssize_t r = 0; r < size; r++) {
+        PyObject *timestamp = PyLong_FromLongLong(self->timestamps[r]);
+        if (!timestamp) {
+            goto error;
+        }
+        PyList_SET_ITEM(timestamps, r, timestamp);
+
+        for (Py_ssize_t i = 0; i < self->fd_count; i++) {
+            PyObject *value = PyLong_FromLongLong(self->values[r * self->fd_count + i]);
+            if (!value) {
+                goto error;
+            }
+            PyList_SET_ITEM(PyList_GET_ITEM(values, i), r, value);
+        }
+    }
+
+    PyObject *result = PyTuple_Pack(2, timestamps, values);
+    Py_DECREF(timestamps);
+    Py_DECREF(values);
+    return result;
+
+error:
+    Py_XDECREF(timestamps);
+    Py_XDECREF(values);
+    return NULL;
+}
+
+static PyObject *EnergyPoller_GetDropped(EnergyPoller *self, void *closure) {
+    return PyLong_FromSsize_t(__atomic_load_n(&self->dropped, __ATOMIC_ACQUIRE));
+}
+
+static PyObject *EnergyPoller_GetInterval(EnergyPoller *self, void *closure) {
+    return PyFloat_FromDouble(__atomic_load_n(&self->interval_ns, __ATOMIC_ACQUIRE) / 1e9);
+}
+
+static void EnergyPoller_Dealloc(EnergyPoller *self) {
+    EnergyPoller_Join(self);
+    PyMem_Free(self->fds);
+    PyMem_Free(self->accumulators);
+    PyMem_RawFree(self->timestamps);
+    PyMem_RawFree(self->values);
+    Py_TYPE(self)->tp_free((PyObject *)self);
+}
+
+static PyMethodDef EnergyPoller_methods[] = {
+    {"start", (PyCFunction)EnergyPoller_Start, METH_NOARGS,
+     "Starts polling the counters from a background thread."},
+    {"stop", (PyCFunction)EnergyPoller_Stop, METH_NOARGS,
+     "Stops the background thread, and takes a final reading."},
+    {"records", (PyCFunction)EnergyPoller_Records, METH_NOARGS,
+     "Returns (timestamps, values) for the records in the buffer, oldest first. values "
+     "contains one list per counter."},
+    {NULL}  /* Sentinel */
+};
+
+static PyGetSetDef EnergyPoller_getset[] = {
+    {"dropped", (getter)EnergyPoller_GetDropped, NULL,
+     "The number of records that were dropped to downsample the buffer once it was full.",
+     NULL},
+    {"interval", (getter)EnergyPoller_GetInterval, NULL,
+     "The current time between readings, in seconds. It doubles each time the buffer is "
+     "downsampled.", NULL},
+    {NULL}  /* Sentinel */
+};
+
+static PyTypeObject EnergyPoller_Type = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    .tp_name = "joulehunter.low_level.energy_poller.EnergyPoller",
+    .tp_basicsize = sizeof(EnergyPoller),
+    .tp_dealloc = (destructor)EnergyPoller_Dealloc,
+    .tp_flags = Py_TPFLAGS_DEFAULT,
+    .tp_doc = "EnergyPoller(fds, interval=0.001, capacity=65536, max_ranges=None, "
+              "max_capacity=1048576)\n\n"
+              "Reads the energy counters open at fds every <interval> seconds from a "
+              "background thread. The buffer starts with room for <capacity> readings, and "
+              "grows as needed up to <max_capacity>, after which every other reading is "
+              "dropped and the interval doubles. max_ranges gives the value at which each "
+              "counter wraps around to 0.",
+    .tp_methods = EnergyPoller_methods,
+    .tp_getset = EnergyPoller_getset,
+    .tp_init = (initproc)EnergyPoller_Init,
+    .tp_new = PyType_GenericNew,
+};
+
+#endif  /* !MS_WINDOWS */
+
+///////////////////////////
+// Module initialization //
+///////////////////////////
+
+PyMODINIT_FUNC PyInit_energy_poller(void)
+{
+    static struct PyModuleDef moduledef = {
+        PyModuleDef_HEAD_INIT,
+        "energy_poller",
+        "Module that polls energy counters from a native background thread",
+        -1,
+        NULL
+    };
+
+    PyObject *module = PyModule_Create(&moduledef);
+    if (module == NULL) {
+        return NULL;
+    }
+
+#if !defined(MS_WINDOWS)
+    if (PyType_Ready(&EnergyPoller_Type) < 0) {
+        Py_DECREF(module);
+        return NULL;
+    }
+
+    Py_INCREF(&EnergyPoller_Type);
+    if (PyModule_AddObject(module, "EnergyPoller", (PyObject *)&EnergyPoller_Type) < 0) {
+        Py_DECREF(&EnergyPoller_Type);
+        Py_DECREF(module);
+        return NULL;
+    }
+#endif
+
+    return module;
+}
@@ -2,6 +2,8 @@
 #include <structmember.h>
 #include <frameobject.h>
 
+#include "energy_counter.h"
+
 ////////////////////////////
 // Version/Platform shims //
 ////////////////////////////
@@ -48,6 +50,10 @@ floatclock(void)
 #else  /* !MS_WINDOWS */
 
 #include <sys/time.h>
+#include <errno.h>
+#include <fcntl.h>
+#include <time.h>
+#include <unistd.h>
 
 static double
 floatclock(void)
@@ -60,10 +66,127 @@ floatclock(void)
 
 #endif  /* MS_WINDOWS */
 
+/*
+A monotonic clock, that isn't stepped when the system time is set, e.g. by
+NTP. Falls back to floatclock where it isn't available.
+*/
+
+#if defined(CLOCK_MONOTONIC)
+
+static double
+monoclock(void)
+{
+    struct timespec t;
+    if (clock_gettime(CLOCK_MONOTONIC, &t) != 0) {
+        return floatclock();
+    }
+    return (double)t.tv_sec + t.tv_nsec*0.000000001;
+}
+
+#else
+
+static double
+monoclock(void)
+{
+    return floatclock();
+}
+
+#endif
+
+/*
+A cheap monotonic clock, that trades resolution (typically 1-4ms) for speed.
+Falls back to monoclock where it isn't available.
+*/
+
+#if defined(CLOCK_MONOTONIC_COARSE)
+
+static double
+coarseclock(void)
+{
+    struct timespec t;
+    if (clock_gettime(CLOCK_MONOTONIC_COARSE, &t) != 0) {
+        return monoclock();
+    }
+    return (double)t.tv_sec + t.tv_nsec*0.000000001;
+}
+
+static double
+coarseclock_resolution(void)
+{
+    struct timespec t;
+    if (clock_getres(CLOCK_MONOTONIC_COARSE, &t) != 0) {
+        return 0.0;
+    }
+    return (double)t.tv_sec + t.tv_nsec*0.000000001;
+}
+
+#else
+
+static double
+coarseclock(void)
+{
+    return monoclock();
+}
+
+static double
+coarseclock_resolution(void)
+{
+    return 0.0;
+}
+
+#endif
+
+/**
+ * Reads the integer counter at the start of the file `fd`. On error, sets an
+ * exception and returns -1.
+ */
+static long long
+read_counter_fd(int fd)
+{
+#if defined(MS_WINDOWS)
+    PyErr_SetString(PyExc_NotImplementedError, "energy counters are not supported on Windows");
+    return -1;
+#else
+    long long value = 0;
+    int error = energy_counter_read(fd, &value);
+
+    if (error == EINVAL) {
+        PyErr_SetString(PyExc_ValueError, "energy counter does not contain an integer");
+        return -1;
+    } else if (error) {
+        errno = error;
+        PyErr_SetFromErrno(PyExc_OSError);
+        return -1;
+    }
+
+    return value;
+#endif
+}
+
 ///////////////////
 // ProfilerState //
 ///////////////////
 
+// the most counters that can be summed into one energy reading, e.g. one per
+// package of the machine
+#define MAX_ENERGY_COUNTERS 64
+
+// a sample held in the sample buffer, until it's sent in a batch
+typedef struct buffered_sample {
+    PyObject *call_stack;
+    // the energy (or time, without an energy counter) and the wall-clock
+    // time since the previous sample
+    double value;
+    double wall_time;
+} BufferedSample;
+
+// the clock used when no timer_func is given
+typedef enum {
+    TIMER_WALLTIME,
+    TIMER_WALLTIME_COARSE,
+    TIMER_MONOTONIC,
+} TimerType;
+
 typedef struct profiler_state {
     PyObject_HEAD
     PyObject *target;
@@ -73,6 +196,26 @@ typedef struct profiler_state {
     PyObject *last_context_var_value;
     PyObject *await_stack_list;
     PyObject *timer_func;
+    TimerType timer_type;
+    int energy_fds[MAX_ENERGY_COUNTERS];
+#if !defined(MS_WINDOWS)
+    EnergyAccumulator energy_accumulators[MAX_ENERGY_COUNTERS];
+#endif
+    int energy_fd_count;
+    int owns_energy_fds;
+    double energy_interval;
+    double last_energy;
+    int sync_locals;
+    // with a sample buffer, the call stack of each sample is built
+    // natively by call_stack_builder, and the samples are sent to the
+    // target in batches, see ProfilerState_FlushSamples
+    PyObject *call_stack_builder;
+    BufferedSample *samples;
+    Py_ssize_t sample_buffer_size;
+    Py_ssize_t sample_count;
+    double last_sample_value;
+    double last_sample_wall_time;
+    int flushing;
 } ProfilerState;
 
 static void ProfilerState_SetTarget(ProfilerState *self, PyObject *target) {
@@ -129,18 +272,56 @@ static double ProfilerState_GetTime(ProfilerState *self) {
 
         Py_DECREF(result);
         return resultDouble;
+    } else if (self->timer_type == TIMER_WALLTIME_COARSE) {
+        return coarseclock();
+    } else if (self->timer_type == TIMER_MONOTONIC) {
+        return monoclock();
     } else {
         // otherwise as normal, call the C timer function.
         return floatclock();
     }
 }
 
+/**
+ * Returns the energy counter reading in joules. On error, returns -1.0.
+ */
+static double ProfilerState_GetEnergy(ProfilerState *self) {
+#if defined(MS_WINDOWS)
+    PyErr_SetString(PyExc_NotImplementedError, "energy counters are not supported on Windows");
+    return -1.0;
+#else
+    // read the energy counters natively, converting microjoules to joules
+    long long energy_uj = 0;
+    for (int i = 0; i < self->energy_fd_count; i++) {
+        long long counter_uj = read_counter_fd(self->energy_fds[i]);
+        if (counter_uj == -1) {
+            return -1.0;
+        }
+        energy_uj += energy_accumulator_add(&self->energy_accumulators[i], counter_uj);
+    }
+    return (double)energy_uj / 1e6;
+#endif
+}
+
 static void ProfilerState_Dealloc(ProfilerState *self) {
+    // samples that weren't flushed are dropped
+    for (Py_ssize_t i = 0; i < self->sample_count; i++) {
+        Py_DECREF(self->samples[i].call_stack);
+    }
+    PyMem_Free(self->samples);
+    Py_XDECREF(self->call_stack_builder);
     ProfilerState_SetTarget(self, NULL);
     Py_XDECREF(self->context_var);
     Py_XDECREF(self->last_context_var_value);
     Py_XDECREF(self->await_stack_list);
     Py_XDECREF(self->timer_func);
+#if !defined(MS_WINDOWS)
+    if (self->owns_energy_fds) {
+        for (int i = 0; i < self->energy_fd_count; i++) {
+            close(self->energy_fds[i]);
+        }
+    }
+#endif
     Py_TYPE(self)->tp_free(self);
 }
 
@@ -195,6 +376,19 @@ static ProfilerState *ProfilerState_New(void) {
     op->last_context_var_value = NULL;
     op->await_stack_list = PyList_New(0);
     op->timer_func = NULL;
+    op->timer_type = TIMER_WALLTIME;
+    op->energy_fd_count = 0;
+    op->owns_energy_fds = 0;
+    op->energy_interval = 0.0;
+    op->last_energy = 0.0;
+    op->sync_locals = 0;
+    op->call_stack_builder = NULL;
+    op->samples = NULL;
+    op->sample_buffer_size = 0;
+    op->sample_count = 0;
+    op->last_sample_value = 0.0;
+    op->last_sample_wall_time = 0.0;
+    op->flushing = 0;
     return op;
 }
 
@@ -202,7 +396,7 @@ static ProfilerState *ProfilerState_New(void) {
 // Internal functions //
 ////////////////////////
 
-static PyObject *whatstrings[8] = {NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL};
+static PyObject *whatstrings[9] = {NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL, NULL};
 
 #define WHAT_CALL 0
 #define WHAT_EXCEPTION 1
@@ -212,16 +406,17 @@ static PyObject *whatstrings[8] = {NULL, NULL, NULL, NULL, NULL, NULL, NULL, NUL
 #define WHAT_C_EXCEPTION 5
 #define WHAT_C_RETURN 6
 #define WHAT_CONTEXT_CHANGED 7
+#define WHAT_SAMPLES 8
 
 static int
 trace_init(void)
 {
-    static char *whatnames[8] = {"call", "exception", "line", "return",
+    static char *whatnames[9] = {"call", "exception", "line", "return",
                                  "c_call", "c_exception", "c_return",
-                                 "context_changed"};
+                                 "context_changed", "samples"};
     PyObject *name;
     int i;
-    for (i = 0; i < 8; ++i) {
+    for (i = 0; i < 9; ++i) {
         if (whatstrings[i] == NULL) {
             name = PyUnicode_InternFromString(whatnames[i]);
             if (name == NULL)
@@ -232,10 +427,19 @@ trace_init(void)
     return 0;
 }
 
+static int
+profile(PyObject *op, PyFrameObject *frame, int what, PyObject *arg);
+
 static PyObject *
 call_target(ProfilerState *pState, PyFrameObject *frame, int what, PyObject *arg)
 {
-    PyFrame_FastToLocals(frame);
+    // copying the fast locals into f_locals and back costs about as much
+    // as the rest of the call on functions with many locals. The target
+    // still sees them through frame.f_locals, which copies them on access,
+    // so this is only needed for targets that write to f_locals.
+    if (pState->sync_locals) {
+        PyFrame_FastToLocals(frame);
+    }
 
 #if PY_VERSION_HEX >= 0x03090000
     // vectorcall implemention could be faster, is available in Python 3.9
@@ -245,9 +449,11 @@ call_target(ProfilerState *pState, PyFrameObject *frame, int what, PyObject *arg
     PyObject *result = PyObject_CallFunctionObjArgs(pState->target, (PyObject *) frame, whatstrings[what], arg == NULL ? Py_None : arg, NULL);
 #endif
 
-    PyFrame_LocalsToFast(frame, 1);
+    if (pState->sync_locals) {
+        PyFrame_LocalsToFast(frame, 1);
+    }
 
-    if (result == NULL)
+    if (result == NULL && frame != NULL)
         PyTraceBack_Here(frame);
 
     return result;
@@ -266,6 +472,483 @@ code_from_frame(PyFrameObject* frame)
 
 }
 
+//////////////////////
+// Code identifiers //
+//////////////////////
+
+/*
+The identifier of each code object seen in a sample, e.g.
+"f\0path/to/file.py\01", in an open-addressing hash table keyed by the code
+object's address. The table holds a reference to each code object, so an
+address can't be reused by another one while it's in the table. It's emptied
+when it fills up, in case the program keeps compiling new code. Only accessed
+with the GIL held.
+*/
+
+#define CODE_IDENTIFIERS_SIZE 16384
+
+typedef struct code_identifier_entry {
+    PyObject *code;
+    PyObject *identifier;
+} CodeIdentifierEntry;
+
+static CodeIdentifierEntry code_identifiers[CODE_IDENTIFIERS_SIZE];
+static Py_ssize_t code_identifiers_count = 0;
+
+static void
+code_identifiers_clear(void)
+{
+    for (Py_ssize_t i = 0; i < CODE_IDENTIFIERS_SIZE; i++) {
+        Py_CLEAR(code_identifiers[i].code);
+        Py_CLEAR(code_identifiers[i].identifier);
+    }
+    code_identifiers_count = 0;
+}
+
+/**
+ * Returns a new reference to the interned identifier of `code`. On error,
+ * sets an exception and returns NULL.
+ */
+static PyObject *
+code_identifier(PyCodeObject *code)
+{
+    size_t hash = ((size_t)code >> 4) * 2654435761u;
+    size_t index = hash & (CODE_IDENTIFIERS_SIZE - 1);
+
+    while (code_identifiers[index].code != NULL) {
+        if (code_identifiers[index].code == (PyObject *)code) {
+            Py_INCREF(code_identifiers[index].identifier);
+            return code_identifiers[index].identifier;
+        }
+        index = (index + 1) & (CODE_IDENTIFIERS_SIZE - 1);
+    }
+
+    PyObject *identifier = PyUnicode_FromFormat(
+        "%U%c%U%c%i",
+        code->co_name,
+        0, // NULL char
+        code->co_filename,
+        0, // NULL char
+        code->co_firstlineno
+    );
+    if (identifier == NULL) {
+        return NULL;
+    }
+    PyUnicode_InternInPlace(&identifier);
+
+    if (code_identifiers_count >= CODE_IDENTIFIERS_SIZE * 3 / 4) {
+        code_identifiers_clear();
+        index = hash & (CODE_IDENTIFIERS_SIZE - 1);
+    }
+    Py_INCREF(code);
+    Py_INCREF(identifier);
+    code_identifiers[index].code = (PyObject *)code;
+    code_identifiers[index].identifier = identifier;
+    code_identifiers_count++;
+
+    return identifier;
+}
+
+//////////////////////
+// CallStackBuilder //
+//////////////////////
+
+/*
+Builds the call stacks of one thread, as lists of frame identifiers that
+start at the thread's root identifier. The frames of the previous stack are
+remembered, by address and code object at each depth, so the part of the
+stack shared with the previous sample reuses its identifiers, and only the
+frames below it are looked up.
+*/
+
+typedef struct call_stack_builder {
+    PyObject_HEAD
+    PyObject *root_identifier;
+    // the previous stack, root first. The frames aren't referenced, but
+    // the code objects are, so a frame whose address was reused for other
+    // code doesn't match
+    PyFrameObject **last_frames;
+    PyObject **last_codes;
+    PyObject **last_identifiers;
+    Py_ssize_t last_depth;
+    // scratch space for walking the frames, with the same capacity
+    PyFrameObject **frames;
+    Py_ssize_t capacity;
+} CallStackBuilder;
+
+static void
+CallStackBuilder_Truncate(CallStackBuilder *self, Py_ssize_t depth)
+{
+    for (Py_ssize_t i = depth; i < self->last_depth; i++) {
+        Py_CLEAR(self->last_codes[i]);
+        Py_CLEAR(self->last_identifiers[i]);
+    }
+    if (depth < self->last_depth) {
+        self->last_depth = depth;
+    }
+}
+
+/**
+ * Makes room for stacks of `depth` frames. Returns true on success, sets an
+ * exception and returns false on failure.
+ */
+static int
+CallStackBuilder_Reserve(CallStackBuilder *self, Py_ssize_t depth)
+{
+    if (depth <= self->capacity) {
+        return 1;
+    }
+
+    Py_ssize_t capacity = self->capacity ? self->capacity : 64;
+    while (capacity < depth) {
+        capacity *= 2;
+    }
+
+    PyFrameObject **last_frames = PyMem_Realloc(self->last_frames, capacity * sizeof(PyFrameObject *));
+    if (last_frames == NULL) goto error;
+    self->last_frames = last_frames;
+    PyObject **last_codes = PyMem_Realloc(self->last_codes, capacity * sizeof(PyObject *));
+    if (last_codes == NULL) goto error;
+    self->last_codes = last_codes;
+    PyObject **last_identifiers = PyMem_Realloc(self->last_identifiers, capacity * sizeof(PyObject *));
+    if (last_identifiers == NULL) goto error;
+    self->last_identifiers = last_identifiers;
+    PyFrameObject **frames = PyMem_Realloc(self->frames, capacity * sizeof(PyFrameObject *));
+    if (frames == NULL) goto error;
+    self->frames = frames;
+
+    self->capacity = capacity;
+    return 1;
+
+error:
+    PyErr_NoMemory();
+    return 0;
+}
+
+static PyObject *
+CallStackBuilder_New(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"root_identifier", NULL};
+    PyObject *root_identifier = NULL;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "U", kwlist, &root_identifier))
+        return NULL;
+
+    CallStackBuilder *self = (CallStackBuilder *)type->tp_alloc(type, 0);
+    if (self == NULL) {
+        return NULL;
+    }
+    Py_INCREF(root_identifier);
+    self->root_identifier = root_identifier;
+    self->last_frames = NULL;
+    self->last_codes = NULL;
+    self->last_identifiers = NULL;
+    self->last_depth = 0;
+    self->frames = NULL;
+    self->capacity = 0;
+    return (PyObject *)self;
+}
+
+static void
+CallStackBuilder_Dealloc(CallStackBuilder *self)
+{
+    CallStackBuilder_Truncate(self, 0);
+    PyMem_Free(self->last_frames);
+    PyMem_Free(self->last_codes);
+    PyMem_Free(self->last_identifiers);
+    PyMem_Free(self->frames);
+    Py_XDECREF(self->root_identifier);
+    Py_TYPE(self)->tp_free((PyObject *)self);
+}
+
+/**
+ * Returns the identifier of the C function `arg`, for c_return and
+ * c_exception events.
+ */
+static PyObject *
+c_function_identifier(PyObject *arg)
+{
+    PyObject *name = PyObject_GetAttrString(arg, "__qualname__");
+    if (name == NULL) {
+        PyErr_Clear();
+        name = PyObject_GetAttrString(arg, "__name__");
+        if (name == NULL) {
+            return NULL;
+        }
+    }
+
+    PyObject *identifier = PyUnicode_FromFormat("%S%c%s%c%i", name, 0, "<built-in>", 0, 0);
+    Py_DECREF(name);
+    return identifier;
+}
+
+/**
+ * Returns the call stack of `frame` for the profile event `what`. On error,
+ * sets an exception and returns NULL.
+ */
+static PyObject *
+CallStackBuilder_BuildStack(CallStackBuilder *self, PyFrameObject *frame, int what, PyObject *arg)
+{
+    PyObject *c_identifier = NULL;
+    if (what == WHAT_CALL) {
+        // if we're entering a function, the time should be attributed to
+        // the caller
+        frame = frame ? frame->f_back : NULL;
+    } else if (what == WHAT_C_RETURN || what == WHAT_C_EXCEPTION) {
+        // if we're exiting a C function, we should add a frame after
+        // any Python frames that attributes the time to that C function
+        c_identifier = c_function_identifier(arg);
+        if (c_identifier == NULL) {
+            return NULL;
+        }
+    }
+
+    // walk the frames from the leaf to the root
+    Py_ssize_t depth = 0;
+    for (PyFrameObject *f = frame; f != NULL; f = f->f_back) {
+        if (!CallStackBuilder_Reserve(self, depth + 1)) {
+            Py_XDECREF(c_identifier);
+            return NULL;
+        }
+        self->frames[depth++] = f;
+    }
+
+    PyObject *call_stack = PyList_New(1 + depth + (c_identifier ? 1 : 0));
+    if (call_stack == NULL) {
+        Py_XDECREF(c_identifier);
+        return NULL;
+    }
+    Py_INCREF(self->root_identifier);
+    PyList_SET_ITEM(call_stack, 0, self->root_identifier);
+
+    // the frames shared with the previous stack, root first, keep their
+    // identifiers
+    Py_ssize_t shared = 0;
+    while (shared < depth && shared < self->last_depth) {
+        PyFrameObject *f = self->frames[depth - 1 - shared];
+        if (f != self->last_frames[shared]
+                || (PyObject *)f->f_code != self->last_codes[shared]) {
+            break;
+        }
+        shared++;
+    }
+    CallStackBuilder_Truncate(self, shared);
+
+    for (Py_ssize_t i = 0; i < depth; i++) {
+        if (i >= shared) {
+            PyFrameObject *f = self->frames[depth - 1 - i];
+            PyCodeObject *code = code_from_frame(f);
+            PyObject *identifier = code_identifier(code);
+            if (identifier == NULL) {
+                Py_DECREF(code);
+                Py_DECREF(call_stack);
+                Py_XDECREF(c_identifier);
+                return NULL;
+            }
+            self->last_frames[i] = f;
+            self->last_codes[i] = (PyObject *)code;
+            self->last_identifiers[i] = identifier;
+            self->last_depth = i + 1;
+        }
+        Py_INCREF(self->last_identifiers[i]);
+        PyList_SET_ITEM(call_stack, 1 + i, self->last_identifiers[i]);
+    }
+
+    if (c_identifier) {
+        PyList_SET_ITEM(call_stack, 1 + depth, c_identifier);
+    }
+
+    return call_stack;
+}
+
+static PyObject *
+CallStackBuilder_Build(CallStackBuilder *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"frame", "event", "arg", NULL};
+    PyObject *frame_obj = NULL;
+    PyObject *event = NULL;
+    PyObject *arg = NULL;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "OUO", kwlist, &frame_obj, &event, &arg))
+        return NULL;
+
+    if (frame_obj != Py_None && !PyFrame_Check(frame_obj)) {
+        PyErr_SetString(PyExc_TypeError, "frame must be a frame or None");
+        return NULL;
+    }
+    if (trace_init() == -1)
+        return NULL;
+
+    int what = WHAT_LINE;
+    for (int i = 0; i < 9; i++) {
+        if (PyUnicode_Compare(event, whatstrings[i]) == 0) {
+            what = i;
+            break;
+        }
+    }
+
+    return CallStackBuilder_BuildStack(
+        self, frame_obj == Py_None ? NULL : (PyFrameObject *)frame_obj, what, arg);
+}
+
+static PyMethodDef CallStackBuilder_methods[] = {
+    {"build", (PyCFunction)CallStackBuilder_Build, METH_VARARGS | METH_KEYWORDS,
+     "build(frame, event, arg)\n\nReturns the call stack of `frame`, as seen by a profile "
+     "function receiving `event` and `arg`: a list of frame identifiers, starting with the root "
+     "identifier."},
+    {NULL}  /* Sentinel */
+};
+
+static PyTypeObject CallStackBuilder_Type = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "joulehunter.stat_profile.CallStackBuilder", /* tp_name */
+    sizeof(CallStackBuilder),                 /* tp_basicsize */
+    0,                                        /* tp_itemsize */
+    (destructor)CallStackBuilder_Dealloc,     /* tp_dealloc */
+    0,                                        /* tp_print */
+    0,                                        /* tp_getattr */
+    0,                                        /* tp_setattr */
+    0,                                        /* tp_reserved */
+    0,                                        /* tp_repr */
+    0,                                        /* tp_as_number */
+    0,                                        /* tp_as_sequence */
+    0,                                        /* tp_as_mapping */
+    0,                                        /* tp_hash */
+    0,                                        /* tp_call */
+    0,                                        /* tp_str */
+    0,                                        /* tp_getattro */
+    0,                                        /* tp_setattro */
+    0,                                        /* tp_as_buffer */
+    Py_TPFLAGS_DEFAULT,                       /* tp_flags */
+    "CallStackBuilder(root_identifier)\n\nBuilds the call stacks of one thread.", /* tp_doc */
+    0,                                        /* tp_traverse */
+    0,                                        /* tp_clear */
+    0,                                        /* tp_richcompare */
+    0,                                        /* tp_weaklistoffset */
+    0,                                        /* tp_iter */
+    0,                                        /* tp_iternext */
+    CallStackBuilder_methods,                 /* tp_methods */
+    0,                                        /* tp_members */
+    0,                                        /* tp_getset */
+    0,                                        /* tp_base */
+    0,                                        /* tp_dict */
+    0,                                        /* tp_descr_get */
+    0,                                        /* tp_descr_set */
+    0,                                        /* tp_dictoffset */
+    0,                                        /* tp_init */
+    PyType_GenericAlloc,                      /* tp_alloc */
+    CallStackBuilder_New,                     /* tp_new */
+    PyObject_Del,                             /* tp_free */
+};
+
+///////////////////
+// Sample buffer //
+///////////////////
+
+/**
+ * Sends the buffered samples to the target, as a list of
+ * (call_stack, value, wall_time) tuples. Returns true on success, sets an
+ * exception and returns false on failure.
+ */
+static int
+ProfilerState_FlushSamples(ProfilerState *self, PyFrameObject *frame)
+{
+    if (self->sample_count == 0) {
+        return 1;
+    }
+
+    Py_ssize_t count = self->sample_count;
+    self->sample_count = 0;
+
+    PyObject *batch = PyList_New(count);
+    if (batch == NULL) {
+        for (Py_ssize_t i = 0; i < count; i++) {
+            Py_DECREF(self->samples[i].call_stack);
+        }
+        return 0;
+    }
+    for (Py_ssize_t i = 0; i < count; i++) {
+        BufferedSample *sample = &self->samples[i];
+        // the tuple takes the buffer's reference to the call stack
+        PyObject *item = Py_BuildValue(
+            "(Ndd)", sample->call_stack, sample->value, sample->wall_time);
+        if (item == NULL) {
+            for (Py_ssize_t j = i + 1; j < count; j++) {
+                Py_DECREF(self->samples[j].call_stack);
+            }
+            Py_DECREF(batch);
+            return 0;
+        }
+        PyList_SET_ITEM(batch, i, item);
+    }
+
+    // the target's own calls aren't sampled
+    self->flushing = 1;
+    PyObject *result = call_target(self, frame, WHAT_SAMPLES, batch);
+    self->flushing = 0;
+    Py_DECREF(batch);
+
+    if (result == NULL) {
+        return 0;
+    }
+    Py_DECREF(result);
+    return 1;
+}
+
+/**
+ * Adds a sample to the buffer, flushing it when it's full. `now` and
+ * `energy` are the readings that profile() has already made. Returns true
+ * on success, sets an exception and returns false on failure.
+ */
+static int
+ProfilerState_BufferSample(ProfilerState *self, PyFrameObject *frame, int what, PyObject *arg,
+                           double now, double energy)
+{
+    double value = now;
+    if (self->energy_fd_count > 0) {
+        if (self->energy_interval <= 0) {
+            energy = ProfilerState_GetEnergy(self);
+            if (energy == -1.0) {
+                return 0;
+            }
+        }
+        value = energy;
+    }
+    double wall_time = monoclock();
+
+    PyObject *call_stack = CallStackBuilder_BuildStack(
+        (CallStackBuilder *)self->call_stack_builder, frame, what, arg);
+    if (call_stack == NULL) {
+        return 0;
+    }
+
+    BufferedSample *sample = &self->samples[self->sample_count++];
+    sample->call_stack = call_stack;
+    sample->value = value - self->last_sample_value;
+    sample->wall_time = wall_time - self->last_sample_wall_time;
+    self->last_sample_value = value;
+    self->last_sample_wall_time = wall_time;
+
+    if (self->sample_count == self->sample_buffer_size) {
+        return ProfilerState_FlushSamples(self, frame);
+    }
+    return 1;
+}
+
+/**
+ * Returns the ProfilerState of the profile function set on this thread, or
+ * NULL if there's none.
+ */
+static ProfilerState *
+current_profiler_state(void)
+{
+    PyThreadState *tstate = PyThreadState_Get();
+    if (tstate->c_profilefunc != profile || tstate->c_profileobj == NULL) {
+        return NULL;
+    }
+    return (ProfilerState *)tstate->c_profileobj;
+}
+
 //////////////////////
 // Public functions //
 //////////////////////
@@ -280,10 +963,28 @@ profile(PyObject *op, PyFrameObject *frame, int what, PyObject *arg)
     ProfilerState *pState = (ProfilerState *)op;
     PyObject *result;
 
-    double now = ProfilerState_GetTime(pState);
-    if (now == -1.0) {
-        PyEval_SetProfile(NULL, NULL);
-        return -1;
+    if (pState->flushing) {
+        return 0;
+    }
+
+    double now = 0.0;
+    if (pState->interval > 0) {
+        now = ProfilerState_GetTime(pState);
+        if (now == -1.0) {
+            PyEval_SetProfile(NULL, NULL);
+            return -1;
+        }
+    }
+
+    // the energy counter is only read on every event when it's being used as
+    // a trigger. Otherwise, it's up to the target to read it when sampled.
+    double energy = 0.0;
+    if (pState->energy_interval > 0) {
+        energy = ProfilerState_GetEnergy(pState);
+        if (energy == -1.0) {
+            PyEval_SetProfile(NULL, NULL);
+            return -1;
+        }
     }
 
     // check for context var change, send context_changed event if seen
@@ -297,6 +998,13 @@ profile(PyObject *op, PyFrameObject *frame, int what, PyObject *arg)
         }
 
         if (old_context_var_value != pState->last_context_var_value) {
+            // the buffered samples were taken in the previous context
+            if (!ProfilerState_FlushSamples(pState, frame)) {
+                Py_XDECREF(old_context_var_value);
+                PyEval_SetProfile(NULL, NULL);
+                return -1;
+            }
+
             PyFrameObject *context_change_frame;
             if (what == WHAT_CALL && frame->f_back) {
                 context_change_frame = frame->f_back;
@@ -330,18 +1038,15 @@ profile(PyObject *op, PyFrameObject *frame, int what, PyObject *arg)
     PyCodeObject* code = code_from_frame(frame);
 
     if ((what == WHAT_RETURN) && (code->co_flags & 0x80)) {
-        PyObject *frame_identifier = PyUnicode_FromFormat(
-            "%U%c%U%c%i",
-            code->co_name,
-            0, // NULL char
-            code->co_filename,
-            0, // NULL char
-            code->co_firstlineno
-        );
+        PyObject *frame_identifier = code_identifier(code);
+        Py_DECREF(code);
+        if (frame_identifier == NULL) {
+            PyEval_SetProfile(NULL, NULL);
+            return -1;
+        }
 
         int status = PyList_Append(pState->await_stack_list, frame_identifier);
         Py_DECREF(frame_identifier);
-        Py_DECREF(code);
 
         if (status == -1) {
             PyEval_SetProfile(NULL, NULL);
@@ -365,12 +1070,31 @@ profile(PyObject *op, PyFrameObject *frame, int what, PyObject *arg)
     }
 
 
-    // stat profile
-    if (now < pState->last_invocation + pState->interval) {
+    // stat profile - sample when either the time or the energy trigger fires
+    int time_elapsed = (
+        pState->interval > 0
+        && now >= pState->last_invocation + pState->interval
+    );
+    int energy_elapsed = (
+        pState->energy_interval > 0
+        && energy >= pState->last_energy + pState->energy_interval
+    );
+
+    if (!time_elapsed && !energy_elapsed) {
         return 0;
     }
 
     pState->last_invocation = now;
+    pState->last_energy = energy;
+
+    if (pState->sample_buffer_size > 0) {
+        if (!ProfilerState_BufferSample(pState, frame, what, arg, now, energy)) {
+            PyEval_SetProfile(NULL, NULL);
+            return -1;
+        }
+        return 0;
+    }
+
     result = call_target(pState, frame, what, arg);
 
     if (result == NULL) {
@@ -382,6 +1106,210 @@ profile(PyObject *op, PyFrameObject *frame, int what, PyObject *arg)
     return 0;
 }
 
+#if !defined(MS_WINDOWS)
+/**
+ * Parses a file descriptor, returns -1 and sets an exception on failure.
+ */
+static int parse_energy_fd(PyObject *fd_obj) {
+    int fd = _PyLong_AsInt(fd_obj);
+    if (fd == -1 && PyErr_Occurred()) {
+        return -1;
+    }
+    if (fd < 0) {
+        PyErr_SetString(PyExc_ValueError, "energy_counter must be a valid file descriptor");
+        return -1;
+    }
+    return fd;
+}
+#endif
+
+/**
+ * Points the profiler at an energy counter, given either as a path to open,
+ * an already-open file descriptor, or a sequence of file descriptors whose
+ * readings are summed. Returns true on success, sets an exception and
+ * returns false on failure.
+ */
+static int ProfilerState_SetEnergyCounter(ProfilerState *self, PyObject *energy_counter) {
+#if defined(MS_WINDOWS)
+    PyErr_SetString(PyExc_NotImplementedError, "energy counters are not supported on Windows");
+    return 0;
+#else
+    if (PyLong_Check(energy_counter)) {
+        int fd = parse_energy_fd(energy_counter);
+        if (fd == -1) {
+            return 0;
+        }
+        self->energy_fds[0] = fd;
+        energy_accumulator_init(&self->energy_accumulators[0], 0);
+        self->energy_fd_count = 1;
+        self->owns_energy_fds = 0;
+        return 1;
+    }
+
+    if (PyList_Check(energy_counter) || PyTuple_Check(energy_counter)) {
+        Py_ssize_t count = PySequence_Fast_GET_SIZE(energy_counter);
+        if (count == 0 || count > MAX_ENERGY_COUNTERS) {
+            PyErr_Format(PyExc_ValueError,
+                         "energy_counter must contain between 1 and %d file descriptors",
+                         MAX_ENERGY_COUNTERS);
+            return 0;
+        }
+        for (Py_ssize_t i = 0; i < count; i++) {
+            int fd = parse_energy_fd(PySequence_Fast_GET_ITEM(energy_counter, i));
+            if (fd == -1) {
+                return 0;
+            }
+            self->energy_fds[i] = fd;
+            energy_accumulator_init(&self->energy_accumulators[i], 0);
+        }
+        self->energy_fd_count = (int)count;
+        self->owns_energy_fds = 0;
+        return 1;
+    }
+
+    PyObject *path_bytes = NULL;
+    if (!PyUnicode_FSConverter(energy_counter, &path_bytes)) {
+        return 0;
+    }
+
+    int fd = open(PyBytes_AS_STRING(path_bytes), O_RDONLY | O_CLOEXEC);
+    if (fd < 0) {
+        PyErr_SetFromErrnoWithFilenameObject(PyExc_OSError, energy_counter);
+        Py_DECREF(path_bytes);
+        return 0;
+    }
+    Py_DECREF(path_bytes);
+
+    self->energy_fds[0] = fd;
+    energy_accumulator_init(&self->energy_accumulators[0], 0);
+    self->energy_fd_count = 1;
+    self->owns_energy_fds = 1;
+    return 1;
+#endif
+}
+
+/**
+ * Sets the range at which each energy counter wraps around, either one range
+ * for every counter or a sequence with one range per counter. Must be called
+ * after ProfilerState_SetEnergyCounter. Returns true on success, sets an
+ * exception and returns false on failure.
+ */
+static int ProfilerState_SetEnergyMaxRange(ProfilerState *self, PyObject *energy_max_range) {
+#if defined(MS_WINDOWS)
+    PyErr_SetString(PyExc_NotImplementedError, "energy counters are not supported on Windows");
+    return 0;
+#else
+    if (PyLong_Check(energy_max_range)) {
+        long long max_range = PyLong_AsLongLong(energy_max_range);
+        if (max_range == -1 && PyErr_Occurred()) {
+            return 0;
+        }
+        for (int i = 0; i < self->energy_fd_count; i++) {
+            self->energy_accumulators[i].max_range = max_range;
+        }
+        return 1;
+    }
+
+    PyObject *ranges_seq = PySequence_Fast(
+        energy_max_range, "energy_max_range must be an integer or a sequence of integers");
+    if (ranges_seq == NULL) {
+        return 0;
+    }
+
+    if (PySequence_Fast_GET_SIZE(ranges_seq) != self->energy_fd_count) {
+        PyErr_SetString(PyExc_ValueError,
+                        "energy_max_range must have one range per energy counter");
+        Py_DECREF(ranges_seq);
+        return 0;
+    }
+
+    for (int i = 0; i < self->energy_fd_count; i++) {
+        long long max_range = PyLong_AsLongLong(PySequence_Fast_GET_ITEM(ranges_seq, i));
+        if (max_range == -1 && PyErr_Occurred()) {
+            Py_DECREF(ranges_seq);
+            return 0;
+        }
+        self->energy_accumulators[i].max_range = max_range;
+    }
+
+    Py_DECREF(ranges_seq);
+    return 1;
+#endif
+}
+
+/**
+ * Sends the samples buffered on this thread to the target, as a single
+ * "samples" event.
+ */
+static PyObject *
+drain_samples(PyObject *m, PyObject *noargs)
+{
+    ProfilerState *state = current_profiler_state();
+    if (state && !ProfilerState_FlushSamples(state, PyEval_GetFrame())) {
+        return NULL;
+    }
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+get_coarse_clock_resolution(PyObject *m, PyObject *noargs)
+{
+    return PyFloat_FromDouble(coarseclock_resolution());
+}
+
+/**
+ * Reads an energy counter from an open file descriptor. This is the native
+ * equivalent of reading the file, parsing it and seeking back to the start.
+ */
+static PyObject *
+read_energy_counter(PyObject *m, PyObject *fd_obj)
+{
+    int fd = _PyLong_AsInt(fd_obj);
+    if (fd == -1 && PyErr_Occurred()) {
+        return NULL;
+    }
+
+    long long value = read_counter_fd(fd);
+    if (value == -1) {
+        return NULL;
+    }
+
+    return PyLong_FromLongLong(value);
+}
+
+/**
+ * Reads several energy counters in one call, returning a list of their
+ * integer values.
+ */
+static PyObject *
+read_energy_counters(PyObject *m, PyObject *fds)
+{
+    PyObject *fds_seq = PySequence_Fast(fds, "fds must be a sequence of file descriptors");
+    if (fds_seq == NULL) {
+        return NULL;
+    }
+
+    Py_ssize_t size = PySequence_Fast_GET_SIZE(fds_seq);
+    PyObject *result = PyList_New(size);
+    if (result == NULL) {
+        Py_DECREF(fds_seq);
+        return NULL;
+    }
+
+    for (Py_ssize_t i = 0; i < size; i++) {
+        PyObject *value = read_energy_counter(m, PySequence_Fast_GET_ITEM(fds_seq, i));
+        if (value == NULL) {
+            Py_DECREF(fds_seq);
+            Py_DECREF(result);
+            return NULL;
+        }
+        PyList_SET_ITEM(result, i, value);
+    }
+
+    Py_DECREF(fds_seq);
+    return result;
+}
+
 /**
  * The 'setprofile' function. This is the public API that can be called
  * from Python code.
@@ -389,15 +1317,44 @@ profile(PyObject *op, PyFrameObject *frame, int what, PyObject *arg)
 static PyObject *
 setstatprofile(PyObject *m, PyObject *args, PyObject *kwds)
 {
-    static char *kwlist[] = {"target", "interval", "context_var", "timer_func", NULL};
+    static char *kwlist[] = {"target", "interval", "context_var", "timer_func", "energy_counter", "energy_interval", "timer_type", "energy_max_range", "sync_locals", "sample_buffer_size", "call_stack_builder", NULL};
     ProfilerState *pState = NULL;
     double interval = 0.0;
     PyObject *target = NULL;
     PyObject *context_var = NULL;
     PyObject *timer_func = NULL;
+    PyObject *energy_counter = NULL;
+    double energy_interval = 0.0;
+    const char *timer_type = NULL;
+    PyObject *energy_max_range = NULL;
+    int sync_locals = 0;
+    Py_ssize_t sample_buffer_size = 0;
+    PyObject *call_stack_builder = NULL;
+
+    if (! PyArg_ParseTupleAndKeywords(args, kwds, "O|dO!OOdzOpnO", kwlist, &target, &interval, &PyContextVar_Type, &context_var, &timer_func, &energy_counter, &energy_interval, &timer_type, &energy_max_range, &sync_locals, &sample_buffer_size, &call_stack_builder))
+        return NULL;
+
+    if (sample_buffer_size < 0) {
+        PyErr_SetString(PyExc_ValueError, "sample_buffer_size can't be negative");
+        return NULL;
+    }
+    if (sample_buffer_size > 0
+            && (call_stack_builder == NULL
+                || !PyObject_TypeCheck(call_stack_builder, &CallStackBuilder_Type))) {
+        PyErr_SetString(PyExc_TypeError, "sample_buffer_size requires a CallStackBuilder");
+        return NULL;
+    }
+
+    // the samples buffered so far go to the target they were taken for
+    ProfilerState *current_state = current_profiler_state();
+    if (current_state && !ProfilerState_FlushSamples(current_state, PyEval_GetFrame())) {
+        return NULL;
+    }
 
-    if (! PyArg_ParseTupleAndKeywords(args, kwds, "O|dO!O", kwlist, &target, &interval, &PyContextVar_Type, &context_var, &timer_func))
+    if (energy_interval > 0 && (energy_counter == NULL || energy_counter == Py_None)) {
+        PyErr_SetString(PyExc_ValueError, "energy_interval requires an energy_counter");
         return NULL;
+    }
 
     if (target == Py_None) {
         target = NULL;
@@ -415,8 +1372,29 @@ setstatprofile(PyObject *m, PyObject *args, PyObject *kwds)
         pState = ProfilerState_New();
         ProfilerState_SetTarget(pState, target);
 
-        // default interval is 1 ms
-        pState->interval = (interval > 0) ? interval : 0.001;
+        // default interval is 1 ms, unless sampling is triggered by energy only
+        if (interval > 0) {
+            pState->interval = interval;
+        } else if (energy_interval > 0) {
+            pState->interval = 0.0;
+        } else {
+            pState->interval = 0.001;
+        }
+        pState->energy_interval = (energy_interval > 0) ? energy_interval : 0.0;
+        pState->sync_locals = sync_locals;
+
+        if (timer_type == NULL || strcmp(timer_type, "walltime") == 0) {
+            pState->timer_type = TIMER_WALLTIME;
+        } else if (strcmp(timer_type, "walltime_coarse") == 0) {
+            pState->timer_type = TIMER_WALLTIME_COARSE;
+        } else if (strcmp(timer_type, "monotonic") == 0) {
+            pState->timer_type = TIMER_MONOTONIC;
+        } else {
+            PyErr_SetString(PyExc_ValueError,
+                            "timer_type must be 'walltime', 'walltime_coarse' or 'monotonic'");
+            Py_DECREF(pState);
+            return NULL;
+        }
 
         if (timer_func == Py_None) {
             timer_func = NULL;
@@ -427,8 +1405,54 @@ setstatprofile(PyObject *m, PyObject *args, PyObject *kwds)
             pState->timer_func = timer_func;
         }
 
+        if (energy_counter && energy_counter != Py_None) {
+            if (!ProfilerState_SetEnergyCounter(pState, energy_counter)) {
+                Py_DECREF(pState);
+                return NULL;
+            }
+            if (energy_max_range && energy_max_range != Py_None
+                    && !ProfilerState_SetEnergyMaxRange(pState, energy_max_range)) {
+                Py_DECREF(pState);
+                return NULL;
+            }
+        }
+
         // initialise the last invocation to avoid immediate callback
         pState->last_invocation = ProfilerState_GetTime(pState);
+        if (pState->last_invocation == -1.0 && PyErr_Occurred()) {
+            Py_DECREF(pState);
+            return NULL;
+        }
+
+        if (pState->energy_interval > 0) {
+            pState->last_energy = ProfilerState_GetEnergy(pState);
+            if (pState->last_energy == -1.0) {
+                Py_DECREF(pState);
+                return NULL;
+            }
+        }
+
+        if (sample_buffer_size > 0) {
+            pState->samples = PyMem_Malloc(sample_buffer_size * sizeof(BufferedSample));
+            if (pState->samples == NULL) {
+                Py_DECREF(pState);
+                return PyErr_NoMemory();
+            }
+            pState->sample_buffer_size = sample_buffer_size;
+            Py_INCREF(call_stack_builder);
+            pState->call_stack_builder = call_stack_builder;
+
+            pState->last_sample_value = pState->last_invocation;
+            if (pState->energy_fd_count > 0) {
+                pState->last_sample_value = pState->energy_interval > 0
+                    ? pState->last_energy : ProfilerState_GetEnergy(pState);
+                if (pState->last_sample_value == -1.0) {
+                    Py_DECREF(pState);
+                    return NULL;
+                }
+            }
+            pState->last_sample_wall_time = monoclock();
+        }
 
         if (context_var) {
             Py_INCREF(context_var);
@@ -456,13 +1480,37 @@ static PyMethodDef module_methods[] = {
     {"setstatprofile", (PyCFunction)setstatprofile, METH_VARARGS | METH_KEYWORDS,
      "Sets the statistal profiler callback. The function in the same manner as setprofile, but "
      "instead of being called every on every call and return, the function is called every "
-     "<interval> seconds with the current stack."},
+     "<interval> seconds with the current stack. If energy_counter (a path, a file descriptor or "
+     "a list of file descriptors to sum) and energy_interval are given, the function is also "
+     "called every <energy_interval> joules, as read natively from that counter. "
+     "energy_max_range is the value at which the counter (or each of the counters) wraps around "
+     "to 0. timer_type selects the clock used when no timer_func is given, either 'walltime', "
+     "'walltime_coarse' or 'monotonic'. If sync_locals is true, the frame's locals are copied into f_locals "
+     "before each call to the function, and back after it, like sys.setprofile does. If "
+     "sample_buffer_size is set, the call stack of each sample is built natively by "
+     "call_stack_builder, and the samples are sent in batches of up to that size, as a 'samples' "
+     "event whose arg is a list of (call_stack, value, wall_time) tuples: the call stack, the "
+     "energy (or the time, without an energy counter) and the wall-clock time since the "
+     "previous sample."},
+    {"drain_samples", (PyCFunction)drain_samples, METH_NOARGS,
+     "Sends the samples that setstatprofile has buffered on this thread to its target."},
+    {"get_coarse_clock_resolution", (PyCFunction)get_coarse_clock_resolution, METH_NOARGS,
+     "Returns the resolution of the 'walltime_coarse' clock in seconds, or 0.0 if it is not "
+     "available."},
+    {"read_energy_counter", (PyCFunction)read_energy_counter, METH_O,
+     "Reads the integer value (e.g. microjoules) of the energy counter open at the given file "
+     "descriptor."},
+    {"read_energy_counters", (PyCFunction)read_energy_counters, METH_O,
+     "Reads the energy counters open at each of the given file descriptors, returning a list of "
+     "their values."},
     {NULL}  /* Sentinel */
 };
 
 PyMODINIT_FUNC PyInit_stat_profile(void)
 {
     PyType_Ready(&ProfilerState_Type);
+    if (PyType_Ready(&CallStackBuilder_Type) < 0)
+        return NULL;
 
     static struct PyModuleDef moduledef = {
         PyModuleDef_HEAD_INIT,
@@ -472,5 +1520,16 @@ PyMODINIT_FUNC PyInit_stat_profile(void)
         module_methods
     };
 
-    return PyModule_Create(&moduledef);
+    PyObject *module = PyModule_Create(&moduledef);
+    if (module == NULL)
+        return NULL;
+
+    Py_INCREF(&CallStackBuilder_Type);
+    if (PyModule_AddObject(module, "CallStackBuilder", (PyObject *)&CallStackBuilder_Type) < 0) {
+        Py_DECREF(&CallStackBuilder_Type);
+        Py_DECREF(module);
+        return NULL;
+    }
+
+    return module;
 }
@@ -1,18 +1,68 @@
 import contextvars
+import os
 import sys
+import time
 import timeit
 import types
-from typing import Any, Callable, List, Optional, Type
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
 
 
 class PythonStatProfiler:
     await_stack: List[str]
 
-    def __init__(self, target, interval, context_var, timer_func):
+    def __init__(
+        self,
+        target,
+        interval,
+        context_var,
+        timer_func,
+        energy_counter=None,
+        energy_interval=0.0,
+        timer_type=None,
+        energy_max_range=None,
+        sample_buffer_size=0,
+        call_stack_builder=None,
+    ):
+        if energy_interval > 0 and energy_counter is None:
+            raise ValueError("energy_interval requires an energy_counter")
+        if timer_type not in (None, "walltime", "walltime_coarse", "monotonic"):
+            raise ValueError("timer_type must be 'walltime', 'walltime_coarse' or 'monotonic'")
+
         self.target = target
-        self.interval = interval
+        if interval > 0:
+            self.interval = interval
+        elif energy_interval > 0:
+            self.interval = 0.0
+        else:
+            self.interval = 0.001
+        self.energy_interval = energy_interval
+
+        self.energy_fds = []
+        if energy_counter is not None:
+            if isinstance(energy_counter, int):
+                self.energy_fds = [energy_counter]
+            elif isinstance(energy_counter, (list, tuple)):
+                # several counters, summed
+                self.energy_fds = list(energy_counter)
+            else:
+                self.energy_fds = [os.open(energy_counter, os.O_RDONLY)]
+
+        # like the C version, the readings of each counter are made monotonic
+        # by adding the range every time the counter wraps around
+        if isinstance(energy_max_range, (list, tuple)):
+            if len(energy_max_range) != len(self.energy_fds):
+                raise ValueError("energy_max_range must have one range per energy counter")
+            self.energy_max_ranges = list(energy_max_range)
+        else:
+            self.energy_max_ranges = [energy_max_range or 0] * len(self.energy_fds)
+        self.energy_last_values = [-1] * len(self.energy_fds)
+        self.energy_offsets = [0] * len(self.energy_fds)
+
+        # timeit.default_timer is time.perf_counter, which is monotonic and
+        # precise, so it stands in for every timer_type
         self.timer_func = timer_func or timeit.default_timer
         self.last_invocation = self.timer_func()
+        self.last_energy = self.read_energy() if energy_interval > 0 else 0.0
 
         if context_var:
             # raise typeerror to match the C version
@@ -23,14 +73,65 @@ class PythonStatProfiler:
         self.last_context_var_value = context_var.get() if context_var else None
         self.await_stack = []
 
+        if sample_buffer_size < 0:
+            raise ValueError("sample_buffer_size can't be negative")
+        if sample_buffer_size > 0 and not isinstance(call_stack_builder, CallStackBuilder):
+            raise TypeError("sample_buffer_size requires a CallStackBuilder")
+        self.sample_buffer_size = sample_buffer_size
+        self.call_stack_builder = call_stack_builder
+        self.samples: List[Tuple[List[str], float, float]] = []
+        self.flushing = False
+        if sample_buffer_size > 0:
+            self.last_sample_value = self.read_energy() if self.energy_fds else self.last_invocation
+            self.last_sample_wall_time = time.time()
+
+    def flush_samples(self, frame: Optional[types.FrameType]):
+        if not self.samples:
+            return
+        samples, self.samples = self.samples, []
+        self.flushing = True
+        try:
+            self.target(frame, "samples", samples)
+        finally:
+            self.flushing = False
+
+    def buffer_sample(self, frame: types.FrameType, event: str, arg: Any, now: float):
+        value = self.read_energy() if self.energy_fds else now
+        wall_time = time.time()
+        self.samples.append(
+            (
+                self.call_stack_builder.build(frame, event, arg),
+                value - self.last_sample_value,
+                wall_time - self.last_sample_wall_time,
+            )
+        )
+        self.last_sample_value = value
+        self.last_sample_wall_time = wall_time
+        if len(self.samples) == self.sample_buffer_size:
+            self.flush_samples(frame)
+
+    def read_energy(self) -> float:
+        energy_uj = 0
+        for i, value in enumerate(read_energy_counters(self.energy_fds)):
+            if self.energy_max_ranges[i] > 0 and value < self.energy_last_values[i]:
+                self.energy_offsets[i] += self.energy_max_ranges[i]
+            self.energy_last_values[i] = value
+            energy_uj += value + self.energy_offsets[i]
+        return energy_uj / 10**6
+
     def profile(self, frame: types.FrameType, event: str, arg: Any):
-        now = self.timer_func()
+        if self.flushing:
+            return
+
+        now = self.timer_func() if self.interval > 0 else 0.0
+        energy = self.read_energy() if self.energy_interval > 0 else 0.0
 
         if self.context_var:
             context_var_value = self.context_var.get()
             last_context_var_value = self.last_context_var_value
 
             if context_var_value is not last_context_var_value:
+                self.flush_samples(frame)
                 context_change_frame = frame.f_back if event == "call" else frame
                 self.target(
                     context_change_frame,
@@ -52,10 +153,18 @@ class PythonStatProfiler:
             else:
                 self.await_stack.clear()
 
-        if now < self.last_invocation + self.interval:
+        time_elapsed = self.interval > 0 and now >= self.last_invocation + self.interval
+        energy_elapsed = (
+            self.energy_interval > 0 and energy >= self.last_energy + self.energy_interval
+        )
+
+        if not time_elapsed and not energy_elapsed:
             return
 
         self.last_invocation = now
+        self.last_energy = energy
+        if self.sample_buffer_size > 0:
+            return self.buffer_sample(frame, event, arg, now)
         return self.target(frame, event, arg)
 
 
@@ -65,14 +174,96 @@ purposes. Not used in normal execution.
 """
 
 
-def setstatprofile(target, interval=0.001, context_var=None, timer_func=None):
+def read_energy_counter(fd: int) -> int:
+    return int(os.pread(fd, 32, 0))
+
+
+# the identifier of each code object, keyed by id(). The entry keeps the code
+# object alive, so its id can't be reused by another one while it's cached
+code_identifiers: Dict[int, Tuple[types.CodeType, str]] = {}
+CODE_IDENTIFIERS_SIZE = 16384
+
+
+def code_identifier(code: types.CodeType) -> str:
+    cached = code_identifiers.get(id(code))
+    if cached is None:
+        identifier = sys.intern("%s\x00%s\x00%i" % (code.co_name, code.co_filename, code.co_firstlineno))
+        cached = (code, identifier)
+        if len(code_identifiers) >= CODE_IDENTIFIERS_SIZE * 3 // 4:
+            code_identifiers.clear()
+        code_identifiers[id(code)] = cached
+    return cached[1]
+
+
+class CallStackBuilder:
+    """
+    Like the C version, without reusing the identifiers of the previous
+    stack.
+    """
+
+    def __init__(self, root_identifier: str):
+        if not isinstance(root_identifier, str):
+            raise TypeError("root_identifier must be a str")
+        self.root_identifier = root_identifier
+
+    def build(self, frame: Optional[types.FrameType], event: str, arg: Any) -> List[str]:
+        call_stack: List[str] = []
+
+        if event == "call":
+            frame = frame.f_back if frame else None
+        elif event == "c_return" or event == "c_exception":
+            call_stack.append(
+                "%s\x00%s\x00%i" % (getattr(arg, "__qualname__", arg.__name__), "<built-in>", 0)
+            )
+
+        while frame is not None:
+            call_stack.append(code_identifier(frame.f_code))
+            frame = frame.f_back
+
+        call_stack.append(self.root_identifier)
+        call_stack.reverse()
+        return call_stack
+
+
+def read_energy_counters(fds: List[int]) -> List[int]:
+    return [read_energy_counter(fd) for fd in fds]
+
+
+def setstatprofile(
+    target,
+    interval=0.0,
+    context_var=None,
+    timer_func=None,
+    energy_counter=None,
+    energy_interval=0.0,
+    timer_type=None,
+    energy_max_range=None,
+    sync_locals=False,
+    sample_buffer_size=0,
+    call_stack_builder=None,
+):
+    # sys.setprofile always copies the frame's locals around the call, so
+    # sync_locals makes no difference here
+    drain_samples()
     if target:
         profiler = PythonStatProfiler(
             target=target,
             interval=interval,
             context_var=context_var,
             timer_func=timer_func,
+            energy_counter=energy_counter,
+            energy_interval=energy_interval,
+            timer_type=timer_type,
+            energy_max_range=energy_max_range,
+            sample_buffer_size=sample_buffer_size,
+            call_stack_builder=call_stack_builder,
         )
         sys.setprofile(profiler.profile)
     else:
         sys.setprofile(None)
+
+
+def drain_samples():
+    profiler = getattr(sys.getprofile(), "__self__", None)
+    if isinstance(profiler, PythonStatProfiler):
+        profiler.flush_samples(sys._getframe(1))
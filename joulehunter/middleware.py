@@ -45,11 +45,14 @@ class ProfilerMiddleware(MiddlewareMixin):  # type: ignore
             if component == '':
                 component = None
 
+            backend = getattr(settings, "JOULEHUNTER_ENERGY_BACKEND", None)
+
             if package is not None:
                 profiler = Profiler(package=package,
-                                    component=component)
+                                    component=component,
+                                    backend=backend)
             else:
-                profiler = Profiler(component=component)
+                profiler = Profiler(component=component, backend=backend)
             profiler.start()
 
             request.profiler = profiler
@@ -57,6 +60,7 @@ class ProfilerMiddleware(MiddlewareMixin):  # type: ignore
     def process_response(self, request, response):
         if hasattr(request, "profiler"):
             profile_session = request.profiler.stop()
+            request.profiler.close()
 
             renderer = HTMLRenderer()
             output_html = renderer.render(profile_session)
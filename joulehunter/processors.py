@@ -37,7 +37,7 @@ def remove_importlib(frame: BaseFrame | None, options: ProcessorOptions) -> Base
 
         if child.file_path and "<frozen importlib._bootstrap" in child.file_path:
             # remove this node, moving the self_time and children up to the parent
-            frame.self_time += child.self_time
+            frame.add_self_time(child.self_time, child.self_domain_times, child.self_wall_time)
             frame.add_children(child.children, after=child)
             child.remove_from_parent()
 
@@ -66,7 +66,8 @@ def aggregate_repeated_calls(
             aggregate_frame = children_by_identifier[child.identifier]
 
             # combine the two frames, putting the children and self_time into the aggregate frame.
-            aggregate_frame.self_time += child.self_time
+            aggregate_frame.add_self_time(
+                child.self_time, child.self_domain_times, child.self_wall_time)
             if child.children:
                 if not isinstance(aggregate_frame, Frame):
                     raise Exception("cannot aggregate children into a DummyFrame")
@@ -82,10 +83,11 @@ def aggregate_repeated_calls(
     for child in frame.children:
         aggregate_repeated_calls(child, options=options)
 
-    # sort the children by time
+    # sort the children by time, or by the metric chosen by the renderer
     # it's okay to use the internal _children list, sinde we're not changing the tree
     # structure.
-    frame._children.sort(key=methodcaller("time"), reverse=True)  # type: ignore # noqa
+    metric = options.get("metric", "energy")
+    frame._children.sort(key=methodcaller("metric", metric), reverse=True)  # type: ignore # noqa
 
     return frame
 
@@ -154,7 +156,8 @@ def merge_consecutive_self_time(
         if isinstance(child, SelfTimeFrame):
             if previous_self_time_frame:
                 # merge
-                previous_self_time_frame.self_time += child.self_time
+                previous_self_time_frame.add_self_time(
+                    child.self_time, child.self_domain_times, child.self_wall_time)
                 child.remove_from_parent()
             else:
                 # keep a reference, maybe it'll be added to on the next loop
@@ -181,7 +184,7 @@ def remove_unnecessary_self_time_nodes(
 
     if len(frame.children) == 1 and isinstance(frame.children[0], SelfTimeFrame):
         child = frame.children[0]
-        frame.self_time += child.self_time
+        frame.add_self_time(child.self_time, child.self_domain_times, child.self_wall_time)
         child.remove_from_parent()
 
     for child in frame.children:
@@ -199,16 +202,23 @@ def remove_irrelevant_nodes(
     if frame is None:
         return None
 
+    # mean power doesn't add up, so those trees are filtered by energy
+    metric = "time" if options.get("metric") == "time" else "energy"
+
     if total_time is None:
-        total_time = frame.time()
+        total_time = frame.metric(metric)
 
     filter_threshold = options.get("filter_threshold", 0.01)
 
     for child in frame.children:
-        proportion_of_total = child.time() / total_time
+        if not total_time:
+            # e.g. a session without wall-clock times, nothing to compare to
+            break
+
+        proportion_of_total = child.metric(metric) / total_time
 
         if proportion_of_total < filter_threshold:
-            frame.self_time += child.time()
+            frame.add_self_time(child.time(), child.domain_times(), child.wall_time())
             child.remove_from_parent()
 
     for child in frame.children:
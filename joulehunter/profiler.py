@@ -2,16 +2,24 @@ from __future__ import annotations
 
 import inspect
 import sys
+import threading
 import time
 import types
-from typing import IO, Any, Union
+import warnings
+from typing import IO, Any, List, Union
 
 import joulehunter.energy as energy
 
-from joulehunter import renderers
+from joulehunter import cgroup, cpufreq, renderers
 from joulehunter.frame import AWAIT_FRAME_IDENTIFIER, OUT_OF_CONTEXT_FRAME_IDENTIFIER
-from joulehunter.session import Session
+from joulehunter.session import FrameRecordType, Session
+from joulehunter.signal_sampler import SignalSampler, get_signal_sampler
 from joulehunter.stack_sampler import AsyncState, StackSampler, build_call_stack, get_stack_sampler
+from joulehunter.thread_sampler import (
+    ALL_THREADS_FRAME_IDENTIFIER,
+    ThreadSampler,
+    get_thread_sampler,
+)
 from joulehunter.typing import LiteralStr
 from joulehunter.util import file_supports_color, file_supports_unicode
 
@@ -19,19 +27,52 @@ from joulehunter.util import file_supports_color, file_supports_unicode
 
 
 class ActiveProfilerSession:
-    frame_records: list[tuple[list[str], float]]
+    frame_records: list[FrameRecordType]
+    sample_timestamps: list[int]
+    last_readings: list[list[int]]
 
     def __init__(
         self,
         start_time: float,
         start_call_stack: list[str],
+        energy_poller: energy.EnergyPoller | None = None,
+        energy_counters: list[energy.Energy] | None = None,
+        idle_power: list[float] | None = None,
+        thread_cpu_weighting: bool = False,
+        cgroup_cpu_share: cgroup.CgroupCpuShare | None = None,
+        frequency_reader: cpufreq.CpuFrequencyReader | None = None,
     ) -> None:
         self.start_time = start_time
         self.start_call_stack = start_call_stack
         self.frame_records = []
+        self.energy_poller = energy_poller
+        # set when each sample records several domains. The sampler reports
+        # the energy of the first domain, the rest is read alongside it
+        self.energy_counters = energy_counters or []
+        self.last_readings = energy.Energy.read_all(self.energy_counters)
+        # the idle power of each domain, subtracted from each record's energy
+        # when the session stops
+        self.idle_power = idle_power
+        # when energy is polled, each record's energy is filled in when the
+        # session stops, from these monotonic_ns timestamps
+        self.start_timestamp = time.monotonic_ns()
+        self.sample_timestamps = []
+        # with thread CPU weighting, the share of each record's energy that
+        # goes to this thread, applied when the session stops
+        self.cpu_time_weights: list[float] | None = [] if thread_cpu_weighting else None
+        self.last_cpu_times = (time.thread_time(), time.process_time())
+        self.last_cpu_time_weight = 1 / threading.active_count()
+        # with cgroup apportioning, the cgroup's share of the host's CPU time
+        # during each record
+        self.cgroup_cpu_share = cgroup_cpu_share
+        self.cgroup_shares: list[float] = []
+        # with frequency recording, the core and its frequency at each record
+        self.frequency_reader = frequency_reader
+        self.cpu_records: list[tuple[int, int]] = []
 
 
 AsyncMode = LiteralStr["enabled", "disabled", "strict"]
+SamplerType = LiteralStr["setprofile", "signal", "threads"]
 
 
 class Profiler:
@@ -41,38 +82,292 @@ class Profiler:
 
     _last_session: Session | None
     _active_session: ActiveProfilerSession | None
-    _interval: float
+    _interval: float | None
+    _energy_interval: float | None
     _async_mode: AsyncMode
 
     def __init__(
             self,
-            interval: float = 0.001,
+            interval: float | None = 0.001,
             async_mode: AsyncMode = "disabled",
             package: Union[str, int] = 0,
-            component: Union[str, int] = None
+            component: Union[str, int] = None,
+            energy_interval: float | None = None,
+            energy_poll_interval: float | None = None,
+            domains: List[Any] | None = None,
+            backend: energy.EnergyBackend | str | None = None,
+            calibrate_idle: bool = False,
+            energy_on_change: bool = False,
+            thread_cpu_weighting: bool = False,
+            cgroup_apportioning: bool = False,
+            record_frequency: bool = False,
+            sample_buffer_size: int = 0,
+            sampler: SamplerType = "setprofile",
     ):
         """
         Note the profiling will not start until :func:`start` is called.
 
         :param interval: See :attr:`interval`.
         :param async_mode: See :attr:`async_mode`.
+        :param package: The package (CPU) to measure, by ID or name, or ``"all"`` to measure
+            every package of the machine. The energy of each package is then also kept in the
+            session, as extra domains. ``"auto"`` measures the packages this process may run
+            on, according to its CPU affinity, and checks them again before each profile.
+        :param component: The component of the package to measure (e.g.
+            ``dram``), by ID or name. If ``None``, the whole package is
+            measured.
+        :param energy_interval: See :attr:`energy_interval`.
+        :param energy_poll_interval: See :attr:`energy_poll_interval`.
+        :param domains: Measure several energy domains at once, instead of
+            ``package`` and ``component``. Each domain is a package, a
+            ``(package, component)`` tuple or a ``"package/component"``
+            string. The first domain is the one shown by default, see
+            :meth:`Session.root_frame` to look at the others.
+        :param backend: The source of the energy readings, as an
+            :class:`~joulehunter.energy.EnergyBackend` or the name of one.
+            Defaults to the process-wide backend, see
+            :func:`~joulehunter.energy.get_backend`.
+        :param calibrate_idle: Measure the idle power of each domain before
+            profiling (or reuse this host's cached measurement, see
+            :func:`~joulehunter.energy.idle_power`), and record the dynamic
+            energy of each domain alongside its total energy. Each sample's
+            dynamic energy is its energy minus the idle power times its
+            duration. The dynamic domains follow the others in
+            :attr:`Session.domains`, named e.g. ``package-0 (dynamic)``.
+        :param energy_on_change: See :attr:`energy_on_change`.
+        :param thread_cpu_weighting: See :attr:`thread_cpu_weighting`.
+        :param cgroup_apportioning: See :attr:`cgroup_apportioning`.
+        :param record_frequency: See :attr:`record_frequency`.
+        :param sample_buffer_size: See :attr:`sample_buffer_size`.
+        :param sampler: See :attr:`sampler`.
         """
+        if not interval and not energy_interval:
+            raise ValueError("At least one of interval and energy_interval must be set.")
+        if energy_interval and energy_poll_interval:
+            raise ValueError("energy_interval can't be used with energy_poll_interval.")
+        if energy_on_change and energy_poll_interval:
+            raise ValueError("energy_on_change can't be used with energy_poll_interval.")
+        if sample_buffer_size and (
+            energy_poll_interval or energy_on_change or thread_cpu_weighting
+            or cgroup_apportioning or record_frequency
+        ):
+            raise ValueError(
+                "sample_buffer_size can't be used with energy_poll_interval, energy_on_change, "
+                "thread_cpu_weighting, cgroup_apportioning or record_frequency.")
+        if sampler not in ("setprofile", "signal", "threads"):
+            raise ValueError(
+                f"Unknown sampler {sampler!r}, must be setprofile, signal or threads.")
+        if sampler != "setprofile" and (
+            energy_interval or energy_on_change or sample_buffer_size or async_mode != "disabled"
+        ):
+            raise ValueError(
+                f'sampler="{sampler}" can\'t be used with energy_interval, energy_on_change, '
+                "sample_buffer_size or async_mode.")
+        if sampler == "threads" and (
+            energy_poll_interval or thread_cpu_weighting or cgroup_apportioning or record_frequency
+        ):
+            raise ValueError(
+                'sampler="threads" can\'t be used with energy_poll_interval, '
+                "thread_cpu_weighting, cgroup_apportioning or record_frequency.")
+
         self._interval = interval
+        self._energy_interval = energy_interval
+        self._energy_poll_interval = energy_poll_interval
+        self._energy_on_change = energy_on_change
+        self._thread_cpu_weighting = thread_cpu_weighting
+        self._cgroup_apportioning = cgroup_apportioning
+        self._record_frequency = record_frequency
+        self._sample_buffer_size = sample_buffer_size
+        self._sampler_type = sampler
         self._last_session = None
         self._active_session = None
         self._async_mode = async_mode
 
-        self.domain = energy.parse_domain(package, component)
-        self.current_energy = energy.Energy(self.domain).current_energy
+        self.backend = energy.get_backend(backend)
+        if (energy_interval or energy_poll_interval) and not self.backend.native:
+            raise ValueError(
+                "energy_interval and energy_poll_interval require a native energy backend, "
+                "e.g. powercap.")
+
+        self._calibrate_idle = calibrate_idle
+        # with package="auto", the packages are checked again before each
+        # profile, in case the process was moved to other CPUs since
+        self._auto_package = domains is None and str(package) == energy.AUTO_PACKAGE
+        self._component = component
+
+        if domains is None:
+            self._open_domains([energy.parse_domain(package, component, self.backend)])
+        else:
+            self._open_domains(energy.parse_domains(domains, self.backend))
+        if sampler == "threads" and len(self.all_domain_names) > 1:
+            self.close()
+            raise ValueError('sampler="threads" records a single energy domain.')
+
+    def _open_domains(self, domains: list[list[str]]):
+        self.domains = domains
+        self.domain = self.domains[0]
+        self.domain_names = energy.domain_names(self.domain, self.backend)
+        self.energy_counters = [energy.Energy(domain, self.backend) for domain in self.domains]
+        self.energy_counter = self.energy_counters[0]
+        # the domains recorded by each sample, including the per-package
+        # breakdown of the energy.ALL_PACKAGES domain
+        self.all_domain_names = [
+            names for counter in self.energy_counters for names in counter.column_names()
+        ]
+        self.idle_power = energy.idle_power(self.energy_counters) if self._calibrate_idle else None
+
+    def _check_auto_package(self):
+        domain = energy.parse_domain(energy.AUTO_PACKAGE, self._component, self.backend)
+        if domain != self.domain or (
+            domain == [energy.AUTO_PACKAGE]
+            and energy.affinity_package_domains(self.backend) != self.energy_counter.parts
+        ):
+            self.close()
+            self._open_domains([domain])
 
     @property
-    def interval(self) -> float:
+    def interval(self) -> float | None:
         """
         The minimum time, in seconds, between each stack sample. This translates into the
-        resolution of the sampling.
+        resolution of the sampling. The time is measured with a cheap wall-clock timer, the
+        energy counter is only read when a sample is taken. Also available as
+        :attr:`time_interval`.
+        """
+        return self._interval
+
+    @property
+    def time_interval(self) -> float | None:
+        """
+        Alias for :attr:`interval`.
         """
         return self._interval
 
+    @property
+    def energy_interval(self) -> float | None:
+        """
+        If set, a stack sample is also taken every time this amount of energy, in joules, has
+        been consumed. This requires reading the energy counter on every call and return, so it
+        is more expensive than :attr:`interval`. Set ``interval`` to ``None`` to sample on energy
+        only.
+        """
+        return self._energy_interval
+
+    @property
+    def energy_poll_interval(self) -> float | None:
+        """
+        If set, the energy counter is read by a background thread every
+        ``energy_poll_interval`` seconds, instead of on the profiled thread.
+        Samples then only record a timestamp, and their energy is
+        interpolated from the polled readings when the profiler stops.
+
+        The readings are buffered in memory until then, up to about a million
+        readings per counter (17 minutes at 1ms). Beyond that, every other
+        reading is dropped and the polling interval doubles, with a warning,
+        so the memory stays bounded in long profiles.
+        """
+        return self._energy_poll_interval
+
+    @property
+    def energy_on_change(self) -> bool:
+        """
+        If set, samples are only recorded once the energy counter has
+        changed, which happens about every millisecond. The change is shared
+        between the samples taken since the previous one, by wall-clock time,
+        rather than all going to the last sample. Only the energy of the
+        first domain is shared out this way.
+        """
+        return self._energy_on_change
+
+    @property
+    def thread_cpu_weighting(self) -> bool:
+        """
+        If set, the profiled thread is only charged with its share of the
+        energy, by CPU time: each sample's energy is scaled by the CPU time
+        of the profiled thread over the CPU time of the whole process since
+        the previous sample. Energy counters measure the whole package, so
+        without this, profiling several busy threads at once counts the
+        package's energy once per thread.
+        """
+        return self._thread_cpu_weighting
+
+    @property
+    def cgroup_apportioning(self) -> bool:
+        """
+        If set, the energy of each sample is also apportioned to this
+        process's cgroup (e.g. its container), by the cgroup's share of the
+        host's busy CPU time during the sample, see
+        :class:`~joulehunter.cgroup.CgroupCpuShare`. The apportioned energy
+        of each domain is recorded next to the raw energy, as domains named
+        e.g. ``package-0 (cgroup)``.
+        """
+        return self._cgroup_apportioning
+
+    @property
+    def record_frequency(self) -> bool:
+        """
+        If set, each sample also records the core that the profiled thread
+        ran on and that core's frequency, see
+        :class:`~joulehunter.cpufreq.CpuFrequencyReader`. They are kept in
+        :attr:`Session.cpu_records`, and summed up per frame by
+        :meth:`Session.frequency_histograms`, to explain why the same code
+        costs a different amount of energy from run to run.
+        """
+        return self._record_frequency
+
+    @property
+    def sample_buffer_size(self) -> int:
+        """
+        If set, samples are recorded natively, into a buffer of this many
+        samples, and handed over to the profiler in batches, rather than
+        calling into Python on every sample. This makes sampling much
+        cheaper for the profiled thread. Options that read something else
+        on every sample can't be used with it. Samples are taken as usual
+        when the energy counter can't be read natively, or when each sample
+        records several domains.
+        """
+        return self._sample_buffer_size
+
+    @property
+    def sampler(self) -> SamplerType:
+        """
+        How the program is sampled.
+
+        ``setprofile``
+            Samples are taken as functions are called and return, using
+            ``sys.setprofile``, on the first call or return after each
+            interval. The time or energy since the previous sample goes to
+            the function that was running.
+
+        ``signal``
+            Samples are taken by a ``SIGPROF`` handler, which an interval
+            timer of the process's CPU time triggers, and go to the code
+            that was interrupted. Long loops that make no calls are sampled
+            while they run, and the profiled code has no per-call overhead.
+            Only available on Unix, on the main thread, and without
+            ``energy_interval``, ``energy_on_change``,
+            ``sample_buffer_size`` or ``async_mode``.
+
+        ``threads``
+            Every thread of the process is sampled by a background thread,
+            using ``sys._current_frames()``, so threads started elsewhere,
+            like the workers of a thread pool, are profiled too. Each
+            interval's energy is shared between the threads by the CPU time
+            they used, and their call stacks are rooted under an
+            ``[all threads]`` frame. The profiled threads have no overhead.
+            It has the restrictions of ``signal``, except for the main
+            thread, and records a single energy domain, without
+            ``energy_poll_interval``, ``thread_cpu_weighting``,
+            ``cgroup_apportioning`` or ``record_frequency``.
+        """
+        return self._sampler_type
+
+    def _get_sampler(self) -> StackSampler | SignalSampler | ThreadSampler:
+        if self._sampler_type == "signal":
+            return get_signal_sampler()
+        elif self._sampler_type == "threads":
+            return get_thread_sampler()
+        return get_stack_sampler()
+
     @property
     def async_mode(self) -> AsyncMode:
         """
@@ -106,18 +401,14 @@ class Profiler:
         """
         return self._last_session
 
-    @property
-    def domain_names(self) -> list[str]:
-        return [energy.domain_name(self.domain[:index+1])
-                for index in range(len(self.domain))]
-
     def start(self, caller_frame: types.FrameType | None = None):
         """
         Instructs the profiler to start - to begin observing the program's execution and recording
         frames.
 
         The normal way to invoke ``start()`` is with a new instance, but you can restart a Profiler
-        that was previously running, too. The sessions are combined.
+        that was previously running, too. The sessions are combined, unless they recorded
+        different energy domains.
 
         :param caller_frame: Set this to override the default behaviour of treating the caller of
             ``start()`` as the 'start_call_stack' - the instigator of the profile. Most
@@ -131,19 +422,53 @@ class Profiler:
         if caller_frame is None:
             caller_frame = inspect.currentframe().f_back  # type: ignore
 
+        if self._auto_package:
+            self._check_auto_package()
+
+        energy_poller = None
+        if self.energy_poll_interval:
+            energy_poller = energy.EnergyPoller(
+                self.energy_counters, self.energy_poll_interval)
+            energy_poller.start()
+
+        start_call_stack = build_call_stack(caller_frame, "initial", None)
+        if self._sampler_type == "threads":
+            start_call_stack.insert(0, ALL_THREADS_FRAME_IDENTIFIER)
+
         try:
             self._active_session = ActiveProfilerSession(
                 start_time=time.time(),
-                start_call_stack=build_call_stack(
-                    caller_frame, "initial", None),
+                start_call_stack=start_call_stack,
+                energy_poller=energy_poller,
+                energy_counters=(
+                    self.energy_counters
+                    if len(self.all_domain_names) > 1 and not energy_poller
+                    else None
+                ),
+                idle_power=self.idle_power,
+                thread_cpu_weighting=self.thread_cpu_weighting,
+                cgroup_cpu_share=cgroup.CgroupCpuShare() if self.cgroup_apportioning else None,
+                frequency_reader=(
+                    cpufreq.CpuFrequencyReader() if self.record_frequency else None
+                ),
             )
 
             use_async_context = self.async_mode != "disabled"
-            get_stack_sampler(self.current_energy).subscribe(
-                self._sampler_saw_call_stack, self.interval, use_async_context
+            self._get_sampler().subscribe(
+                self._sampler_saw_call_stack, self.interval, use_async_context,
+                energy_counter=None if energy_poller else self.energy_counter,
+                desired_energy_interval=self.energy_interval,
+                energy_on_change=self.energy_on_change and not energy_poller,
+                # the energy of the other domains is read as each sample
+                # arrives, so it can't be batched
+                sample_buffer_size=(
+                    self.sample_buffer_size if len(self.all_domain_names) == 1 else 0
+                ),
             )
         except Exception as e:
             self._active_session = None
+            if energy_poller:
+                energy_poller.stop()
             raise e
 
     def stop(self) -> Session:
@@ -157,13 +482,33 @@ class Profiler:
             raise RuntimeError("This profiler is not currently running.")
 
         try:
-            get_stack_sampler(self.current_energy)\
-                .unsubscribe(self._sampler_saw_call_stack)
+            self._get_sampler().unsubscribe(self._sampler_saw_call_stack)
         except StackSampler.SubscriberNotFound:
             raise RuntimeError(
                 "Failed to stop profiling. Make sure that you start/stop profiling on the same thread."
             )
 
+        if self._active_session.energy_poller:
+            self._assign_polled_energy(self._active_session)
+
+        domains = self.all_domain_names
+        if self._active_session.idle_power is not None:
+            self._subtract_idle_power(self._active_session)
+            domains = domains + [
+                names[:-1] + [f"{names[-1]} (dynamic)"] for names in self.all_domain_names
+            ]
+        if self._active_session.cgroup_cpu_share:
+            self._apportion_to_cgroup(self._active_session)
+            domains = domains + [
+                names[:-1] + [f"{names[-1]} (cgroup)"] for names in domains
+            ]
+        if self._active_session.cpu_time_weights is not None:
+            self._apply_cpu_time_weights(self._active_session)
+        cpu_records = None
+        if self._active_session.frequency_reader:
+            self._active_session.frequency_reader.close()
+            cpu_records = self._active_session.cpu_records
+
         session = Session(
             frame_records=self._active_session.frame_records,
             start_time=self._active_session.start_time,
@@ -171,13 +516,22 @@ class Profiler:
             sample_count=len(self._active_session.frame_records),
             program=" ".join(sys.argv),
             start_call_stack=self._active_session.start_call_stack,
-            domain_names=self.domain_names
+            domain_names=self.domain_names,
+            domains=domains,
+            cpu_records=cpu_records,
         )
         self._active_session = None
 
         if self.last_session is not None:
-            # include the previous session's data too
-            session = Session.combine(self.last_session, session)
+            if self.last_session.domains != session.domains:
+                # e.g. package="auto" moved to other packages since
+                warnings.warn(
+                    "The previous session recorded other energy domains, so it can't be "
+                    "combined with this one and is discarded."
+                )
+            else:
+                # include the previous session's data too
+                session = Session.combine(self.last_session, session)
 
         self._last_session = session
 
@@ -199,6 +553,17 @@ class Profiler:
 
         self._last_session = None
 
+    def close(self):
+        """
+        Closes the energy counters of this profiler, giving their handles
+        back to :data:`~joulehunter.energy.counter_pool`. The profiler can't
+        be started again, but its last session can still be rendered.
+        """
+        if self.is_running:
+            raise RuntimeError("This profiler is still running.")
+        for counter in self.energy_counters:
+            counter.close()
+
     def __enter__(self):
         """
         Context manager support.
@@ -220,6 +585,113 @@ class Profiler:
     def __exit__(self, *args: Any):
         self.stop()
 
+    def _assign_polled_energy(self, active_session: ActiveProfilerSession):
+        energy_poller = active_session.energy_poller
+        assert energy_poller
+        energy_poller.stop()
+
+        if energy_poller.dropped:
+            warnings.warn(
+                "The energy poller's buffer was full, so it was downsampled to a reading "
+                f"every {energy_poller.interval * 1000:g} ms. The energy of short samples is "
+                "less precise."
+            )
+
+        columns = energy_poller.interpolate_columns(
+            [active_session.start_timestamp] + active_session.sample_timestamps)
+
+        frame_records: list[FrameRecordType] = []
+        for index, (call_stack, _, wall_time) in enumerate(active_session.frame_records):
+            deltas = [end - start for start, end in zip(columns[index], columns[index + 1])]
+            frame_records.append(
+                (call_stack, deltas[0] if len(deltas) == 1 else deltas, wall_time))
+        active_session.frame_records = frame_records
+
+    def _subtract_idle_power(self, active_session: ActiveProfilerSession):
+        idle_power = active_session.idle_power
+        assert idle_power is not None
+
+        frame_records: list[FrameRecordType] = []
+        for call_stack, energy_sample, wall_time in active_session.frame_records:
+            columns = (
+                [energy_sample] if isinstance(energy_sample, (int, float)) else list(energy_sample)
+            )
+            # the counters update in steps, so a single sample's dynamic
+            # energy can be negative. It evens out over a frame's samples
+            dynamic_columns = [
+                column - power * wall_time for column, power in zip(columns, idle_power)
+            ]
+            frame_records.append((call_stack, columns + dynamic_columns, wall_time))
+        active_session.frame_records = frame_records
+
+    def _apportion_to_cgroup(self, active_session: ActiveProfilerSession):
+        assert active_session.cgroup_cpu_share
+        active_session.cgroup_cpu_share.close()
+
+        frame_records: list[FrameRecordType] = []
+        for (call_stack, energy_sample, wall_time), share in zip(
+            active_session.frame_records, active_session.cgroup_shares
+        ):
+            columns = (
+                [energy_sample] if isinstance(energy_sample, (int, float)) else list(energy_sample)
+            )
+            frame_records.append(
+                (call_stack, columns + [column * share for column in columns], wall_time))
+        active_session.frame_records = frame_records
+
+    def _apply_cpu_time_weights(self, active_session: ActiveProfilerSession):
+        cpu_time_weights = active_session.cpu_time_weights
+        assert cpu_time_weights is not None
+
+        frame_records: list[FrameRecordType] = []
+        for (call_stack, energy_sample, wall_time), weight in zip(
+            active_session.frame_records, cpu_time_weights
+        ):
+            if isinstance(energy_sample, (int, float)):
+                frame_records.append((call_stack, energy_sample * weight, wall_time))
+            else:
+                frame_records.append(
+                    (call_stack, [column * weight for column in energy_sample], wall_time))
+        active_session.frame_records = frame_records
+
+    def _cpu_time_weight(self, active_session: ActiveProfilerSession) -> float:
+        thread_time, process_time = time.thread_time(), time.process_time()
+        last_thread_time, last_process_time = active_session.last_cpu_times
+        active_session.last_cpu_times = (thread_time, process_time)
+
+        if process_time > last_process_time:
+            active_session.last_cpu_time_weight = min(
+                1.0, (thread_time - last_thread_time) / (process_time - last_process_time)
+            )
+        # otherwise no CPU time was used since the previous sample, e.g.
+        # samples sent together by energy_on_change, so its share still holds
+        return active_session.last_cpu_time_weight
+
+    def _read_energy_columns(
+        self, active_session: ActiveProfilerSession, time_since_last_sample: float
+    ) -> list[float]:
+        counters = active_session.energy_counters
+        primary_counter = counters[0]
+        if not primary_counter.is_aggregate:
+            # only the sampler's own reading of the first domain is recorded
+            primary_values = active_session.last_readings[0]
+        elif self._get_sampler().current_energy_counter is primary_counter:
+            # the sampler has just read every package to time this sample
+            primary_values = primary_counter.last_values
+        else:
+            primary_values = primary_counter.read()
+
+        readings = [primary_values] + energy.Energy.read_all(counters[1:])
+        deltas = [
+            [(value - last) / 10**6 for value, last in zip(values, last_values)]
+            for values, last_values in zip(readings, active_session.last_readings)
+        ]
+        active_session.last_readings = readings
+
+        columns = energy.energy_columns(counters, deltas)
+        columns[0] = time_since_last_sample
+        return columns
+
     # pylint: disable=W0613
     def _sampler_saw_call_stack(
         self,
@@ -232,6 +704,11 @@ class Profiler:
                 "Received a call stack without an active session. Please file an issue on joulehunter Github describing how you made this happen!"
             )
 
+        energy_sample: float | list[float] = time_since_last_sample
+        if self._active_session.energy_counters:
+            energy_sample = self._read_energy_columns(self._active_session, time_since_last_sample)
+        wall_time = self._get_sampler().sample_wall_time
+
         if (
             async_state
             and async_state.state == "out_of_context_awaited"
@@ -241,7 +718,8 @@ class Profiler:
             self._active_session.frame_records.append(
                 (
                     awaiting_coroutine_stack + [AWAIT_FRAME_IDENTIFIER],
-                    time_since_last_sample,
+                    energy_sample,
+                    wall_time,
                 )
             )
         elif (
@@ -253,13 +731,26 @@ class Profiler:
             self._active_session.frame_records.append(
                 (
                     context_exit_frame + [OUT_OF_CONTEXT_FRAME_IDENTIFIER],
-                    time_since_last_sample,
+                    energy_sample,
+                    wall_time,
                 )
             )
         else:
             # regular sync code
             self._active_session.frame_records.append(
-                (call_stack, time_since_last_sample))
+                (call_stack, energy_sample, wall_time))
+
+        if self._active_session.energy_poller:
+            self._active_session.sample_timestamps.append(time.monotonic_ns())
+        if self._active_session.cpu_time_weights is not None:
+            self._active_session.cpu_time_weights.append(
+                self._cpu_time_weight(self._active_session))
+        if self._active_session.cgroup_cpu_share:
+            self._active_session.cgroup_shares.append(
+                self._active_session.cgroup_cpu_share.share())
+        if self._active_session.frequency_reader:
+            self._active_session.cpu_records.append(
+                self._active_session.frequency_reader.read())
 
     def print(
         self,
@@ -269,8 +760,9 @@ class Profiler:
         color: bool | None = None,
         show_all: bool = False,
         timeline: bool = False,
+        metric: str = "energy",
     ):
-        """print(file=sys.stdout, *, unicode=None, color=None, show_all=False, timeline=False)
+        """print(file=sys.stdout, *, unicode=None, color=None, show_all=False, timeline=False, metric="energy")
 
         Print the captured profile to the console.
 
@@ -279,6 +771,7 @@ class Profiler:
         :param color: Override ANSI color support detection.
         :param show_all: Sets the ``show_all`` parameter on the renderer.
         :param timeline: Sets the ``timeline`` parameter on the renderer.
+        :param metric: Sets the ``metric`` parameter on the renderer.
         """
         if unicode is None:
             unicode = file_supports_unicode(file)
@@ -291,6 +784,7 @@ class Profiler:
                 color=color,
                 show_all=show_all,
                 timeline=timeline,
+                metric=metric,
             ),
             file=file,
         )
@@ -301,29 +795,34 @@ class Profiler:
         color: bool = False,
         show_all: bool = False,
         timeline: bool = False,
+        metric: str = "energy",
     ) -> str:
         """
         Return the profile output as text, as rendered by :class:`ConsoleRenderer`
         """
         return self.output(
             renderer=renderers.ConsoleRenderer(
-                unicode=unicode, color=color, show_all=show_all, timeline=timeline
+                unicode=unicode,
+                color=color,
+                show_all=show_all,
+                timeline=timeline,
+                metric=metric,
             )
         )
 
-    def output_html(self, timeline: bool = False) -> str:
+    def output_html(self, timeline: bool = False, metric: str = "energy") -> str:
         """
         Return the profile output as HTML, as rendered by :class:`HTMLRenderer`
         """
-        return self.output(renderer=renderers.HTMLRenderer(timeline=timeline))
+        return self.output(renderer=renderers.HTMLRenderer(timeline=timeline, metric=metric))
 
-    def open_in_browser(self, timeline: bool = False):
+    def open_in_browser(self, timeline: bool = False, metric: str = "energy"):
         """
         Opens the last profile session in your web browser.
         """
         session = self._get_last_session_or_fail()
 
-        return renderers.HTMLRenderer(timeline=timeline).open_in_browser(session)
+        return renderers.HTMLRenderer(timeline=timeline, metric=metric).open_in_browser(session)
 
     def output(self, renderer: renderers.Renderer) -> str:
         """
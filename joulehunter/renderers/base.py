@@ -3,7 +3,7 @@ from __future__ import annotations
 from typing import Any, List
 
 from joulehunter import processors
-from joulehunter.frame import BaseFrame
+from joulehunter.frame import METRICS, BaseFrame
 from joulehunter.session import Session
 
 # pyright: strict
@@ -34,16 +34,27 @@ class Renderer:
         show_all: bool = False,
         timeline: bool = False,
         processor_options: dict[str, Any] | None = None,
+        domain: int = 0,
+        metric: str = "energy",
     ):
         """
         :param show_all: Don't hide library frames - show everything that joulehunter captures.
         :param timeline: Instead of aggregating time, leave the samples in chronological order.
         :param processor_options: A dictionary of processor options.
+        :param domain: The index of the energy domain to render, for sessions that measured
+            several domains.
+        :param metric: What to sort and colour frames by: ``"energy"``, wall-clock ``"time"``
+            or mean ``"power"``.
         """
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric {metric!r}, expected one of {', '.join(METRICS)}")
+
         # processors is defined on the base class to provide a common way for users to
         # add to and manipulate them before calling render()
         self.processors = self.default_processors()
         self.processor_options = processor_options or {}
+        self.domain = domain
+        self.metric = metric
 
         if show_all:
             self.processors.remove(processors.group_library_frames_processor)
@@ -58,8 +69,9 @@ class Renderer:
 
     def preprocess(self, root_frame: BaseFrame | None) -> BaseFrame | None:
         frame = root_frame
+        options = {"metric": self.metric, **self.processor_options}
         for processor in self.processors:
-            frame = processor(frame, options=self.processor_options)
+            frame = processor(frame, options=options)
         return frame
 
     def render(self, session: Session) -> str:
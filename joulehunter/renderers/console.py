@@ -8,6 +8,8 @@ from joulehunter.util import truncate
 
 # pyright: strict
 
+METRIC_UNITS = {"energy": "J", "time": "s", "power": "W"}
+
 
 class ConsoleRenderer(Renderer):
     """
@@ -29,15 +31,16 @@ class ConsoleRenderer(Renderer):
     def render(self, session: Session):
         result = self.render_preamble(session)
 
-        frame = self.preprocess(session.root_frame())
+        frame = self.preprocess(session.root_frame(domain=self.domain))
 
         if frame is None:
             result += "No samples were recorded.\n\n"
             return result
 
         self.root_frame = frame
-        result += self.render_frame(
-            self.root_frame, total_energy=self.root_frame.time())
+        # percentages only make sense for the metrics that add up
+        total = None if self.metric == "power" else self.root_frame.metric(self.metric)
+        result += self.render_frame(self.root_frame, total_energy=total)
         result += "\n"
 
         return result
@@ -52,12 +55,13 @@ class ConsoleRenderer(Renderer):
             f"{c.bold}{c.cyan}|/                                {c.end}{c.end}",
         ]
         lines[1] += f"{c.cyan}Duration:{c.end} {session.duration:<12.3f}"
-        lines[2] += f"{c.cyan}Package:{c.end}  {session.domain_names[0]:<12}"
+        domain_names = session.domains[self.domain]
+        lines[2] += f"{c.cyan}Package:{c.end}  {domain_names[0]:<12}"
         lines[3] += f"{c.cyan}Program:{c.end}  {session.program}"
 
         lines[1] += f"{c.cyan}Samples:{c.end}   {session.sample_count}"
-        if len(session.domain_names) == 2:
-            lines[2] += f"{c.cyan}Component:{c.end} {session.domain_names[1]}"
+        if len(domain_names) == 2:
+            lines[2] += f"{c.cyan}Component:{c.end} {domain_names[1]}"
         lines.append("")
         lines.append("")
 
@@ -73,10 +77,11 @@ class ConsoleRenderer(Renderer):
             or frame.total_self_time > 0.2 * self.root_frame.time()
             or frame in frame.group.exit_frames
         ):
+            value = frame.metric(self.metric)
             time_str = (self._ansi_color_for_time(frame)
-                        + f"{frame.time():.3f} J")
+                        + f"{value:.3f} {METRIC_UNITS[self.metric]}")
             if total_energy:
-                percentage = frame.time() / total_energy * 100
+                percentage = value / total_energy * 100
                 time_str += f" [{percentage:.1f}%]"
             time_str += self.colors.end
             function_color = self._ansi_color_for_function(frame)
@@ -123,7 +128,21 @@ class ConsoleRenderer(Renderer):
         return result
 
     def _ansi_color_for_time(self, frame: BaseFrame):
-        proportion_of_total = frame.time() / self.root_frame.time()
+        if self.metric == "power":
+            # frames drawing more power than the program as a whole stand out
+            mean_power = self.root_frame.mean_power()
+            ratio = frame.mean_power() / mean_power if mean_power else 0
+            if ratio > 1.5:
+                return self.colors.red
+            elif ratio > 1.1:
+                return self.colors.yellow
+            elif ratio > 0.9:
+                return self.colors.green
+            else:
+                return self.colors.bright_green + self.colors.faint
+
+        total = self.root_frame.metric(self.metric)
+        proportion_of_total = frame.metric(self.metric) / total if total else 0
 
         if proportion_of_total > 0.6:
             return self.colors.red
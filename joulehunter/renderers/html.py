@@ -15,6 +15,30 @@ from joulehunter.session import Session
 # pyright: strict
 
 
+DOMAIN_PICKER_HTML = """
+<div style="font-family: sans-serif; font-size: 13px; padding: 6px 10px;">
+    <label for="domain-picker">Domain:</label>
+    <select id="domain-picker"></select>
+</div>
+<script>
+    window.addEventListener("DOMContentLoaded", function () {
+        var picker = document.getElementById("domain-picker");
+        window.profileSessions.forEach(function (session, index) {
+            var option = document.createElement("option");
+            option.value = index;
+            option.text = session.component ? session.package + "/" + session.component : session.package;
+            option.selected = session === window.profileSession;
+            picker.appendChild(option);
+        });
+        picker.addEventListener("change", function () {
+            window.profileSession = window.profileSessions[picker.value];
+            window.App.session = window.profileSession;
+        });
+    });
+</script>
+"""
+
+
 class HTMLRenderer(Renderer):
     """
     Renders a rich, interactive web page, as a string of HTML.
@@ -37,7 +61,18 @@ class HTMLRenderer(Renderer):
         with open(os.path.join(resources_dir, "app.js"), encoding="utf-8") as f:
             js = f.read()
 
-        session_json = self.render_json(session)
+        if len(session.domains) > 1:
+            # render every domain, with a picker that swaps the session shown
+            # by the app
+            session_jsons = [
+                self.render_json(session, domain=domain) for domain in range(len(session.domains))
+            ]
+            session_script = "window.profileSessions = [%s]\n" % ",".join(session_jsons)
+            session_script += "window.profileSession = window.profileSessions[%d]" % self.domain
+            domain_picker = DOMAIN_PICKER_HTML
+        else:
+            session_script = "window.profileSession = %s" % self.render_json(session)
+            domain_picker = ""
 
         page = """<!DOCTYPE html>
             <html>
@@ -45,16 +80,17 @@ class HTMLRenderer(Renderer):
                 <meta charset="utf-8">
             </head>
             <body>
+                {domain_picker}
                 <div id="app"></div>
                 <script>
-                    window.profileSession = {session_json}
+                    {session_script}
                 </script>
                 <script>
                     {js}
                 </script>
             </body>
             </html>""".format(
-            js=js, session_json=session_json
+            js=js, session_script=session_script, domain_picker=domain_picker
         )
 
         return page
@@ -81,8 +117,9 @@ class HTMLRenderer(Renderer):
         webbrowser.open(url)
         return output_filename
 
-    def render_json(self, session: Session):
-        json_renderer = JSONRenderer()
+    def render_json(self, session: Session, domain: int | None = None):
+        json_renderer = JSONRenderer(
+            domain=self.domain if domain is None else domain, metric=self.metric)
         json_renderer.processors = self.processors
         json_renderer.processor_options = self.processor_options
         return json_renderer.render(session)
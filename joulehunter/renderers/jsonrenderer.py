@@ -27,6 +27,7 @@ class JSONRenderer(Renderer):
 
     def __init__(self, **kwargs: Any):
         super().__init__(**kwargs)
+        self._frequency_histograms: dict[str, dict[int, int]] = {}
 
     def render_frame(self, frame: BaseFrame | None):
         if frame is None:
@@ -41,6 +42,18 @@ class JSONRenderer(Renderer):
         property_decls.append('"line_no": %d' % frame.line_no)
         property_decls.append('"time": %f' % frame.time())
         property_decls.append('"await_time": %f' % frame.await_time())
+        property_decls.append('"wall_time": %f' % frame.wall_time())
+        property_decls.append('"mean_power": %f' % frame.mean_power())
+        domain_times = frame.domain_times()
+        if domain_times:
+            property_decls.append(
+                '"domain_times": [%s]' % ",".join("%f" % t for t in domain_times))
+        histogram = self._frequency_histograms.get(frame.identifier)
+        if histogram:
+            property_decls.append(
+                '"frequencies": {%s}'
+                % ",".join('"%d": %d' % item for item in sorted(histogram.items()))
+            )
         property_decls.append(
             '"is_application_code": %s' % encode_bool(frame.is_application_code or False)
         )
@@ -57,7 +70,9 @@ class JSONRenderer(Renderer):
         return "{%s}" % ",".join(property_decls)
 
     def render(self, session: Session):
-        frame = self.preprocess(session.root_frame())
+        self._frequency_histograms = session.frequency_histograms()
+        frame = self.preprocess(session.root_frame(domain=self.domain))
+        domain_names = session.domains[self.domain]
 
         property_decls: list[str] = []
         property_decls.append('"start_time": %f' % session.start_time)
@@ -65,12 +80,18 @@ class JSONRenderer(Renderer):
         property_decls.append('"sample_count": %d' % session.sample_count)
         property_decls.append('"program": %s' % encode_str(session.program))
         property_decls.append(
-            '"package": %s' % encode_str(session.domain_names[0]))
-        if len(session.domain_names) == 2:
+            '"package": %s' % encode_str(domain_names[0]))
+        if len(domain_names) == 2:
             property_decls.append(
-                '"component": %s' % encode_str(session.domain_names[1]))
+                '"component": %s' % encode_str(domain_names[1]))
         else:
             property_decls.append('"component": null')
+        property_decls.append('"domain": %d' % self.domain)
+        property_decls.append('"metric": %s' % encode_str(self.metric))
+        property_decls.append(
+            '"domains": [%s]' % ",".join(
+                "[%s]" % ",".join(encode_str(name) for name in names)
+                for names in session.domains))
         property_decls.append('"root_frame": %s' % self.render_frame(frame))
 
         return "{%s}\n" % ",".join(property_decls)
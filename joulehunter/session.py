@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import json
 from collections import deque
-from typing import Any, List, Tuple, cast
+from typing import Any, List, Sequence, Tuple, Union, cast
 
 from joulehunter.frame import BaseFrame, DummyFrame, Frame, SelfTimeFrame
 from joulehunter.typing import PathOrStr
@@ -15,7 +15,13 @@ ASSERTION_MESSAGE = (
     "let me know how you caused this error!"
 )
 
-FrameRecordType = Tuple[List[str], float]
+# the energy of a record is a float, or a list with one float per domain when
+# the session recorded several energy domains. It's followed by the wall-clock
+# time of the record in seconds, which records saved by older versions lack.
+FrameRecordType = Union[
+    Tuple[List[str], Union[float, Sequence[float]]],
+    Tuple[List[str], Union[float, Sequence[float]], float],
+]
 
 
 class Session:
@@ -28,6 +34,8 @@ class Session:
         start_call_stack: list[str],
         program: str,
         domain_names: list[str],
+        domains: list[list[str]] | None = None,
+        cpu_records: list[tuple[int, int]] | None = None,
     ):
         """Session()
 
@@ -42,6 +50,10 @@ class Session:
         self.start_call_stack = start_call_stack
         self.program = program
         self.domain_names = domain_names
+        self.domains = domains or [domain_names]
+        # the core of each frame record, and its frequency in kHz (0 if
+        # unknown), when the session recorded them
+        self.cpu_records = cpu_records
 
     @staticmethod
     def load(filename: PathOrStr) -> Session:
@@ -72,6 +84,8 @@ class Session:
             "start_call_stack": self.start_call_stack,
             "program": self.program,
             "domain_names": self.domain_names,
+            "domains": self.domains,
+            "cpu_records": self.cpu_records,
         }
 
     @staticmethod
@@ -84,6 +98,8 @@ class Session:
             start_call_stack=json_dict["start_call_stack"],
             program=json_dict["program"],
             domain_names=json_dict["domain_names"],
+            domains=json_dict.get("domains"),
+            cpu_records=json_dict.get("cpu_records"),
         )
 
     @staticmethod
@@ -95,8 +111,16 @@ class Session:
         as timelines, because the samples are simply concatenated. But
         aggregate views (the default) of this data will work.
 
+        :raises ValueError: If the sessions recorded different energy domains,
+            e.g. a profiler with ``package="auto"`` that moved to another
+            package, as their records can't be added up.
         :rtype: Session
         """
+        if session1.domains != session2.domains:
+            raise ValueError(
+                "Can't combine sessions that recorded different energy domains, "
+                f"{session1.domains} and {session2.domains}.")
+
         if session1.start_time > session2.start_time:
             # swap them around so that session1 is the first one
             session1, session2 = session2, session1
@@ -109,23 +133,75 @@ class Session:
             start_call_stack=session1.start_call_stack,
             program=session1.program,
             domain_names=session1.domain_names,
+            domains=session1.domains,
+            cpu_records=(
+                session1.cpu_records + session2.cpu_records
+                if session1.cpu_records is not None and session2.cpu_records is not None
+                else None
+            ),
         )
 
-    def root_frame(self, trim_stem: bool = True) -> BaseFrame | None:
+    def domain_label(self, domain: int = 0) -> str:
+        """
+        A name for the energy domain at index ``domain``, e.g. ``package-0/dram``.
+        """
+        return "/".join(self.domains[domain])
+
+    def frequency_histograms(self, bin_size: int = 100) -> dict[str, dict[int, int]]:
+        """
+        Counts the samples of each frame by the frequency of the core they
+        ran on, from :attr:`cpu_records`.
+
+        :param bin_size: The width of each bin, in MHz.
+        :return: For each frame identifier, the number of samples in each
+            bin, keyed by the bin's lowest frequency in MHz. A frame counts
+            every sample it is on the stack of, once. Samples whose
+            frequency is unknown are left out. Empty if the session didn't
+            record frequencies.
+        """
+        histograms: dict[str, dict[int, int]] = {}
+        if not self.cpu_records:
+            return histograms
+
+        for frame_tuple, (_, frequency) in zip(self.frame_records, self.cpu_records):
+            if not frequency:
+                continue
+            frequency_bin = frequency // 1000 // bin_size * bin_size
+            for identifier in set(frame_tuple[0]):
+                histogram = histograms.setdefault(identifier, {})
+                histogram[frequency_bin] = histogram.get(frequency_bin, 0) + 1
+
+        return histograms
+
+    def root_frame(self, trim_stem: bool = True, domain: int = 0) -> BaseFrame | None:
         """
         Parses the internal frame records and returns a tree of :class:`Frame`
         objects. This object can be renderered using a :class:`Renderer`
         object.
 
+        :param domain: When several energy domains were recorded, the index
+            of the domain whose energy is used as the frames' time. The
+            energy of every domain remains available with
+            :meth:`Frame.domain_times`.
         :rtype: A :class:`Frame` object, or None if the session is empty.
         """
+        if not 0 <= domain < len(self.domains):
+            raise IndexError(f"This session has no energy domain {domain}")
+
         root_frame = None
 
         frame_stack: list[BaseFrame] = []
 
         for frame_tuple in self.frame_records:
             identifier_stack = frame_tuple[0]
-            time = frame_tuple[1]
+            energy = frame_tuple[1]
+            wall_time = frame_tuple[2] if len(frame_tuple) > 2 else 0.0
+            if isinstance(energy, (int, float)):
+                time = energy
+                domain_times: Sequence[float] = ()
+            else:
+                time = energy[domain]
+                domain_times = energy
 
             stack_depth = 0
 
@@ -154,9 +230,11 @@ class Session:
             # assign the time to the final frame in the stack
             final_frame = frame_stack[-1]
             if isinstance(final_frame, DummyFrame):
-                final_frame.self_time += time
+                final_frame.add_self_time(time, domain_times, wall_time)
             elif isinstance(final_frame, Frame):
-                final_frame.add_child(SelfTimeFrame(self_time=time))
+                final_frame.add_child(
+                    SelfTimeFrame(
+                        self_time=time, self_domain_times=domain_times, self_wall_time=wall_time))
             else:
                 raise Exception("unknown frame type")
 
@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+import signal
+import threading
+import timeit
+import types
+from typing import Any
+
+from joulehunter.energy import Energy
+from joulehunter.stack_sampler import (
+    StackSampler,
+    StackSamplerSubscriber,
+    StackSamplerSubscriberTarget,
+    build_call_stack,
+)
+
+# pyright: strict
+
+
+class SignalSampler:
+    """
+    Samples the main thread from a ``SIGPROF`` handler, driven by
+    ``setitimer(ITIMER_PROF)``, rather than on calls and returns like
+    :class:`StackSampler`. The handler sees the frame that was interrupted,
+    so a loop that makes no calls is still sampled while it runs, and the
+    profiled code has no per-call overhead.
+
+    The timer counts the CPU time of the process, so no samples are taken
+    while it sleeps: the energy used meanwhile goes to the next sample.
+    Samples are only taken on the main thread, between bytecodes, so a long
+    call into C code is sampled when it returns to Python, in its caller.
+    """
+
+    SubscriberNotFound = StackSampler.SubscriberNotFound
+
+    subscribers: list[StackSamplerSubscriber]
+    current_sampling_interval: float | None
+    current_energy_counter: Energy | None
+    last_profile_time: float
+    last_wall_time: float
+    sample_wall_time: float
+    timer_func: Any
+
+    def __init__(self) -> None:
+        self.subscribers = []
+        self.current_sampling_interval = None
+        self.current_energy_counter = None
+        self.last_profile_time = 0.0
+        self.last_wall_time = 0.0
+        # the wall-clock time of the sample being sent to the subscribers
+        self.sample_wall_time = 0.0
+        self.timer_func = None
+        self._previous_handler: Any = None
+        self._handler_installed = False
+        self._in_handler = False
+
+    def subscribe(
+        self,
+        target: StackSamplerSubscriberTarget,
+        desired_interval: float | None,
+        use_async_context: bool,
+        energy_counter: Energy | None = None,
+        desired_energy_interval: float | None = None,
+        energy_on_change: bool = False,
+        sample_buffer_size: int = 0,
+    ):
+        """
+        Starts sending samples to ``target``, every ``desired_interval``
+        seconds of CPU time. Takes the same arguments as
+        :meth:`StackSampler.subscribe`, but async contexts, energy triggers,
+        ``energy_on_change`` and sample buffers aren't supported.
+        """
+        if use_async_context or desired_energy_interval or energy_on_change or sample_buffer_size:
+            raise ValueError(
+                "The signal sampler doesn't support async contexts, energy_interval, "
+                "energy_on_change or sample_buffer_size"
+            )
+        if not hasattr(signal, "setitimer"):
+            raise RuntimeError("The signal sampler isn't available on this platform")
+        if threading.current_thread() is not threading.main_thread():
+            raise RuntimeError("The signal sampler can only be used on the main thread")
+
+        self.subscribers.append(
+            StackSamplerSubscriber(
+                target=target,
+                desired_interval=desired_interval,
+                desired_energy_interval=None,
+                bound_to_async_context=False,
+                async_state=None,
+                energy_counter=energy_counter,
+            )
+        )
+        self._update()
+
+    def unsubscribe(self, target: StackSamplerSubscriberTarget):
+        try:
+            subscriber = next(
+                s for s in self.subscribers if s.target == target)  # type: ignore
+        except StopIteration:
+            raise SignalSampler.SubscriberNotFound()
+
+        self.subscribers.remove(subscriber)
+
+        self._update()
+
+    def _update(self):
+        if len(self.subscribers) == 0:
+            self._stop_sampling()
+            return
+
+        intervals = [s.desired_interval for s in self.subscribers if s.desired_interval]
+        interval = min(intervals) if intervals else 0.001
+
+        energy_counter = next(
+            (s.energy_counter for s in self.subscribers if s.energy_counter is not None), None
+        )
+
+        if (
+            self.current_sampling_interval != interval
+            or self.current_energy_counter is not energy_counter
+        ):
+            self._start_sampling(interval, energy_counter)
+
+    def _start_sampling(self, interval: float, energy_counter: Energy | None):
+        if self.current_energy_counter is not energy_counter:
+            # readings from different counters can't be subtracted
+            self.last_profile_time = 0.0
+        self.current_sampling_interval = interval
+        self.current_energy_counter = energy_counter
+        if self.last_profile_time == 0.0:
+            self.last_profile_time = self._timer()
+            self.last_wall_time = timeit.default_timer()
+
+        if not self._handler_installed:
+            self._previous_handler = signal.signal(signal.SIGPROF, self._handle_signal)
+            self._handler_installed = True
+        signal.setitimer(signal.ITIMER_PROF, interval, interval)
+
+    def _stop_sampling(self):
+        if self._handler_installed:
+            # the timer is disarmed first, so no SIGPROF arrives once the
+            # previous handler (by default, terminating the process) is back
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(
+                signal.SIGPROF,
+                signal.SIG_DFL if self._previous_handler is None else self._previous_handler,
+            )
+            self._handler_installed = False
+            self._previous_handler = None
+        self.current_sampling_interval = None
+        self.current_energy_counter = None
+        self.last_profile_time = 0.0
+
+    def _handle_signal(self, signum: int, frame: types.FrameType | None):
+        # a signal that arrives while the subscribers run would sample them
+        if self._in_handler or not self.subscribers:
+            return
+        self._in_handler = True
+        try:
+            now = self._timer()
+            time_since_last_sample = now - self.last_profile_time
+            wall_now = timeit.default_timer()
+            self.sample_wall_time = wall_now - self.last_wall_time
+            self.last_wall_time = wall_now
+
+            call_stack = build_call_stack(frame, "line", None)
+
+            for subscriber in self.subscribers:
+                subscriber.target(call_stack, time_since_last_sample, subscriber.async_state)
+
+            self.last_profile_time = now
+        finally:
+            self._in_handler = False
+
+    def _timer(self) -> float:
+        if self.timer_func:
+            return self.timer_func()
+        elif self.current_energy_counter is not None:
+            return self.current_energy_counter.current_energy()
+        else:
+            return timeit.default_timer()
+
+
+_signal_sampler: SignalSampler | None = None
+
+
+def get_signal_sampler() -> SignalSampler:
+    """
+    Gets the process's signal sampler. There's only one, as signals are
+    handled on the main thread.
+    """
+    global _signal_sampler
+    if _signal_sampler is None:
+        _signal_sampler = SignalSampler()
+    return _signal_sampler
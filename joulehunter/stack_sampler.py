@@ -1,12 +1,19 @@
 from __future__ import annotations
 
+import sys
 import threading
 import timeit
 import types
 from contextvars import ContextVar
 from typing import Any, Callable, List, NamedTuple, Optional, Union
 
-from joulehunter.low_level.stat_profile import setstatprofile
+from joulehunter.energy import Energy
+from joulehunter.low_level.stat_profile import (
+    CallStackBuilder,
+    drain_samples,
+    get_coarse_clock_resolution,
+    setstatprofile,
+)
 from joulehunter.typing import LiteralStr
 
 # pyright: strict
@@ -23,41 +30,111 @@ class StackSamplerSubscriber:
         self,
         *,
         target: StackSamplerSubscriberTarget,
-        desired_interval: float,
+        desired_interval: float | None,
+        desired_energy_interval: float | None,
         bound_to_async_context: bool,
         async_state: AsyncState | None,
+        energy_counter: Energy | None,
+        energy_on_change: bool = False,
+        sample_buffer_size: int = 0,
     ) -> None:
         self.target = target
         self.desired_interval = desired_interval
+        self.desired_energy_interval = desired_energy_interval
         self.bound_to_async_context = bound_to_async_context
         self.async_state = async_state
+        self.energy_counter = energy_counter
+        self.energy_on_change = energy_on_change
+        self.sample_buffer_size = sample_buffer_size
+
+
+class PendingSample(NamedTuple):
+    """
+    A sample whose energy isn't known yet, because the energy counter hasn't
+    changed since it was taken. Its call stack is only built once the energy
+    is known.
+    """
+
+    frame: types.FrameType
+    event: str
+    arg: Any
+    wall_time: float
+    async_states: tuple[AsyncState | None, ...]
 
 
 active_profiler_context_var: ContextVar[object | None] = ContextVar(
     "active_profiler_context_var", default=None
 )
 
+# the coarse clock is much cheaper to read, but it's only usable for
+# intervals that are long compared to its resolution (typically 1-4ms).
+COARSE_CLOCK_RESOLUTION = get_coarse_clock_resolution()
+
 
 class StackSampler:
     """Manages setstatprofile for Profilers on a single thread"""
 
     subscribers: list[StackSamplerSubscriber]
     current_sampling_interval: float | None
+    current_energy_interval: float | None
+    current_energy_counter: Energy | None
+    current_energy_on_change: bool
+    current_sample_buffer_size: int
     last_profile_time: float
-    timer_func: Callable[[], float]
+    last_wall_time: float
+    sample_wall_time: float
+    pending_samples: list[PendingSample]
+    timer_func: Callable[[], float] | None
 
-    def __init__(self, timer_func) -> None:
+    def __init__(self) -> None:
         self.subscribers = []
         self.current_sampling_interval = None
+        self.current_energy_interval = None
+        self.current_energy_counter = None
+        self.current_energy_on_change = False
+        self.current_sample_buffer_size = 0
         self.last_profile_time = 0.0
-        self.timer_func = timer_func
+        self.last_wall_time = 0.0
+        # the wall-clock time of the sample being sent to the subscribers
+        self.sample_wall_time = 0.0
+        self.pending_samples = []
+        self.timer_func = None
 
     def subscribe(
         self,
         target: StackSamplerSubscriberTarget,
-        desired_interval: float,
+        desired_interval: float | None,
         use_async_context: bool,
+        energy_counter: Energy | None = None,
+        desired_energy_interval: float | None = None,
+        energy_on_change: bool = False,
+        sample_buffer_size: int = 0,
     ):
+        """
+        Starts sending samples to ``target``. Samples are taken every
+        ``desired_interval`` seconds of wall-clock time, and every
+        ``desired_energy_interval`` joules consumed, if set. The energy
+        trigger requires an ``energy_counter``, which otherwise is only read
+        when a sample is taken.
+
+        With ``energy_on_change``, samples are held back until the energy
+        counter changes, and its increment is then spread over the samples
+        taken since its last change, in proportion to their wall-clock time.
+        Energy counters only update every millisecond or so, so this avoids
+        sending most samples with no energy and the next one with all of it.
+        The mode is used while every subscriber asks for it.
+
+        With ``sample_buffer_size``, the call stacks of the samples are
+        built natively and sent in batches of up to that many samples, so
+        sampling runs no Python code on this thread in between. This is
+        used while every subscriber asks for it, and only with no energy
+        counter or one that can be read natively, and without
+        ``energy_on_change``.
+        """
+        if (desired_energy_interval or energy_on_change) and energy_counter is None:
+            raise ValueError(
+                "desired_energy_interval and energy_on_change require an energy_counter")
+
         if use_async_context:
             if active_profiler_context_var.get() is not None:
                 raise RuntimeError(
@@ -65,13 +142,21 @@ class StackSampler:
                 )
             active_profiler_context_var.set(target)
 
+        # the held back samples are for the current subscribers only
+        self._drain_samples()
+        self._flush_pending_samples(self._timer())
+
         self.subscribers.append(
             StackSamplerSubscriber(
                 target=target,
                 desired_interval=desired_interval,
+                desired_energy_interval=desired_energy_interval,
                 bound_to_async_context=use_async_context,
                 async_state=AsyncState(
                     "in_context") if use_async_context else None,
+                energy_counter=energy_counter,
+                energy_on_change=energy_on_change,
+                sample_buffer_size=sample_buffer_size,
             )
         )
         self._update()
@@ -83,6 +168,10 @@ class StackSampler:
         except StopIteration:
             raise StackSampler.SubscriberNotFound()
 
+        # the held back samples are sent with the energy used so far
+        self._drain_samples()
+        self._flush_pending_samples(self._timer())
+
         if subscriber.bound_to_async_context:
             # (don't need to use context_var.reset() because we verified it was
             # None before we started)
@@ -97,26 +186,114 @@ class StackSampler:
             self._stop_sampling()
             return
 
-        min_subscribers_interval = min(
-            s.desired_interval for s in self.subscribers)
+        intervals = [s.desired_interval for s in self.subscribers if s.desired_interval]
+        min_subscribers_interval = min(intervals) if intervals else None
 
-        if self.current_sampling_interval != min_subscribers_interval:
-            self._start_sampling(interval=min_subscribers_interval)
+        energy_intervals = [
+            s.desired_energy_interval for s in self.subscribers if s.desired_energy_interval
+        ]
+        min_subscribers_energy_interval = min(energy_intervals) if energy_intervals else None
 
-    def _start_sampling(self, interval: float):
+        # the energy counter of the first subscriber that has one drives the
+        # sampling of this thread
+        energy_counter = next(
+            (s.energy_counter for s in self.subscribers if s.energy_counter is not None), None
+        )
+
+        self.current_energy_on_change = energy_counter is not None and all(
+            s.energy_on_change for s in self.subscribers
+        )
+
+        sample_buffer_size = min(s.sample_buffer_size for s in self.subscribers)
+        if self.current_energy_on_change or (energy_counter and not energy_counter.native):
+            # these need every sample to come through _sample as it's taken
+            sample_buffer_size = 0
+
+        if (
+            self.current_sampling_interval != min_subscribers_interval
+            or self.current_energy_interval != min_subscribers_energy_interval
+            or self.current_energy_counter is not energy_counter
+            or self.current_sample_buffer_size != sample_buffer_size
+        ):
+            self._start_sampling(
+                interval=min_subscribers_interval,
+                energy_interval=min_subscribers_energy_interval,
+                energy_counter=energy_counter,
+                sample_buffer_size=sample_buffer_size,
+            )
+
+    def _start_sampling(
+        self,
+        interval: float | None,
+        energy_interval: float | None,
+        energy_counter: Energy | None,
+        sample_buffer_size: int = 0,
+    ):
+        if self.current_energy_counter is not energy_counter:
+            # readings from different counters can't be subtracted
+            self._flush_pending_samples(self.last_profile_time)
+            self.last_profile_time = 0.0
         self.current_sampling_interval = interval
+        self.current_energy_interval = energy_interval
+        self.current_energy_counter = energy_counter
+        self.current_sample_buffer_size = sample_buffer_size
         if self.last_profile_time == 0.0:
             self.last_profile_time = self._timer()
-        setstatprofile(self._sample, interval,
-                       active_profiler_context_var, self.timer_func)
+            self.last_wall_time = timeit.default_timer()
+
+        if interval and 0 < COARSE_CLOCK_RESOLUTION <= interval / 2:
+            timer_type = "walltime_coarse"
+        else:
+            # e.g. the default 1ms interval, shorter than the coarse clock's
+            # resolution. Not gettimeofday, which NTP can step back or forth
+            timer_type = "monotonic"
+
+        # the C extension reads the energy counter itself on every event when
+        # it is used as a trigger, or on every sample when it buffers them.
+        # Otherwise it's only read in _sample.
+        native_energy_counter = (
+            energy_counter if energy_counter and (energy_interval or sample_buffer_size) else None
+        )
+        setstatprofile(
+            self._sample,
+            interval or 0.0,
+            active_profiler_context_var,
+            self.timer_func,
+            energy_counter=native_energy_counter.fds if native_energy_counter else None,
+            energy_interval=energy_interval or 0.0,
+            timer_type=timer_type,
+            energy_max_range=native_energy_counter.max_ranges if native_energy_counter else None,
+            sample_buffer_size=sample_buffer_size,
+            call_stack_builder=get_call_stack_builder() if sample_buffer_size else None,
+        )
 
     def _stop_sampling(self):
         setstatprofile(None)
+        self.pending_samples = []
         self.current_sampling_interval = None
+        self.current_energy_interval = None
+        self.current_energy_counter = None
+        self.current_sample_buffer_size = 0
         self.last_profile_time = 0.0
 
+    def _drain_samples(self):
+        """
+        Sends the samples buffered by the C extension, if any.
+        """
+        if self.current_sample_buffer_size:
+            drain_samples()
+            # the batches were timed natively, carry on from here
+            self.last_profile_time = self._timer()
+            self.last_wall_time = timeit.default_timer()
+
     def _sample(self, frame: types.FrameType, event: str, arg: Any):
-        if event == "context_changed":
+        if event == "samples":
+            for call_stack, time_since_last_sample, wall_time in arg:
+                self.sample_wall_time = wall_time
+                for subscriber in self.subscribers:
+                    subscriber.target(
+                        call_stack, time_since_last_sample, subscriber.async_state)
+        elif event == "context_changed":
             new, old, coroutine_stack = arg
 
             for subscriber in self.subscribers:
@@ -135,9 +312,36 @@ class StackSampler:
                 elif subscriber.target == new:
                     assert subscriber.bound_to_async_context
                     subscriber.async_state = AsyncState("in_context")
+        elif self.current_energy_on_change:
+            now = self._timer()
+            wall_now = timeit.default_timer()
+            wall_time = wall_now - self.last_wall_time
+            self.last_wall_time = wall_now
+
+            async_states = tuple(s.async_state for s in self.subscribers)
+            last_sample = self.pending_samples[-1] if self.pending_samples else None
+            if (
+                last_sample
+                and last_sample.frame is frame
+                and last_sample.event == event
+                and last_sample.arg is arg
+                and last_sample.async_states == async_states
+            ):
+                # still in the same place, no need for another call stack
+                self.pending_samples[-1] = last_sample._replace(
+                    wall_time=last_sample.wall_time + wall_time)
+            else:
+                self.pending_samples.append(
+                    PendingSample(frame, event, arg, wall_time, async_states))
+
+            if now != self.last_profile_time:
+                self._flush_pending_samples(now)
         else:
             now = self._timer()
             time_since_last_sample = now - self.last_profile_time
+            wall_now = timeit.default_timer()
+            self.sample_wall_time = wall_now - self.last_wall_time
+            self.last_wall_time = wall_now
 
             call_stack = build_call_stack(frame, event, arg)
 
@@ -147,58 +351,92 @@ class StackSampler:
 
             self.last_profile_time = now
 
-    def _timer(self):
-        return self.timer_func()
+    def _flush_pending_samples(self, now: float):
+        """
+        Sends the held back samples, sharing the energy used since the last
+        flush between them by wall-clock time.
+        """
+        pending_samples = self.pending_samples
+        if not pending_samples:
+            return
+        self.pending_samples = []
+
+        energy = now - self.last_profile_time
+        total_wall_time = sum(sample.wall_time for sample in pending_samples)
+        for sample in pending_samples:
+            if total_wall_time > 0:
+                share = energy * sample.wall_time / total_wall_time
+            else:
+                share = energy / len(pending_samples)
+            call_stack = build_call_stack(sample.frame, sample.event, sample.arg)
+            self.sample_wall_time = sample.wall_time
+            for subscriber, async_state in zip(self.subscribers, sample.async_states):
+                subscriber.target(call_stack, share, async_state)
+
+        self.last_profile_time = now
+
+    def _timer(self) -> float:
+        if self.timer_func:
+            return self.timer_func()
+        elif self.current_energy_counter is not None:
+            return self.current_energy_counter.current_energy()
+        else:
+            return timeit.default_timer()
 
     class SubscriberNotFound(Exception):
         pass
 
 
-def get_stack_sampler(timer_func) -> StackSampler:
+def get_stack_sampler() -> StackSampler:
     """
     Gets the stack sampler for the current thread, creating it if necessary
     """
     if not hasattr(thread_locals, "stack_sampler"):
-        thread_locals.stack_sampler = StackSampler(timer_func)
+        thread_locals.stack_sampler = StackSampler()
     return thread_locals.stack_sampler
 
 
 def build_call_stack(frame: types.FrameType | None, event: str, arg: Any) -> list[str]:
-    call_stack: list[str] = []
-
-    if event == "call":
-        # if we're entering a function, the time should be attributed to
-        # the caller
-        frame = frame.f_back if frame else None
-    elif event == "c_return" or event == "c_exception":
-        # if we're exiting a C function, we should add a frame before
-        # any Python frames that attributes the time to that C function
-        c_frame_identifier = "%s\x00%s\x00%i" % (
-            getattr(arg, "__qualname__", arg.__name__),
-            "<built-in>",
-            0,
-        )
-        call_stack.append(c_frame_identifier)
+    """
+    Returns the call stack of ``frame`` as a list of frame identifiers,
+    starting with the identifier of the calling thread. The part of the
+    stack that hasn't changed since the previous call on this thread reuses
+    its identifiers, see :class:`CallStackBuilder`.
+    """
+    return get_call_stack_builder().build(frame, event, arg)
 
-    while frame is not None:
-        identifier = "%s\x00%s\x00%i" % (
-            frame.f_code.co_name,
-            frame.f_code.co_filename,
-            frame.f_code.co_firstlineno,
-        )
-        call_stack.append(identifier)
-        frame = frame.f_back
 
-    thread = threading.current_thread()
-    thread_identifier = "%s\x00%s\x00%i" % (
-        thread.name, "<thread>", thread.ident)
-    call_stack.append(thread_identifier)
+def get_call_stack_builder() -> CallStackBuilder:
+    """
+    Returns the :class:`CallStackBuilder` of the calling thread.
+    """
+    try:
+        return thread_locals.call_stack_builder
+    except AttributeError:
+        builder = thread_locals.call_stack_builder = CallStackBuilder(thread_identifier())
+        return builder
 
-    # we iterated from the leaf to the root, we actually want the call stack
-    # starting at the root, so reverse this array
-    call_stack.reverse()
 
-    return call_stack
+def thread_identifier() -> str:
+    """
+    Returns the identifier of the calling thread, the root of its call
+    stacks. It's worked out on the thread's first sample, so renaming the
+    thread afterwards doesn't change it.
+    """
+    try:
+        return thread_locals.thread_identifier
+    except AttributeError:
+        thread = threading.current_thread()
+        identifier = thread_locals.thread_identifier = identifier_of_thread(
+            thread.name, threading.get_ident())
+        return identifier
+
+
+def identifier_of_thread(name: str, ident: int) -> str:
+    """
+    Returns the frame identifier that roots the call stacks of a thread.
+    """
+    return sys.intern("%s\x00%s\x00%i" % (name, "<thread>", ident))
 
 
 class AsyncState(NamedTuple):
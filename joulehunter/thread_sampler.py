@@ -0,0 +1,300 @@
+from __future__ import annotations
+
+import os
+import sys
+import threading
+import timeit
+import types
+from typing import Any
+
+from joulehunter.energy import Energy
+from joulehunter.low_level.stat_profile import CallStackBuilder
+from joulehunter.stack_sampler import (
+    StackSampler,
+    StackSamplerSubscriber,
+    StackSamplerSubscriberTarget,
+    identifier_of_thread,
+)
+
+# pyright: strict
+
+# the root of every call stack sent by the thread sampler, above the threads
+ALL_THREADS_FRAME_IDENTIFIER = "[all threads]\x00<process>\x000"
+
+# the on-CPU time of each thread, in nanoseconds, is the first field of its
+# schedstat file, see proc(5)
+TASK_SCHEDSTAT_PATH = "/proc/self/task/%i/schedstat"
+
+
+class _SampledThread:
+    """
+    What the thread sampler keeps about each thread it samples.
+    """
+
+    def __init__(self, ident: int, thread: threading.Thread | None, started: bool) -> None:
+        name = thread.name if thread else "Thread"
+        self.builder = CallStackBuilder(identifier_of_thread(name, ident))
+        native_id: int | None = getattr(thread, "native_id", None)
+        try:
+            self.schedstat_fd = os.open(TASK_SCHEDSTAT_PATH % native_id, os.O_RDONLY)
+        except (OSError, TypeError):
+            self.schedstat_fd = -1
+        # a thread that started while sampling has used all its CPU time since
+        self.last_cpu_time = 0.0 if started else self.cpu_time()
+
+    def cpu_time(self) -> float | None:
+        """
+        Returns the CPU time of the thread in seconds, or None if it can't be
+        read, e.g. the thread has just exited, or isn't on Linux.
+        """
+        if self.schedstat_fd < 0:
+            return None
+        try:
+            return int(os.pread(self.schedstat_fd, 128, 0).split()[0]) / 1e9
+        except (OSError, IndexError, ValueError):
+            return None
+
+    def close(self) -> None:
+        if self.schedstat_fd >= 0:
+            os.close(self.schedstat_fd)
+            self.schedstat_fd = -1
+
+
+class ThreadSampler:
+    """
+    Samples every thread of the process from a background thread, with
+    ``sys._current_frames()``, rather than hooking calls and returns on the
+    profiled thread like :class:`StackSampler`. The sampled threads run with
+    no profiling overhead at all, and threads that the profiler didn't start
+    on, like the workers of a thread pool, are profiled too.
+
+    Every interval, the energy used since the previous sample is shared
+    between the threads by the CPU time each used meanwhile, read from
+    ``/proc/self/task/<tid>/schedstat``. When none used any, e.g. all were
+    waiting, or their CPU time can't be read, it's shared evenly. Each share
+    is sent as a separate sample, its call stack rooted under
+    :data:`ALL_THREADS_FRAME_IDENTIFIER` and the thread's identifier, and
+    with its share of the interval's wall-clock time, so the samples of a
+    tick add up to the interval.
+    """
+
+    SubscriberNotFound = StackSampler.SubscriberNotFound
+
+    subscribers: list[StackSamplerSubscriber]
+    current_sampling_interval: float | None
+    current_energy_counter: Energy | None
+    last_profile_time: float
+    last_wall_time: float
+    sample_wall_time: float
+    timer_func: Any
+
+    def __init__(self) -> None:
+        self.subscribers = []
+        self.current_sampling_interval = None
+        self.current_energy_counter = None
+        self.last_profile_time = 0.0
+        self.last_wall_time = 0.0
+        # the wall-clock time of the sample being sent to the subscribers
+        self.sample_wall_time = 0.0
+        self.timer_func = None
+        # held while sampling, so that no sample reaches a subscriber once
+        # it has unsubscribed
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._stop_event: threading.Event | None = None
+        self._threads: dict[int, _SampledThread] = {}
+
+    def subscribe(
+        self,
+        target: StackSamplerSubscriberTarget,
+        desired_interval: float | None,
+        use_async_context: bool,
+        energy_counter: Energy | None = None,
+        desired_energy_interval: float | None = None,
+        energy_on_change: bool = False,
+        sample_buffer_size: int = 0,
+    ):
+        """
+        Starts sending samples of every thread to ``target``, every
+        ``desired_interval`` seconds of wall-clock time. Takes the same
+        arguments as :meth:`StackSampler.subscribe`, but async contexts,
+        energy triggers, ``energy_on_change`` and sample buffers aren't
+        supported. ``target`` is called on the sampler's own thread.
+        """
+        if use_async_context or desired_energy_interval or energy_on_change or sample_buffer_size:
+            raise ValueError(
+                "The thread sampler doesn't support async contexts, energy_interval, "
+                "energy_on_change or sample_buffer_size"
+            )
+
+        with self._lock:
+            self.subscribers.append(
+                StackSamplerSubscriber(
+                    target=target,
+                    desired_interval=desired_interval,
+                    desired_energy_interval=None,
+                    bound_to_async_context=False,
+                    async_state=None,
+                    energy_counter=energy_counter,
+                )
+            )
+            self._update()
+
+    def unsubscribe(self, target: StackSamplerSubscriberTarget):
+        with self._lock:
+            try:
+                subscriber = next(
+                    s for s in self.subscribers if s.target == target)  # type: ignore
+            except StopIteration:
+                raise ThreadSampler.SubscriberNotFound()
+
+            self.subscribers.remove(subscriber)
+
+            self._update()
+            thread = self._thread if not self.subscribers else None
+            if thread:
+                self._thread = None
+
+        if thread and thread is not threading.current_thread():
+            thread.join()
+
+    def _update(self):
+        if len(self.subscribers) == 0:
+            self._stop_sampling()
+            return
+
+        intervals = [s.desired_interval for s in self.subscribers if s.desired_interval]
+        interval = min(intervals) if intervals else 0.001
+
+        energy_counter = next(
+            (s.energy_counter for s in self.subscribers if s.energy_counter is not None), None
+        )
+
+        if self.current_energy_counter is not energy_counter:
+            # readings from different counters can't be subtracted
+            self.last_profile_time = 0.0
+        self.current_sampling_interval = interval
+        self.current_energy_counter = energy_counter
+        if self.last_profile_time == 0.0:
+            self.last_profile_time = self._timer()
+            self.last_wall_time = timeit.default_timer()
+
+        if self._thread is None:
+            self._start_sampling()
+
+    def _start_sampling(self):
+        # the CPU time of the threads counts from now
+        self._update_threads(sys._current_frames(), started=False)  # type: ignore
+
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(self._stop_event,),
+            name="joulehunter-thread-sampler",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def _stop_sampling(self):
+        if self._stop_event:
+            self._stop_event.set()
+            self._stop_event = None
+        for sampled_thread in self._threads.values():
+            sampled_thread.close()
+        self._threads = {}
+        self.current_sampling_interval = None
+        self.current_energy_counter = None
+        self.last_profile_time = 0.0
+
+    def _run(self, stop_event: threading.Event):
+        next_time = timeit.default_timer()
+        while not stop_event.is_set():
+            next_time += self.current_sampling_interval or 0.001
+            delay = next_time - timeit.default_timer()
+            if delay > 0:
+                stop_event.wait(delay)
+            else:
+                # fell behind, e.g. the samples took longer than the interval
+                next_time = timeit.default_timer()
+
+            with self._lock:
+                if stop_event.is_set():
+                    return
+                self._sample()
+
+    def _update_threads(self, frames: dict[int, types.FrameType], started: bool = True):
+        """
+        Starts tracking the threads in ``frames`` that weren't yet, and stops
+        tracking those that have exited. ``started`` tells if the new threads
+        started since the previous sample.
+        """
+        new_idents = [ident for ident in frames if ident not in self._threads]
+        if new_idents:
+            threads = {thread.ident: thread for thread in threading.enumerate()}
+            for ident in new_idents:
+                self._threads[ident] = _SampledThread(ident, threads.get(ident), started)
+
+        for ident in [ident for ident in self._threads if ident not in frames]:
+            self._threads.pop(ident).close()
+
+    def _sample(self):
+        frames: dict[int, types.FrameType] = sys._current_frames()  # type: ignore
+        # not the sampler's own thread
+        del frames[threading.get_ident()]
+        self._update_threads(frames)
+
+        now = self._timer()
+        energy = now - self.last_profile_time
+        wall_now = timeit.default_timer()
+        wall_time = wall_now - self.last_wall_time
+        self.last_profile_time = now
+        self.last_wall_time = wall_now
+
+        cpu_times: dict[int, float] = {}
+        for ident, sampled_thread in self._threads.items():
+            cpu_time = sampled_thread.cpu_time()
+            if cpu_time is None:
+                continue
+            if sampled_thread.last_cpu_time is not None:
+                cpu_times[ident] = max(0.0, cpu_time - sampled_thread.last_cpu_time)
+            sampled_thread.last_cpu_time = cpu_time
+
+        total_cpu_time = sum(cpu_times.values())
+        for ident, sampled_thread in self._threads.items():
+            if total_cpu_time > 0:
+                share = cpu_times.get(ident, 0.0) / total_cpu_time
+                if share == 0:
+                    continue
+            else:
+                share = 1 / len(self._threads)
+
+            call_stack = sampled_thread.builder.build(frames[ident], "line", None)
+            call_stack.insert(0, ALL_THREADS_FRAME_IDENTIFIER)
+
+            self.sample_wall_time = wall_time * share
+            for subscriber in self.subscribers:
+                subscriber.target(call_stack, energy * share, subscriber.async_state)
+
+    def _timer(self) -> float:
+        if self.timer_func:
+            return self.timer_func()
+        elif self.current_energy_counter is not None:
+            return self.current_energy_counter.current_energy()
+        else:
+            return timeit.default_timer()
+
+
+_thread_sampler: ThreadSampler | None = None
+_thread_sampler_lock = threading.Lock()
+
+
+def get_thread_sampler() -> ThreadSampler:
+    """
+    Gets the process's thread sampler. There's only one, as it samples every
+    thread.
+    """
+    global _thread_sampler
+    with _thread_sampler_lock:
+        if _thread_sampler is None:
+            _thread_sampler = ThreadSampler()
+        return _thread_sampler
@@ -0,0 +1,55 @@
+"""
+Measures how much copying the sampled frame's locals into f_locals and back
+(``sync_locals=True``) adds to each sample, on a function with many locals.
+The interval is tiny, so every call and return is sampled.
+"""
+
+from timeit import Timer
+
+from joulehunter.low_level.stat_profile import setstatprofile
+
+LOCALS_COUNT = 100
+CALLS = 10000
+
+# a function with many locals, that calls another function
+exec(
+    "def many_locals():\n"
+    + "".join(f"    local_{i} = {i}\n" for i in range(LOCALS_COUNT))
+    + "    for _ in range(10):\n"
+    + "        leaf()\n",
+    globals(),
+)
+
+
+def leaf():
+    pass
+
+
+def target(frame, event, arg):
+    pass
+
+
+def run():
+    for _ in range(CALLS):
+        many_locals()  # type: ignore # noqa
+
+
+def timings(**kwargs):
+    setstatprofile(target, 1e-9, **kwargs)
+    try:
+        return min(Timer(run).repeat(repeat=5, number=1))
+    finally:
+        setstatprofile(None)
+
+
+base_timing = min(Timer(run).repeat(repeat=5, number=1))
+sync_timing = timings(sync_locals=True)
+lean_timing = timings()
+
+# each call to many_locals gives 1 call, 10 calls and returns of leaf, and 1
+# return, all sampled
+samples = CALLS * 22
+print(f"{LOCALS_COUNT} locals, {samples} samples")
+print(f"no profiler:        {base_timing:.3f}s")
+print(f"sync_locals=True:   {sync_timing:.3f}s ({(sync_timing - base_timing) / samples * 1e9:.0f}ns/sample)")
+print(f"sync_locals=False:  {lean_timing:.3f}s ({(lean_timing - base_timing) / samples * 1e9:.0f}ns/sample)")
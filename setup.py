@@ -11,7 +11,13 @@ setup(
         Extension(
             "joulehunter.low_level.stat_profile",
             sources=["joulehunter/low_level/stat_profile.c"],
-        )
+            depends=["joulehunter/low_level/energy_counter.h"],
+        ),
+        Extension(
+            "joulehunter.low_level.energy_poller",
+            sources=["joulehunter/low_level/energy_poller.c"],
+            depends=["joulehunter/low_level/energy_counter.h"],
+        ),
     ],
     keywords=["profiling", "profile", "profiler",
               "energy", "cpu", "time", "sampling"],
@@ -19,7 +25,8 @@ setup(
     include_package_data=True,
     python_requires=">=3.7",
     entry_points={"console_scripts": [
-        "joulehunter = joulehunter.__main__:main"]},
+        "joulehunter = joulehunter.__main__:main",
+        "joulehunter-energyd = joulehunter.energyd:main"]},
     zip_safe=False,
 
 )
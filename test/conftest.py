@@ -2,9 +2,11 @@ import sys
 
 import pytest
 
-from joulehunter import stack_sampler, Profiler
+from joulehunter import cgroup, cpufreq, energy, stack_sampler, Profiler
 from _pytest.monkeypatch import MonkeyPatch
 
+from .fake_rapl_util import FakeCgroup, FakeCpus, FakeHwmon, FakeRapl
+
 
 @pytest.fixture(autouse=True)
 def check_sampler_state():
@@ -20,24 +22,28 @@ def check_sampler_state():
         stack_sampler.thread_locals.__dict__.clear()
 
 
-def current_energy_generator():
-    i = 0
-    while True:
-        i += 1
-        yield i
+@pytest.fixture(autouse=True)
+def reset_backend():
+    # the default backend is chosen once, the fake counters of each test
+    # need it chosen again
+    energy.set_backend(None)
+    yield
+    energy.set_backend(None)
 
 
-def current_energy():
-    return next(current_energy_generator.generator)
+# the real constructor, for the tests that need a real profiler, see
+# make_profiler
+real_profiler_init = Profiler.__init__
 
 
 def new_init(self, async_mode="disabled"):
-    self._interval = 0.001
-    self._last_session = None
-    self._active_session = None
-    self._async_mode = async_mode
-    self.current_energy = current_energy
+    real_profiler_init(self, async_mode=async_mode, backend=energy.ScriptedBackend())
+    self.close()
+    # the samples measure wall-clock time instead of energy
+    self.energy_counter = None
+    self.energy_counters = []
     self.domain_names = ["0", "mockup"]
+    self.all_domain_names = [self.domain_names]
 
 
 @pytest.fixture(autouse=True)
@@ -45,3 +51,68 @@ def mock_profiler():
     MonkeyPatch().setattr(Profiler, "__init__", new_init)
     myprofiler = Profiler()
     return myprofiler
+
+
+@pytest.fixture()
+def make_profiler():
+    # builds profilers with the real constructor, which read the energy from
+    # the default backend, e.g. fake_rapl. They're closed at teardown
+    profilers = []
+
+    def make(**kwargs):
+        profiler = Profiler.__new__(Profiler)
+        real_profiler_init(profiler, **kwargs)
+        profilers.append(profiler)
+        return profiler
+
+    yield make
+
+    for profiler in profilers:
+        profiler.close()
+
+
+@pytest.fixture()
+def fake_rapl(tmp_path, monkeypatch):
+    fake = FakeRapl(tmp_path / "intel-rapl")
+    monkeypatch.setattr(energy, "RAPL_API_DIR", str(fake.root))
+    return fake
+
+
+@pytest.fixture()
+def fake_hwmon(tmp_path, monkeypatch):
+    fake = FakeHwmon(tmp_path / "hwmon")
+    monkeypatch.setenv(energy.HWMON_ROOT_ENV_VAR, str(fake.root))
+    return fake
+
+
+@pytest.fixture()
+def fake_cgroup(tmp_path, monkeypatch):
+    fake = FakeCgroup(tmp_path / "cgroup-host")
+    monkeypatch.setattr(cgroup, "PROC_DIR", str(fake.proc_dir))
+    monkeypatch.setattr(cgroup, "CGROUP_DIR", str(fake.cgroup_dir))
+    return fake
+
+
+@pytest.fixture()
+def fake_cpufreq(tmp_path, monkeypatch):
+    fake = FakeCpus(tmp_path / "cpufreq-host")
+    monkeypatch.setattr(cpufreq, "PROC_DIR", str(fake.proc_dir))
+    monkeypatch.setattr(cpufreq, "CPU_SYSFS_DIR", str(fake.cpu_dir))
+    return fake
+
+
+@pytest.fixture()
+def fake_cpus(fake_rapl, tmp_path, monkeypatch):
+    # cpu0 and cpu1 are on package 0, cpu2 and cpu3 on package 1. Returns
+    # the affinity of the process, which tests can change
+    fake_rapl.add_domain(["intel-rapl:1"], "package-1")
+    for cpu in range(4):
+        topology_dir = tmp_path / "cpu" / f"cpu{cpu}" / "topology"
+        topology_dir.mkdir(parents=True)
+        (topology_dir / "physical_package_id").write_text(f"{cpu // 2}\n")
+    monkeypatch.setattr(energy, "CPU_SYSFS_DIR", str(tmp_path / "cpu"))
+    monkeypatch.setattr(energy, "_cpu_packages", {})
+
+    affinity = {0, 1, 2, 3}
+    monkeypatch.setattr(energy.os, "sched_getaffinity", lambda pid: affinity, raising=False)
+    return affinity
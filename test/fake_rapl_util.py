@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+
+def write_counter(path: os.PathLike | str, value: int):
+    """
+    Overwrites the counter at `path` in a single write, so that a profiler
+    reading it concurrently never sees a truncated file.
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT)
+    try:
+        os.pwrite(fd, b"%020d\n" % value, 0)
+    finally:
+        os.close(fd)
+
+
+class FakeRapl:
+    """
+    A fake powercap tree, laid out like /sys/devices/virtual/powercap/intel-rapl.
+    By default, it has one package with a core and a dram component.
+    """
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        self.root.mkdir(parents=True)
+
+        self.add_domain(["intel-rapl:0"], "package-0")
+        self.add_domain(["intel-rapl:0", "intel-rapl:0:0"], "core")
+        self.add_domain(["intel-rapl:0", "intel-rapl:0:1"], "dram")
+
+    def add_domain(self, dirnames: list[str], name: str, energy_uj: int = 0,
+                   max_energy_range_uj: int = 262143328850):
+        domain_dir = self.root.joinpath(*dirnames)
+        domain_dir.mkdir()
+        (domain_dir / "name").write_text(name + "\n")
+        self.set_max_energy_range(dirnames, max_energy_range_uj)
+        self.set_energy(dirnames, energy_uj)
+
+    def set_max_energy_range(self, dirnames: list[str], max_energy_range_uj: int):
+        path = self.root.joinpath(*dirnames, "max_energy_range_uj")
+        path.write_text("%d\n" % max_energy_range_uj)
+
+    def set_energy(self, dirnames: list[str], energy_uj: int):
+        write_counter(self.energy_path(dirnames), energy_uj)
+
+    def energy_path(self, dirnames: list[str]) -> str:
+        return str(self.root.joinpath(*dirnames, "energy_uj"))
+
+
+class FakeHwmon:
+    """
+    A fake hwmon class directory, laid out like /sys/class/hwmon. By default,
+    it has an amd_energy device with two sockets of two cores, a device
+    without energy sensors, and an SCMI device with two energy channels.
+    """
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        self.root.mkdir(parents=True)
+
+        self.add_device("hwmon0", "amd_energy",
+                        ["Ecore000", "Ecore001", "Ecore002", "Ecore003", "Esocket0", "Esocket1"])
+        self.add_device("hwmon1", "nvme", [])
+        self.add_device("hwmon2", "scmi_sensors", ["SoC", "CPU_B"])
+
+    def add_device(self, dirname: str, name: str, labels: list[str]):
+        device_dir = self.root / dirname
+        device_dir.mkdir()
+        (device_dir / "name").write_text(name + "\n")
+        (device_dir / "temp1_input").write_text("42000\n")
+        for channel_num, label in enumerate(labels, start=1):
+            (device_dir / f"energy{channel_num}_label").write_text(label + "\n")
+            self.set_energy(dirname, channel_num, 0)
+
+    def set_energy(self, dirname: str, channel_num: int, energy_uj: int):
+        write_counter(self.root / dirname / f"energy{channel_num}_input", energy_uj)
+
+
+class FakeCgroup:
+    """
+    Fake procfs and cgroup filesystems, with this process in a cgroup whose
+    CPU usage and the host's busy CPU time are set with :meth:`set_usage`.
+    """
+
+    def __init__(self, root: Path, version: int = 2) -> None:
+        self.proc_dir = root / "proc"
+        self.cgroup_dir = root / "cgroup"
+        self.version = version
+        self.clock_ticks = os.sysconf("SC_CLK_TCK")
+
+        (self.proc_dir / "self").mkdir(parents=True)
+        if version == 2:
+            (self.proc_dir / "self" / "cgroup").write_text("0::/system.slice/app.service\n")
+            self.usage_path = self.cgroup_dir / "system.slice" / "app.service" / "cpu.stat"
+        else:
+            (self.proc_dir / "self" / "cgroup").write_text(
+                "3:memory:/docker/app\n2:cpu,cpuacct:/docker/app\n1:name=systemd:/docker/app\n")
+            self.usage_path = self.cgroup_dir / "cpu,cpuacct" / "docker" / "app" / "cpuacct.usage"
+        self.usage_path.parent.mkdir(parents=True)
+        self.set_usage(0, 0)
+
+    def set_usage(self, cgroup_usec: int, host_busy_usec: int):
+        # fixed-width values, so that each file is overwritten in one write
+        if self.version == 2:
+            usage = b"usage_usec %020d\nuser_usec 0\nsystem_usec 0\n" % cgroup_usec
+        else:
+            usage = b"%020d\n" % (cgroup_usec * 1000)
+        busy_jiffies = host_busy_usec * self.clock_ticks // 10**6
+        stat = b"cpu  %020d 0 0 %020d 0 0 0 0 0 0\ncpu0 0 0 0 0 0 0 0 0 0 0\n" % (
+            busy_jiffies, 123456)
+
+        for path, content in ((self.usage_path, usage), (self.proc_dir / "stat", stat)):
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT)
+            try:
+                os.pwrite(fd, content, 0)
+            finally:
+                os.close(fd)
+
+
+class FakeCpus:
+    """
+    Fake procfs and sysfs CPU trees, where the calling thread runs on the
+    core set with :meth:`set_cpu`, and each core's frequency is set with
+    :meth:`set_frequency`.
+    """
+
+    def __init__(self, root: Path, cpu_count: int = 2) -> None:
+        self.proc_dir = root / "proc"
+        self.cpu_dir = root / "cpu"
+
+        (self.proc_dir / "thread-self").mkdir(parents=True)
+        for cpu in range(cpu_count):
+            (self.cpu_dir / f"cpu{cpu}" / "cpufreq").mkdir(parents=True)
+            self.set_frequency(cpu, 1000000)
+        self.set_cpu(0)
+
+    def set_cpu(self, cpu: int):
+        # the command name has spaces and parentheses, like real ones can
+        fields = " ".join(["S"] + ["0"] * 35 + [str(cpu)] + ["0"] * 13)
+        write_text(self.proc_dir / "thread-self" / "stat", "1234 (a (b) c) %-60s\n" % fields)
+
+    def set_frequency(self, cpu: int, frequency_khz: int):
+        write_counter(self.cpu_dir / f"cpu{cpu}" / "cpufreq" / "scaling_cur_freq", frequency_khz)
+
+
+def write_text(path: os.PathLike | str, text: str):
+    """
+    Overwrites the file at `path` in a single write.
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT)
+    try:
+        os.pwrite(fd, text.encode(), 0)
+    finally:
+        os.close(fd)
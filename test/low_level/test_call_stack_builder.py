@@ -0,0 +1,93 @@
+import sys
+
+import pytest
+
+from joulehunter.low_level.stat_profile import CallStackBuilder as CallStackBuilder_c
+from joulehunter.low_level.stat_profile_python import (
+    CallStackBuilder as CallStackBuilder_python,
+)
+
+parametrize_builder = pytest.mark.parametrize(
+    "CallStackBuilder",
+    [CallStackBuilder_c, CallStackBuilder_python],
+)
+
+
+def identifier(function):
+    code = function.__code__
+    return "%s\x00%s\x00%i" % (code.co_name, code.co_filename, code.co_firstlineno)
+
+
+def inner():
+    return sys._getframe()
+
+
+def outer():
+    return inner(), sys._getframe()
+
+
+@parametrize_builder
+def test_build(CallStackBuilder):
+    builder = CallStackBuilder("root")
+    inner_frame, outer_frame = outer()
+
+    stack = builder.build(inner_frame, "line", None)
+    assert stack[0] == "root"
+    assert stack[-2:] == [identifier(outer), identifier(inner)]
+    assert stack[-3] == identifier(test_build)
+
+    # on call, the time goes to the caller
+    assert builder.build(inner_frame, "call", None) == stack[:-1]
+
+    # on c_return, it goes to the C function
+    assert builder.build(outer_frame, "c_return", len) == stack[:-1] + [
+        "len\x00<built-in>\x000"
+    ]
+
+    assert builder.build(None, "line", None) == ["root"]
+
+
+@parametrize_builder
+def test_build_shares_prefix(CallStackBuilder):
+    builder = CallStackBuilder("root")
+    frame = sys._getframe()
+
+    stack_1 = builder.build(frame, "line", None)
+    stack_2 = builder.build(inner(), "line", None)
+    stack_3 = builder.build(frame, "line", None)
+
+    assert stack_2[:-1] == stack_1
+    assert stack_3 == stack_1
+    assert stack_3 is not stack_1
+    assert all(a is b for a, b in zip(stack_1, stack_2))
+    assert all(a is b for a, b in zip(stack_1, stack_3))
+
+
+@parametrize_builder
+def test_build_after_the_stack_changes(CallStackBuilder):
+    builder = CallStackBuilder("root")
+
+    def a():
+        return b()
+
+    def b():
+        return builder.build(sys._getframe(), "line", None)
+
+    def c():
+        return b()
+
+    stack_a = a()
+    stack_c = c()
+    assert stack_a[-2:] == [identifier(a), identifier(b)]
+    assert stack_c[-2:] == [identifier(c), identifier(b)]
+    assert stack_a[:-2] == stack_c[:-2]
+
+
+@parametrize_builder
+def test_build_errors(CallStackBuilder):
+    with pytest.raises(TypeError):
+        CallStackBuilder(None)
+
+    builder = CallStackBuilder("root")
+    with pytest.raises(AttributeError):
+        builder.build(sys._getframe(), "c_return", object())
@@ -0,0 +1,174 @@
+import os
+from typing import Any
+
+import pytest
+
+from joulehunter.low_level.stat_profile import read_energy_counter as read_energy_counter_c
+from joulehunter.low_level.stat_profile_python import (
+    read_energy_counter as read_energy_counter_python,
+)
+
+from ..fake_rapl_util import write_counter
+from .util import parametrize_setstatprofile
+
+
+class CallCounter:
+    def __init__(self) -> None:
+        self.count = 0
+
+    def __call__(self, *args: Any, **kwds: Any) -> Any:
+        self.count += 1
+
+
+@pytest.mark.parametrize("read_energy_counter", [read_energy_counter_c, read_energy_counter_python])
+def test_read_energy_counter(read_energy_counter, tmp_path):
+    path = tmp_path / "energy_uj"
+    path.write_text("123456789\n")
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        assert read_energy_counter(fd) == 123456789
+        path.write_text("42\n")
+        assert read_energy_counter(fd) == 42
+    finally:
+        os.close(fd)
+
+
+@pytest.mark.parametrize("energy_counter_type", ["path", "fd", "fds"])
+@parametrize_setstatprofile
+def test_energy_counter_interval(setstatprofile, energy_counter_type, tmp_path):
+    # with several counters, e.g. one per package, the energy is split
+    # between them and the trigger fires on their sum
+    paths = [tmp_path / "energy_uj", tmp_path / "energy_uj_1"]
+    if energy_counter_type != "fds":
+        paths = paths[:1]
+    energy_uj = 0
+
+    def consume(joules):
+        nonlocal energy_uj
+        energy_uj += int(joules * 10**6 / len(paths))
+        for path in paths:
+            write_counter(path, energy_uj)
+
+    consume(0)
+    fds = [os.open(path, os.O_RDONLY) for path in paths]
+    if energy_counter_type == "path":
+        energy_counter = str(paths[0])
+    elif energy_counter_type == "fd":
+        energy_counter = fds[0]
+    else:
+        energy_counter = fds
+
+    counter = CallCounter()
+    setstatprofile(counter, energy_counter=energy_counter, energy_interval=1.0)
+
+    for _ in range(100):
+        consume(1.0)
+
+    setstatprofile(None)
+    for fd in fds:
+        os.close(fd)
+
+    assert counter.count == 100
+
+
+@parametrize_setstatprofile
+def test_energy_counter_wraparound(setstatprofile, tmp_path):
+    # the counter wraps around every 10 J, but the trigger keeps firing
+    path = tmp_path / "energy_uj"
+    max_range = 10 * 10**6
+    energy_uj = 0
+
+    def consume(joules):
+        nonlocal energy_uj
+        energy_uj += int(joules * 10**6)
+        write_counter(path, energy_uj % max_range)
+
+    consume(0)
+    fd = os.open(path, os.O_RDONLY)
+
+    counter = CallCounter()
+    setstatprofile(counter, energy_counter=fd, energy_interval=1.0, energy_max_range=max_range)
+
+    for _ in range(100):
+        consume(1.0)
+
+    setstatprofile(None)
+    os.close(fd)
+
+    assert counter.count == 100
+
+
+def test_energy_counter_missing_file(tmp_path):
+    from joulehunter.low_level.stat_profile import setstatprofile
+
+    with pytest.raises(OSError):
+        setstatprofile(CallCounter(), 1.0, energy_counter=str(tmp_path / "missing"))
+
+
+@parametrize_setstatprofile
+def test_energy_counter_not_read_without_energy_interval(setstatprofile, tmp_path):
+    # the counter doesn't hold a number, so reading it would raise
+    path = tmp_path / "energy_uj"
+    path.write_text("unreadable\n")
+
+    time = 0.0
+
+    def fake_time():
+        return time
+
+    def fake_sleep(duration):
+        nonlocal time
+        time += duration
+
+    counter = CallCounter()
+    setstatprofile(counter, 1.0, timer_func=fake_time, energy_counter=str(path))
+
+    for _ in range(100):
+        fake_sleep(1.0)
+
+    setstatprofile(None)
+
+    assert counter.count == 100
+
+
+@parametrize_setstatprofile
+def test_time_and_energy_triggers(setstatprofile, tmp_path):
+    path = tmp_path / "energy_uj"
+    write_counter(path, 0)
+
+    time = 0.0
+    energy_uj = 0
+
+    def fake_time():
+        return time
+
+    def fake_sleep(duration):
+        nonlocal time
+        time += duration
+
+    def consume(joules):
+        nonlocal energy_uj
+        energy_uj += int(joules * 10**6)
+        write_counter(path, energy_uj)
+
+    counter = CallCounter()
+    setstatprofile(
+        counter, 1.0, timer_func=fake_time, energy_counter=str(path), energy_interval=1.0
+    )
+
+    for _ in range(50):
+        fake_sleep(1.0)
+    for _ in range(50):
+        consume(1.0)
+
+    setstatprofile(None)
+
+    assert counter.count == 100
+
+
+def test_energy_interval_requires_counter():
+    from joulehunter.low_level.stat_profile import setstatprofile
+
+    with pytest.raises(ValueError):
+        setstatprofile(CallCounter(), energy_interval=1.0)
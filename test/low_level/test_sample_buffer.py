@@ -0,0 +1,89 @@
+import pytest
+
+from joulehunter.low_level import stat_profile, stat_profile_python
+
+parametrize_implementation = pytest.mark.parametrize(
+    "implementation",
+    [stat_profile, stat_profile_python],
+)
+
+
+class BatchRecorder:
+    def __init__(self) -> None:
+        self.batches = []
+        self.events = []
+
+    def __call__(self, frame, event, arg):
+        self.events.append(event)
+        if event == "samples":
+            self.batches.append(arg)
+
+
+@parametrize_implementation
+def test_sample_buffer(implementation):
+    time = 0.0
+
+    def fake_time():
+        return time
+
+    def fake_sleep(duration):
+        nonlocal time
+        time += duration
+
+    recorder = BatchRecorder()
+    builder = implementation.CallStackBuilder("root")
+    implementation.setstatprofile(
+        recorder, 0.5, timer_func=fake_time, sample_buffer_size=10, call_stack_builder=builder
+    )
+
+    for _ in range(25):
+        fake_sleep(1.0)
+
+    # the samples are only sent when the buffer is full
+    assert [len(batch) for batch in recorder.batches] == [10, 10]
+    assert set(recorder.events) == {"samples"}
+
+    implementation.drain_samples()
+    assert [len(batch) for batch in recorder.batches] == [10, 10, 5]
+
+    implementation.setstatprofile(None)
+
+    samples = [sample for batch in recorder.batches for sample in batch]
+    for call_stack, value, wall_time in samples:
+        assert call_stack[0] == "root"
+        assert any(identifier.startswith("test_sample_buffer\x00") for identifier in call_stack)
+        assert value == pytest.approx(1.0)
+        assert wall_time >= 0
+
+    # each sample is in fake_sleep, called from the test
+    assert samples[0][0][-1].startswith("fake_sleep\x00")
+
+
+@parametrize_implementation
+def test_sample_buffer_flushed_when_replaced(implementation):
+    time = 0.0
+
+    def fake_time():
+        return time
+
+    def fake_sleep(duration):
+        nonlocal time
+        time += duration
+
+    recorder = BatchRecorder()
+    builder = implementation.CallStackBuilder("root")
+    implementation.setstatprofile(
+        recorder, 0.5, timer_func=fake_time, sample_buffer_size=100, call_stack_builder=builder
+    )
+    for _ in range(5):
+        fake_sleep(1.0)
+    implementation.setstatprofile(None)
+
+    assert [len(batch) for batch in recorder.batches] == [5]
+
+
+@parametrize_implementation
+def test_sample_buffer_requires_builder(implementation):
+    with pytest.raises(TypeError):
+        implementation.setstatprofile(BatchRecorder(), 0.001, sample_buffer_size=10)
+    implementation.setstatprofile(None)
@@ -49,3 +49,30 @@ def test_internal_object_compatibility(setstatprofile):
     print(type(profile_state).__name__)
 
     setstatprofile(None)
+
+
+@parametrize_setstatprofile
+@pytest.mark.parametrize("sync_locals", [False, True])
+def test_locals(setstatprofile, sync_locals):
+    seen_locals = []
+
+    def target(frame, event, arg):
+        if frame.f_code is func.__code__:
+            seen_locals.append(dict(frame.f_locals))
+            frame.f_locals["b"] = 3
+
+    def func():
+        a = 1
+        b = 2
+        time.sleep(0.001)
+        return a, b
+
+    # with or without sync_locals, the target can read the locals
+    setstatprofile(target, 1e-9, sync_locals=sync_locals)
+    result = func()
+    setstatprofile(None)
+
+    assert {"a": 1, "b": 2} in seen_locals
+    if sync_locals:
+        # and with it, write them
+        assert result == (1, 3)
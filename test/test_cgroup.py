@@ -0,0 +1,56 @@
+import pytest
+
+from joulehunter import cgroup
+
+from .fake_rapl_util import FakeCgroup
+
+
+@pytest.mark.parametrize("version", [1, 2])
+def test_cgroup_cpu_share(tmp_path, version):
+    fake = FakeCgroup(tmp_path, version=version)
+    cpu_share = cgroup.CgroupCpuShare(str(fake.proc_dir), str(fake.cgroup_dir))
+
+    # the host was busy for 4s, 1s of which was the cgroup's
+    fake.set_usage(1000000, 4000000)
+    assert cpu_share.share() == pytest.approx(0.25)
+
+    # /proc/stat hasn't moved, so the share still holds
+    fake.set_usage(1100000, 4000000)
+    assert cpu_share.share() == pytest.approx(0.25)
+
+    # the cgroup's usage counts from the previous move of /proc/stat
+    fake.set_usage(2000000, 6000000)
+    assert cpu_share.share() == pytest.approx(0.5)
+    cpu_share.close()
+
+
+def test_cgroup_cpu_share_ticks(tmp_path):
+    fake = FakeCgroup(tmp_path)
+    cpu_share = cgroup.CgroupCpuShare(str(fake.proc_dir), str(fake.cgroup_dir))
+    tick_usec = 10**6 // fake.clock_ticks
+
+    # the cgroup uses a fifth of the host's busy time, and is sampled 4 times
+    # per clock tick, but /proc/stat only moves once per tick
+    shares = []
+    host_usec = 0
+    for sample in range(1, 41):
+        if sample % 4 == 0:
+            host_usec += tick_usec
+        fake.set_usage(sample * tick_usec // 20, host_usec)
+        shares.append(cpu_share.share())
+
+    assert shares[-1] == pytest.approx(0.2, rel=0.05)
+    assert all(share == pytest.approx(0.2, rel=0.05) for share in shares[3:])
+    cpu_share.close()
+
+
+def test_parse_busy_jiffies():
+    # idle and iowait aren't busy
+    assert cgroup.parse_busy_jiffies("cpu  10 1 5 1000 20 2 3 4 0 0\ncpu0 1 1 1 1 1 1 1 1 0 0\n") == 25
+
+
+def test_missing_cgroup(tmp_path):
+    fake = FakeCgroup(tmp_path)
+    (fake.proc_dir / "self" / "cgroup").write_text("1:name=systemd:/\n")
+    with pytest.raises(RuntimeError):
+        cgroup.CgroupCpuShare(str(fake.proc_dir), str(fake.cgroup_dir))
@@ -0,0 +1,27 @@
+import os
+
+from joulehunter import cpufreq
+
+from .fake_rapl_util import FakeCpus
+
+
+def test_frequency_reader(tmp_path):
+    fake = FakeCpus(tmp_path)
+    reader = cpufreq.CpuFrequencyReader(str(fake.proc_dir), str(fake.cpu_dir))
+    assert reader.read() == (0, 1000000)
+
+    fake.set_frequency(0, 3400000)
+    assert reader.read() == (0, 3400000)
+
+    fake.set_cpu(1)
+    assert reader.read() == (1, 1000000)
+
+    # a core without cpufreq, e.g. in a VM
+    fake.set_cpu(5)
+    assert reader.read() == (5, 0)
+    reader.close()
+
+
+def test_parse_processor():
+    with open(f"/proc/{os.getpid()}/stat") as file:
+        assert 0 <= cpufreq.parse_processor(file.read()) < os.cpu_count()
@@ -0,0 +1,524 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from joulehunter import energy
+
+
+def test_available_domains(fake_rapl):
+    domains = energy.available_domains()
+
+    assert [package["name"] for package in domains] == ["package-0"]
+    assert [c["name"] for c in domains[0]["components"]] == ["core", "dram"]
+
+
+def test_parse_domain(fake_rapl):
+    assert energy.parse_domain(0, None) == ["intel-rapl:0"]
+    assert energy.parse_domain("package-0", "dram") == ["intel-rapl:0", "intel-rapl:0:1"]
+
+
+def test_topology_is_cached(fake_rapl, monkeypatch):
+    topology = energy.get_topology()
+    assert [package.name for package in topology.packages] == ["package-0"]
+    assert topology.find(["intel-rapl:0", "intel-rapl:0:1"]).name == "dram"
+
+    # sysfs isn't walked again once the topology is known
+    def listdir(path):
+        raise AssertionError("listdir called")
+
+    with monkeypatch.context() as m:
+        m.setattr(energy.os, "listdir", listdir)
+        assert energy.parse_domain("package-0", "dram") == ["intel-rapl:0", "intel-rapl:0:1"]
+        assert energy.domain_names(["intel-rapl:0", "intel-rapl:0:0"]) == ["package-0", "core"]
+
+    fake_rapl.add_domain(["intel-rapl:1"], "package-1")
+    assert energy.get_topology() is topology
+
+    topology = energy.refresh_topology()
+    assert [package.name for package in topology.packages] == ["package-0", "package-1"]
+    assert energy.get_topology() is topology
+
+
+def test_current_energy(fake_rapl):
+    counter = energy.Energy(["intel-rapl:0"])
+
+    fake_rapl.set_energy(["intel-rapl:0"], 1500000)
+    assert counter.current_energy() == pytest.approx(1.5)
+
+    # the counter is re-read from the start of the file on every call
+    fake_rapl.set_energy(["intel-rapl:0"], 2500000)
+    assert counter.current_energy() == pytest.approx(2.5)
+
+    counter.close()
+
+
+def test_missing_domain(fake_rapl):
+    with pytest.raises(RuntimeError):
+        energy.Energy(["intel-rapl:1"])
+
+
+def test_interpolate_energy():
+    # the counter updates at 0, 10 and 20, but was polled more often
+    record_timestamps = [0, 5, 10, 15, 20, 25]
+    record_values = [0, 0, 1000000, 1000000, 3000000, 3000000]
+
+    energies = energy.interpolate_energy(
+        record_timestamps, record_values, [-5, 0, 5, 10, 15, 25, 30])
+
+    assert energies == pytest.approx([0.0, 0.0, 0.5, 1.0, 2.0, 3.0, 3.0])
+
+
+def test_energy_poller(fake_rapl):
+    counter = energy.Energy(["intel-rapl:0"])
+    poller = energy.EnergyPoller([counter], interval=0.001)
+
+    poller.start()
+    start = time.monotonic_ns()
+    time.sleep(0.01)
+    fake_rapl.set_energy(["intel-rapl:0"], 2000000)
+    time.sleep(0.01)
+    end = time.monotonic_ns()
+    poller.stop()
+
+    [energies] = poller.interpolate([start, end])
+    assert energies == pytest.approx([0.0, 2.0], abs=0.1)
+    assert poller.dropped == 0
+
+    counter.close()
+
+
+def test_energy_poller_grows(fake_rapl):
+    counter = energy.Energy(["intel-rapl:0"])
+    # far fewer slots than the readings of the profile
+    poller = energy.EnergyPoller([counter], interval=0.0005, capacity=4)
+
+    poller.start()
+    start = time.monotonic_ns()
+    for energy_uj in range(0, 50000, 1000):
+        fake_rapl.set_energy(["intel-rapl:0"], energy_uj)
+        time.sleep(0.001)
+    end = time.monotonic_ns()
+    poller.stop()
+
+    # the first readings weren't overwritten, so the start is still accurate
+    assert poller.dropped == 0
+    timestamps, _ = poller._poller.records()
+    assert len(timestamps) > 4
+    assert timestamps[0] <= start
+    [energies] = poller.interpolate([start, end])
+    assert energies == pytest.approx([0.0, 0.049], abs=0.002)
+
+    counter.close()
+
+
+def test_energy_poller_downsamples(fake_rapl):
+    counter = energy.Energy(["intel-rapl:0"])
+    poller = energy.EnergyPoller([counter], interval=0.0005, capacity=4, max_capacity=8)
+
+    poller.start()
+    start = time.monotonic_ns()
+    for energy_uj in range(0, 50000, 1000):
+        fake_rapl.set_energy(["intel-rapl:0"], energy_uj)
+        time.sleep(0.001)
+    poller.stop()
+
+    # the buffer stopped growing, and kept every other reading instead
+    timestamps, _ = poller._poller.records()
+    assert len(timestamps) <= 8
+    assert poller.dropped > 0
+    assert poller.interval > 0.0005
+    assert timestamps[0] <= start
+    assert timestamps == sorted(timestamps)
+    # the energy up to the last reading is still exact
+    [energies] = poller.interpolate([start, timestamps[-1]])
+    assert energies == pytest.approx([0.0, 0.049], abs=0.002)
+
+    with pytest.raises(ValueError):
+        energy.EnergyPoller([counter], capacity=8, max_capacity=4)
+
+    counter.close()
+
+
+def test_wraparound(fake_rapl):
+    fake_rapl.set_max_energy_range(["intel-rapl:0"], 1000000)
+    counter = energy.Energy(["intel-rapl:0"])
+    assert counter.max_ranges == [1000000]
+
+    readings = []
+    for energy_uj in [900000, 100000, 950000, 10000]:
+        fake_rapl.set_energy(["intel-rapl:0"], energy_uj)
+        readings.append(counter.current_energy())
+
+    # the counter wrapped twice, but the readings keep increasing
+    assert readings == pytest.approx([0.9, 1.1, 1.95, 2.01])
+
+    counter.close()
+
+
+def test_energy_poller_wraparound(fake_rapl):
+    fake_rapl.set_max_energy_range(["intel-rapl:0"], 1000000)
+    fake_rapl.set_energy(["intel-rapl:0"], 800000)
+    counter = energy.Energy(["intel-rapl:0"])
+    poller = energy.EnergyPoller([counter], interval=0.001)
+
+    poller.start()
+    start = time.monotonic_ns()
+    time.sleep(0.01)
+    fake_rapl.set_energy(["intel-rapl:0"], 300000)
+    time.sleep(0.01)
+    end = time.monotonic_ns()
+    poller.stop()
+
+    [energies] = poller.interpolate([start, end])
+    assert energies[1] - energies[0] == pytest.approx(0.5, abs=0.1)
+
+    counter.close()
+
+
+def test_parse_domains(fake_rapl):
+    assert energy.parse_domains([0, "package-0/dram", ("0", "core")]) == [
+        ["intel-rapl:0"],
+        ["intel-rapl:0", "intel-rapl:0:1"],
+        ["intel-rapl:0", "intel-rapl:0:0"],
+    ]
+
+    with pytest.raises(ValueError):
+        energy.parse_domains([])
+
+
+def test_read_all(fake_rapl):
+    counters = [energy.Energy(["intel-rapl:0"]), energy.Energy(["intel-rapl:0", "intel-rapl:0:1"])]
+
+    fake_rapl.set_energy(["intel-rapl:0"], 1500000)
+    fake_rapl.set_energy(["intel-rapl:0", "intel-rapl:0:1"], 250000)
+    assert energy.Energy.read_all(counters) == [[1500000], [250000]]
+
+    for counter in counters:
+        counter.close()
+
+
+def test_all_packages(fake_rapl):
+    fake_rapl.add_domain(["intel-rapl:1"], "package-1")
+
+    assert energy.parse_domain("all", None) == [energy.ALL_PACKAGES]
+    with pytest.raises(ValueError):
+        energy.parse_domain("all", "dram")
+
+    counter = energy.Energy([energy.ALL_PACKAGES])
+    assert counter.is_aggregate
+    assert counter.parts == [["intel-rapl:0"], ["intel-rapl:1"]]
+    assert counter.column_names() == [["all"], ["package-0"], ["package-1"]]
+
+    fake_rapl.set_energy(["intel-rapl:0"], 1000000)
+    fake_rapl.set_energy(["intel-rapl:1"], 3000000)
+    assert counter.current_energy() == pytest.approx(4.0)
+    # the per-package readings of the last read are kept
+    assert counter.last_values == [1000000, 3000000]
+
+    dram_counter = energy.Energy(["intel-rapl:0", "intel-rapl:0:1"])
+    readings = energy.Energy.read_all([counter, dram_counter])
+    assert readings == [[1000000, 3000000], [0]]
+    assert energy.energy_columns([counter, dram_counter], readings) == [
+        4000000, 1000000, 3000000, 0]
+
+    counter.close()
+    dram_counter.close()
+
+
+def test_powercap_root(fake_rapl, monkeypatch):
+    monkeypatch.setattr(energy, "RAPL_API_DIR", "/nonexistent")
+    with pytest.raises(RuntimeError):
+        energy.PowercapBackend().topology()
+
+    backend = energy.PowercapBackend(root=str(fake_rapl.root))
+    assert backend.topology().root == str(fake_rapl.root)
+
+    # e.g. a container with the host's /sys mounted elsewhere
+    monkeypatch.setenv(energy.POWERCAP_ROOT_ENV_VAR, str(fake_rapl.root))
+    backend = energy.PowercapBackend()
+    assert [package.name for package in backend.topology().packages] == ["package-0"]
+
+    counter = energy.Energy(["intel-rapl:0"], backend)
+    fake_rapl.set_energy(["intel-rapl:0"], 1500000)
+    assert counter.current_energy() == pytest.approx(1.5)
+    counter.close()
+
+
+def test_scripted_backend():
+    backend = energy.ScriptedBackend(
+        packages={"package-0": ["core", "dram"], "package-1": ["dram"]},
+        script=lambda dirnames, read_count: read_count * (2000 if "dram" in dirnames[-1] else 1000),
+    )
+
+    assert not backend.native
+    assert energy.available_domains(backend) == [
+        {"dirname": "scripted:0", "name": "package-0", "components": [
+            {"dirname": "scripted:0:0", "name": "core"},
+            {"dirname": "scripted:0:1", "name": "dram"}]},
+        {"dirname": "scripted:1", "name": "package-1", "components": [
+            {"dirname": "scripted:1:0", "name": "dram"}]},
+    ]
+    assert energy.parse_domain("package-1", "dram", backend) == ["scripted:1", "scripted:1:0"]
+
+    counter = energy.Energy(["scripted:0"], backend)
+    assert [counter.current_energy() for _ in range(3)] == pytest.approx([0.0, 0.001, 0.002])
+
+    all_counter = energy.Energy([energy.ALL_PACKAGES], backend)
+    assert energy.Energy.read_all([counter, all_counter]) == [[3000], [0, 0]]
+    assert energy.Energy.read_all([counter, all_counter]) == [[4000], [1000, 1000]]
+
+    with pytest.raises(ValueError):
+        energy.EnergyPoller([counter])
+
+
+@pytest.mark.parametrize("backend_name", ["scripted", "model"])
+def test_backend_handles_are_reused(backend_name):
+    backend = energy.BACKENDS[backend_name]()
+    domain = energy.parse_domain(0, 0, backend)
+
+    handles = set()
+    for _ in range(100):
+        counter = energy.Energy(domain, backend)
+        handles.update(counter.fds)
+        counter.close()
+
+    # a handle is freed when its counter closes, so the next one reuses it
+    assert len(handles) == 1
+    if backend_name == "scripted":
+        assert len(backend._handles) == 1
+
+        # a reused handle starts its script again
+        counter = energy.Energy(domain, backend)
+        assert counter.read() == [0]
+        counter.close()
+
+
+def test_scripted_backend_wraparound():
+    backend = energy.ScriptedBackend(max_energy_range=2500)
+    counter = energy.Energy(["scripted:0"], backend)
+
+    # the raw readings wrap every 2500 µJ
+    assert [counter.read()[0] for _ in range(6)] == [0, 1000, 2000, 3000, 4000, 5000]
+
+
+def test_get_backend():
+    assert isinstance(energy.get_backend("scripted"), energy.ScriptedBackend)
+    with pytest.raises(ValueError):
+        energy.get_backend("nonexistent")
+
+
+def test_hwmon_backend(fake_hwmon):
+    backend = energy.HwmonBackend()
+
+    # sockets become packages, and the cores are split between them
+    assert energy.stringify_domains(energy.available_domains(backend)) == (
+        "[0] Esocket0\n"
+        "  [0] Ecore000\n"
+        "  [1] Ecore001\n"
+        "[1] Esocket1\n"
+        "  [0] Ecore002\n"
+        "  [1] Ecore003\n"
+        "[2] SoC\n"
+        "[3] CPU_B"
+    )
+    assert energy.parse_domain("Esocket1", "Ecore002", backend) == ["hwmon:1", "hwmon:1:0"]
+    assert energy.parse_domain(3, None, backend) == ["hwmon:3"]
+
+    counter = energy.Energy(["hwmon:1", "hwmon:1:0"], backend)
+    assert counter.native
+    fake_hwmon.set_energy("hwmon0", 3, 2500000)
+    assert counter.current_energy() == pytest.approx(2.5)
+    counter.close()
+
+    # the counters are polled natively, like powercap's
+    counter = energy.Energy(["hwmon:2"], backend)
+    poller = energy.EnergyPoller([counter])
+    poller.start()
+    fake_hwmon.set_energy("hwmon2", 1, 1000000)
+    time.sleep(0.01)
+    poller.stop()
+    [energies] = poller.interpolate([time.monotonic_ns()])
+    assert energies == pytest.approx([1.0])
+    counter.close()
+
+
+def test_default_backend_is_chosen_once(fake_rapl, monkeypatch):
+    backend = energy.get_backend()
+    assert isinstance(backend, energy.PowercapBackend)
+
+    def is_running(self):
+        raise AssertionError("the default backend was chosen again")
+
+    monkeypatch.setattr(energy.EnergydBackend, "is_running", is_running)
+    monkeypatch.setenv(energy.BACKEND_ENV_VAR, "scripted")
+    assert energy.get_backend() is backend
+    assert energy.domain_name(["intel-rapl:0"]) == "package-0"
+
+    # until the domains are discovered again
+    energy.refresh_topology()
+    assert isinstance(energy.get_backend(), energy.ScriptedBackend)
+
+
+def test_default_backend_falls_back_to_hwmon(fake_hwmon, monkeypatch):
+    monkeypatch.setattr(energy, "RAPL_API_DIR", "/nonexistent")
+    assert isinstance(energy.get_backend(), energy.HwmonBackend)
+    assert [package["name"] for package in energy.available_domains()][:2] == [
+        "Esocket0", "Esocket1"]
+
+    # the default is kept until it's chosen again
+    monkeypatch.setenv(energy.BACKEND_ENV_VAR, "scripted")
+    assert isinstance(energy.get_backend(), energy.HwmonBackend)
+    energy.set_backend(None)
+    assert isinstance(energy.get_backend(), energy.ScriptedBackend)
+
+
+def test_model_backend(monkeypatch):
+    backend = energy.ModelBackend(watts=20.0)
+
+    assert not backend.native
+    assert energy.stringify_domains(energy.available_domains(backend)) == (
+        "[0] process\n"
+        "  [0] thread"
+    )
+
+    counter = energy.Energy(energy.parse_domain("process", None, backend), backend)
+    thread_counter = energy.Energy(energy.parse_domain(0, "thread", backend), backend)
+    start_energy = counter.current_energy()
+    start_thread_energy = thread_counter.current_energy()
+    start_cpu_time = time.process_time()
+    while time.process_time() - start_cpu_time < 0.05:
+        pass
+
+    # 20 W per second of CPU time
+    cpu_time = time.process_time() - start_cpu_time
+    assert counter.current_energy() - start_energy == pytest.approx(20.0 * cpu_time, rel=0.1)
+    assert thread_counter.current_energy() - start_thread_energy == pytest.approx(
+        20.0 * cpu_time, rel=0.1)
+
+    monkeypatch.setenv(energy.MODEL_WATTS_ENV_VAR, "7.5")
+    assert energy.ModelBackend().watts == 7.5
+    with pytest.raises(ValueError):
+        energy.ModelBackend(watts=0)
+
+
+def test_model_backend_calibrate():
+    # the scripted counter is read twice, adding 1000 µJ, over at most about
+    # 0.05s of CPU time
+    watts = energy.ModelBackend.calibrate(energy.ScriptedBackend(), duration=0.05)
+    assert watts >= 0.001 / 0.05 * 0.9
+
+
+def test_default_backend_falls_back_to_model(monkeypatch, tmp_path):
+    monkeypatch.setattr(energy, "RAPL_API_DIR", "/nonexistent")
+    monkeypatch.setenv(energy.HWMON_ROOT_ENV_VAR, str(tmp_path))
+    with pytest.warns(UserWarning):
+        assert isinstance(energy.get_backend(), energy.ModelBackend)
+
+
+def test_idle_power(fake_rapl, tmp_path):
+    # every read of the scripted counter adds 1000 µJ
+    counter = energy.Energy(["scripted:0"], energy.ScriptedBackend())
+    [watts] = energy.measure_idle_power([counter], duration=0.01)
+    assert 0 < watts <= 0.001 / 0.01
+
+    cache_path = str(tmp_path / "cache" / "idle_power.json")
+    counter = energy.Energy(["intel-rapl:0"])
+    fake_rapl.set_energy(["intel-rapl:0"], 5000000)
+    assert energy.idle_power([counter], duration=0.01, cache_path=cache_path) == [0.0]
+
+    # the measurement is cached per host and domain
+    with open(cache_path) as file:
+        cache = json.load(file)
+    [key] = cache
+    assert key.endswith("|powercap|package-0")
+    cache[key]["watts"] = [12.5]
+    with open(cache_path, "w") as file:
+        json.dump(cache, file)
+    assert energy.idle_power([counter], duration=0.01, cache_path=cache_path) == [12.5]
+
+    # until it's too old
+    cache[key]["time"] -= energy.IDLE_CALIBRATION_MAX_AGE
+    with open(cache_path, "w") as file:
+        json.dump(cache, file)
+    assert energy.idle_power([counter], duration=0.01, cache_path=cache_path) == [0.0]
+    counter.close()
+
+
+def test_counter_pool(fake_rapl):
+    handle_count = len(energy.counter_pool)
+
+    # counters of the same domain share their file descriptor
+    counter = energy.Energy(["intel-rapl:0"])
+    other_counter = energy.Energy(["intel-rapl:0"])
+    dram_counter = energy.Energy(["intel-rapl:0", "intel-rapl:0:1"])
+    assert counter.fds == other_counter.fds
+    assert dram_counter.fds != counter.fds
+    assert len(energy.counter_pool) == handle_count + 2
+
+    [fd] = counter.fds
+    counter.close()
+    fake_rapl.set_energy(["intel-rapl:0"], 1000000)
+    assert other_counter.current_energy() == pytest.approx(1.0)
+
+    # the last user closes it
+    other_counter.close()
+    with pytest.raises(OSError):
+        os.fstat(fd)
+    dram_counter.close()
+    assert len(energy.counter_pool) == handle_count
+
+
+def test_counter_pool_threads(fake_rapl):
+    handle_count = len(energy.counter_pool)
+
+    def use_counters():
+        for _ in range(200):
+            energy.Energy(["intel-rapl:0"]).close()
+
+    threads = [threading.Thread(target=use_counters) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(energy.counter_pool) == handle_count
+
+
+def test_auto_package(fake_cpus):
+    fake_cpus.intersection_update({2, 3})
+    assert energy.parse_domain("auto", None) == ["intel-rapl:1"]
+
+    fake_cpus.update({1})
+    assert energy.parse_domain("auto", None) == [energy.AUTO_PACKAGE]
+    with pytest.raises(ValueError):
+        energy.parse_domain("auto", "dram")
+
+    counter = energy.Energy([energy.AUTO_PACKAGE])
+    assert counter.parts == [["intel-rapl:0"], ["intel-rapl:1"]]
+    assert counter.column_names() == [["auto"], ["package-0"], ["package-1"]]
+    counter.close()
+
+
+def test_auto_package_matches_names(fake_cpus, fake_rapl):
+    # the zones are registered in another order than the packages' IDs
+    (fake_rapl.root / "intel-rapl:0" / "name").write_text("package-1\n")
+    (fake_rapl.root / "intel-rapl:1" / "name").write_text("package-0\n")
+    energy.refresh_topology()
+    fake_cpus.intersection_update({0, 1})
+    assert energy.affinity_package_domains() == [["intel-rapl:1"]]
+
+    # every die of the package is included
+    (fake_rapl.root / "intel-rapl:0" / "name").write_text("package-0-die-0\n")
+    (fake_rapl.root / "intel-rapl:1" / "name").write_text("package-0-die-1\n")
+    energy.refresh_topology()
+    assert energy.affinity_package_domains() == [["intel-rapl:0"], ["intel-rapl:1"]]
+    assert energy.parse_domain("auto", None) == [energy.AUTO_PACKAGE]
+
+    # a backend with one package for the whole machine
+    fake_cpus.clear()
+    fake_cpus.add(2)
+    with pytest.warns(UserWarning, match="package 1"):
+        assert energy.affinity_package_domains("model") == [["model:0"]]
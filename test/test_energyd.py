@@ -0,0 +1,117 @@
+import os
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from joulehunter import energy, energyd
+
+
+def test_energy_publisher(fake_rapl, tmp_path):
+    path = str(tmp_path / "joulehunter-energy")
+    publisher = energyd.EnergyPublisher(path, "powercap")
+    assert oct(os.stat(path).st_mode & 0o777) == "0o644"
+
+    backend = energy.EnergydBackend(path)
+    assert energy.available_domains(backend) == [
+        {"dirname": "energyd:0", "name": "package-0", "components": [
+            {"dirname": "energyd:0:0", "name": "core"},
+            {"dirname": "energyd:0:1", "name": "dram"}]},
+    ]
+
+    counter = energy.Energy(energy.parse_domain(0, "dram", backend), backend)
+    fake_rapl.set_energy(["intel-rapl:0", "intel-rapl:0:1"], 2500000)
+    assert counter.current_energy() == 0
+    publisher.publish()
+    assert counter.current_energy() == pytest.approx(2.5)
+
+    # the counters are read from memory, while they're being updated
+    stop_event = threading.Event()
+    thread = threading.Thread(target=publisher.run, args=(stop_event,))
+    thread.start()
+    try:
+        for energy_uj in range(2500000, 2600000, 1000):
+            fake_rapl.set_energy(["intel-rapl:0", "intel-rapl:0:1"], energy_uj)
+            assert 2.5 <= counter.current_energy() <= energy_uj / 10**6
+    finally:
+        stop_event.set()
+        thread.join()
+
+    counter.close()
+    publisher.close()
+    assert not os.path.exists(path)
+
+
+def test_energy_publisher_ignores_planted_files(fake_rapl, tmp_path):
+    # another user left a symlink at the name the segment used to be
+    # written under, and one at the segment itself
+    path = str(tmp_path / "joulehunter-energy")
+    target = tmp_path / "target"
+    target.write_text("keep me")
+    os.symlink(target, f"{path}.{os.getpid()}")
+    os.symlink(target, path)
+
+    publisher = energyd.EnergyPublisher(path, "powercap")
+    assert not os.path.islink(path)
+    assert target.read_text() == "keep me"
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        ["intel-rapl", "joulehunter-energy", f"joulehunter-energy.{os.getpid()}", "target"])
+    publisher.close()
+
+
+def test_energyd_process(fake_rapl, tmp_path):
+    path = str(tmp_path / "joulehunter-energy")
+    env = dict(os.environ, **{energy.POWERCAP_ROOT_ENV_VAR: str(fake_rapl.root)})
+    process = subprocess.Popen(
+        [sys.executable, "-m", "joulehunter.energyd", "--path", path], env=env)
+    try:
+        start = time.time()
+        while not os.path.exists(path) and time.time() < start + 10:
+            time.sleep(0.01)
+
+        backend = energy.EnergydBackend(path)
+        counter = energy.Energy(["energyd:0"], backend)
+        fake_rapl.set_energy(["intel-rapl:0"], 1000000)
+        while counter.current_energy() == 0 and time.time() < start + 10:
+            time.sleep(0.001)
+        assert counter.current_energy() == pytest.approx(1.0)
+        counter.close()
+    finally:
+        process.terminate()
+        process.wait()
+
+    assert not os.path.exists(path)
+
+
+def test_energyd_not_running(tmp_path):
+    with pytest.raises(RuntimeError):
+        energy.EnergydBackend(str(tmp_path / "joulehunter-energy")).topology()
+
+
+def test_default_backend_skips_stale_segment(fake_rapl, tmp_path, monkeypatch):
+    path = str(tmp_path / "joulehunter-energy")
+    monkeypatch.setenv(energy.ENERGYD_PATH_ENV_VAR, path)
+    publisher = energyd.EnergyPublisher(path, "powercap")
+    try:
+        assert isinstance(energy.get_backend(), energy.EnergydBackend)
+
+        # the helper was killed, and left its segment behind
+        struct.pack_into(
+            "=Q", publisher._mmap, energy.ENERGYD_TIMESTAMP_OFFSET,
+            time.monotonic_ns() - int(2 * energy.ENERGYD_MAX_AGE * 10**9))
+        assert not energy.EnergydBackend(path).is_running()
+        assert isinstance(energy.get_backend(), energy.PowercapBackend)
+
+        publisher.publish()
+        assert energy.EnergydBackend(path).is_running()
+        if os.getuid() == 0:
+            # a segment that anyone could have written isn't trusted
+            os.chown(path, 12345, -1)
+            assert not energy.EnergydBackend(path).is_running()
+    finally:
+        publisher.close()
+
+    assert not energy.EnergydBackend(path).is_running()
@@ -293,3 +293,83 @@ def test_group_library_frames_processor():
     sys.path.append("env/lib/python3.6")
     assert group.libraries == ["django"]
     sys.path[:] = old_sys_path
+
+
+def test_domain_times():
+    frame = Frame(
+        identifier="<module>\x00cibuildwheel/__init__.py\x0012",
+        children=[
+            Frame(
+                identifier="strip_newlines\x00cibuildwheel/utils.py\x00997",
+                self_time=0.1,
+                self_domain_times=[0.1, 0.01],
+            ),
+            Frame(
+                identifier="strip_newlines\x00cibuildwheel/utils.py\x00997",
+                self_time=0.2,
+                self_domain_times=[0.2, 0.02],
+            ),
+            SelfTimeFrame(
+                self_time=0.3,
+                self_domain_times=[0.3, 0.03],
+            ),
+        ],
+    )
+
+    assert frame.domain_times() == approx((0.6, 0.06))
+    assert frame.domain_time(1) == approx(0.06)
+
+    frame = processors.aggregate_repeated_calls(frame, options={})
+    assert frame
+
+    assert len(frame.children) == 2
+    assert frame.children[0].domain_times() == approx((0.3, 0.03))
+    assert frame.domain_times() == approx((0.6, 0.06))
+
+    frame = processors.remove_unnecessary_self_time_nodes(frame, options={})
+    assert frame
+    assert frame.domain_times() == approx((0.6, 0.06))
+
+
+def test_wall_time_and_power():
+    frame = Frame(
+        identifier="<module>\x00cibuildwheel/__init__.py\x0012",
+        children=[
+            Frame(
+                identifier="strip_newlines\x00cibuildwheel/utils.py\x00997",
+                self_time=0.2,
+                self_wall_time=0.1,
+            ),
+            Frame(
+                identifier="calculate_metrics\x00cibuildwheel/utils.py\x007",
+                self_time=0.1,
+                self_wall_time=0.01,
+            ),
+            Frame(
+                identifier="strip_newlines\x00cibuildwheel/utils.py\x00997",
+                self_time=0.2,
+                self_wall_time=0.1,
+            ),
+        ],
+    )
+
+    assert frame.energy() == approx(0.5)
+    assert frame.wall_time() == approx(0.21)
+    assert frame.mean_power() == approx(0.5 / 0.21)
+    assert Frame(identifier="f\x00a.py\x001", self_time=0.1).mean_power() == 0
+
+    frame = processors.aggregate_repeated_calls(frame, options={"metric": "power"})
+    assert frame
+
+    # calculate_metrics draws 10 W, against 2 W for strip_newlines
+    assert [child.function for child in frame.children] == ["calculate_metrics", "strip_newlines"]
+    assert frame.children[1].wall_time() == approx(0.2)
+    assert frame.children[1].mean_power() == approx(2)
+
+    frame = processors.remove_irrelevant_nodes(
+        frame, options={"metric": "time", "filter_threshold": 0.1})
+    assert frame
+
+    # calculate_metrics is 20% of the energy, but under 5% of the time
+    assert [child.function for child in frame.children] == ["strip_newlines"]
+    assert frame.wall_time() == approx(0.21)
@@ -1,5 +1,6 @@
 import asyncio
 import json
+import socket
 import time
 from functools import partial
 from test.fake_time_util import fake_time
@@ -8,7 +9,7 @@ from typing import Generator, Optional
 import pytest
 import trio
 
-from joulehunter import Profiler, renderers
+from joulehunter import Profiler, energy, renderers
 from joulehunter.frame import BaseFrame, Frame
 from joulehunter.session import Session
 
@@ -189,3 +190,343 @@ def test_state_management():
     profiler.reset()
     assert profiler.is_running == False
     assert profiler.last_session is None
+
+
+def test_multiple_domains():
+    # each record holds the energy of every domain
+    session = Session(
+        frame_records=[
+            (["<module>\x00a.py\x001", "f\x00a.py\x002"], [0.2, 0.02]),
+            (["<module>\x00a.py\x001", "g\x00a.py\x003"], [0.1, 0.05]),
+        ],
+        start_time=0,
+        duration=1,
+        sample_count=2,
+        start_call_stack=["<module>\x00a.py\x001"],
+        program="a.py",
+        domain_names=["package-0"],
+        domains=[["package-0"], ["package-0", "dram"]],
+    )
+
+    root_frame = session.root_frame()
+    assert root_frame
+    assert root_frame.time() == pytest.approx(0.3)
+    assert root_frame.domain_times() == pytest.approx((0.3, 0.07))
+
+    dram_root_frame = session.root_frame(domain=1)
+    assert dram_root_frame
+    assert dram_root_frame.time() == pytest.approx(0.07)
+
+    with pytest.raises(IndexError):
+        session.root_frame(domain=2)
+
+    output = json.loads(renderers.JSONRenderer(domain=1).render(session))
+    assert output["domain"] == 1
+    assert output["domains"] == [["package-0"], ["package-0", "dram"]]
+    assert output["package"] == "package-0"
+    assert output["component"] == "dram"
+    assert output["root_frame"]["time"] == pytest.approx(0.07)
+    assert output["root_frame"]["domain_times"] == pytest.approx([0.3, 0.07])
+
+    restored = Session.from_json(session.to_json())
+    assert restored.domains == session.domains
+    assert restored.root_frame(domain=1).time() == pytest.approx(0.07)
+
+
+def test_combine_different_domains():
+    def make_session(start_time, domains):
+        return Session(
+            frame_records=[(["<module>\x00a.py\x001"], [0.2] * len(domains), 0.1)],
+            start_time=start_time,
+            duration=1,
+            sample_count=1,
+            start_call_stack=["<module>\x00a.py\x001"],
+            program="a.py",
+            domain_names=domains[0],
+            domains=domains,
+        )
+
+    package_0_session = make_session(0, [["package-0"]])
+    combined = Session.combine(package_0_session, make_session(2, [["package-0"]]))
+    assert combined.domains == [["package-0"]]
+    assert combined.sample_count == 2
+
+    # the records of the other session measured other domains
+    with pytest.raises(ValueError):
+        Session.combine(package_0_session, make_session(2, [["package-1"]]))
+    with pytest.raises(ValueError):
+        Session.combine(
+            package_0_session, make_session(2, [["auto"], ["package-0"], ["package-1"]]))
+
+
+def test_wall_time_records():
+    # records carry their wall-clock time after the energy
+    session = Session(
+        frame_records=[
+            (["<module>\x00a.py\x001", "f\x00a.py\x002"], 0.2, 0.1),
+            (["<module>\x00a.py\x001", "g\x00a.py\x003"], 0.3, 0.01),
+        ],
+        start_time=0,
+        duration=1,
+        sample_count=2,
+        start_call_stack=["<module>\x00a.py\x001"],
+        program="a.py",
+        domain_names=["package-0"],
+    )
+
+    root_frame = session.root_frame()
+    assert root_frame
+    assert root_frame.wall_time() == pytest.approx(0.11)
+    assert root_frame.mean_power() == pytest.approx(0.5 / 0.11)
+
+    output = json.loads(renderers.JSONRenderer(metric="power").render(session))
+    assert output["metric"] == "power"
+    assert output["root_frame"]["wall_time"] == pytest.approx(0.11)
+    assert [child["function"] for child in output["root_frame"]["children"]] == ["g", "f"]
+
+    # the HTML renderer's session is sorted by the metric too
+    output = json.loads(renderers.HTMLRenderer(metric="time").render_json(session))
+    assert output["metric"] == "time"
+    assert [child["function"] for child in output["root_frame"]["children"]] == ["f", "g"]
+
+    text = renderers.ConsoleRenderer(metric="time").render(session)
+    assert "0.110 s" in text
+    assert "30.000 W g" in renderers.ConsoleRenderer(metric="power").render(session)
+
+    restored = Session.from_json(session.to_json())
+    assert restored.root_frame().wall_time() == pytest.approx(0.11)
+
+    with pytest.raises(ValueError):
+        renderers.ConsoleRenderer(metric="watts")
+
+
+def test_records_wall_time():
+    profiler = Profiler()
+    with profiler:
+        busy_wait(0.1)
+
+    session = profiler.last_session
+    assert session
+    assert all(len(record) == 3 for record in session.frame_records)
+    root_frame = session.root_frame()
+    assert root_frame
+    assert root_frame.wall_time() == pytest.approx(0.1, rel=0.5)
+
+
+def test_all_packages(fake_rapl, make_profiler):
+    fake_rapl.add_domain(["intel-rapl:1"], "package-1")
+
+    profiler = make_profiler(package="all")
+    assert profiler.domain == [energy.ALL_PACKAGES]
+
+    energy_uj = 0
+
+    def consume():
+        # the second package uses three times the energy of the first
+        nonlocal energy_uj
+        energy_uj += 1000
+        fake_rapl.set_energy(["intel-rapl:0"], energy_uj)
+        fake_rapl.set_energy(["intel-rapl:1"], 3 * energy_uj)
+        busy_wait(0.0005)
+
+    profiler.start()
+    for _ in range(200):
+        consume()
+    session = profiler.stop()
+
+    assert session.domains == [["all"], ["package-0"], ["package-1"]]
+
+    all_energy, package_0_energy, package_1_energy = session.root_frame().domain_times()
+    assert all_energy > 0
+    assert all_energy == pytest.approx(package_0_energy + package_1_energy)
+    assert package_1_energy == pytest.approx(3 * package_0_energy, rel=0.1)
+
+
+def test_calibrate_idle(fake_rapl, make_profiler, tmp_path, monkeypatch):
+    # this host's idle power was calibrated earlier today
+    cache_path = tmp_path / ".cache" / "joulehunter" / "idle_power.json"
+    cache_path.parent.mkdir(parents=True)
+    cache_path.write_text(json.dumps({
+        f"{socket.gethostname()}|powercap|package-0": {"time": time.time(), "watts": [0.5]},
+    }))
+    monkeypatch.setattr(energy, "IDLE_CALIBRATION_CACHE", str(cache_path))
+
+    profiler = make_profiler(calibrate_idle=True)
+    assert profiler.idle_power == [0.5]
+
+    energy_uj = 0
+
+    def consume():
+        nonlocal energy_uj
+        energy_uj += 1000
+        fake_rapl.set_energy(["intel-rapl:0"], energy_uj)
+        busy_wait(0.0005)
+
+    profiler.start()
+    for _ in range(200):
+        consume()
+    session = profiler.stop()
+
+    assert session.domains == [["package-0"], ["package-0 (dynamic)"]]
+
+    # the idle power is subtracted over the duration of each sample
+    for _, (total, dynamic), wall_time in session.frame_records:
+        assert dynamic == pytest.approx(total - 0.5 * wall_time)
+
+    total_energy, dynamic_energy = session.root_frame().domain_times()
+    assert total_energy == pytest.approx(energy_uj / 10**6, abs=0.002)
+    assert dynamic_energy == pytest.approx(
+        total_energy - 0.5 * session.root_frame().wall_time())
+    assert session.root_frame(domain=1).time() == pytest.approx(dynamic_energy)
+
+
+def test_cgroup_apportioning(fake_cgroup, make_profiler):
+    profiler = make_profiler(cgroup_apportioning=True, backend="model")
+
+    host_usec = 0
+
+    def work():
+        # the cgroup uses a fifth of the host's busy CPU time
+        nonlocal host_usec
+        host_usec += 50000
+        fake_cgroup.set_usage(host_usec // 5, host_usec)
+        busy_wait(0.001)
+
+    profiler.start()
+    for _ in range(100):
+        work()
+    session = profiler.stop()
+
+    assert session.domains == [["process"], ["process (cgroup)"]]
+    raw_time, apportioned_time = session.root_frame().domain_times()
+    assert raw_time > 0
+    assert apportioned_time == pytest.approx(0.2 * raw_time, rel=0.1)
+
+
+def test_auto_package_follows_affinity(fake_cpus, make_profiler):
+    fake_cpus.intersection_update({0})
+
+    profiler = make_profiler(package="auto")
+    assert profiler.domain == ["intel-rapl:0"]
+
+    # the process was moved to the other package
+    fake_cpus.clear()
+    fake_cpus.add(2)
+    profiler.start()
+    busy_wait(0.01)
+    session = profiler.stop()
+
+    assert profiler.domain == ["intel-rapl:1"]
+    assert session.domains == [["package-1"]]
+
+    # and then allowed on both, so the session can't be combined with the
+    # previous one
+    fake_cpus.add(0)
+    profiler.start()
+    busy_wait(0.01)
+    with pytest.warns(UserWarning, match="other energy domains"):
+        session = profiler.stop()
+
+    assert profiler.domain == [energy.AUTO_PACKAGE]
+    assert session.domains == [["auto"], ["package-0"], ["package-1"]]
+    assert profiler.last_session is session
+    assert all(len(record[1]) == 3 for record in session.frame_records)
+
+
+def test_auto_package_without_sockets(fake_cpus, make_profiler):
+    # the model backend has a single package, for the whole machine
+    fake_cpus.intersection_update({2})
+    with pytest.warns(UserWarning, match="package 1"):
+        profiler = make_profiler(package="auto", backend="model")
+    assert profiler.domain == ["model:0"]
+
+    with pytest.warns(UserWarning, match="package 1"):
+        with profiler:
+            busy_wait(0.01)
+    assert profiler.last_session
+    assert profiler.last_session.domains == [["process"]]
+
+
+def test_record_frequency(fake_cpufreq, make_profiler):
+    profiler = make_profiler(record_frequency=True, backend="model")
+
+    with profiler:
+        busy_wait(0.01)
+        fake_cpufreq.set_frequency(0, 2450000)
+        busy_wait(0.01)
+
+    session = profiler.last_session
+    assert session
+    assert len(session.cpu_records) == len(session.frame_records)
+    assert {cpu for cpu, _ in session.cpu_records} == {0}
+    assert {frequency for _, frequency in session.cpu_records} == {1000000, 2450000}
+
+    histograms = session.frequency_histograms()
+    busy_wait_identifier = next(
+        identifier for identifier in histograms if identifier.startswith("busy_wait\x00"))
+    assert set(histograms[busy_wait_identifier]) == {1000, 2400}
+
+    output = json.loads(renderers.JSONRenderer().render(session))
+    root_frequencies = output["root_frame"]["frequencies"]
+    assert sum(root_frequencies.values()) == len(session.frame_records)
+
+    restored = Session.from_json(session.to_json())
+    assert restored.frequency_histograms() == histograms
+
+
+def profile_energy_steps(profiler, fake_rapl):
+    energy_uj = 0
+    fake_rapl.set_energy(["intel-rapl:0"], energy_uj)
+
+    def consume():
+        nonlocal energy_uj
+        energy_uj += 1000
+        fake_rapl.set_energy(["intel-rapl:0"], energy_uj)
+
+    with profiler:
+        for _ in range(200):
+            consume()
+
+    session = profiler.last_session
+    assert session
+    return session
+
+
+def test_sample_buffer(fake_rapl, make_profiler):
+    # sampled on each step of the counter, so both profiles take the same
+    # samples
+    unbuffered_session = profile_energy_steps(
+        make_profiler(interval=None, energy_interval=0.0005), fake_rapl)
+
+    profiler = make_profiler(interval=None, energy_interval=0.0005, sample_buffer_size=16)
+    assert profiler.sample_buffer_size == 16
+    session = profile_energy_steps(profiler, fake_rapl)
+
+    # the samples arrive in batches, and the last one when the profiler stops
+    assert session.sample_count > 16
+    assert [stack for stack, _, _ in session.frame_records] == [
+        stack for stack, _, _ in unbuffered_session.frame_records
+    ]
+    assert [record[1] for record in session.frame_records] == pytest.approx(
+        [record[1] for record in unbuffered_session.frame_records])
+    root_frame = session.root_frame()
+    assert root_frame
+    assert root_frame.time() == pytest.approx(0.2)
+    assert root_frame.wall_time() == pytest.approx(session.duration, rel=0.2)
+    assert "consume" in renderers.ConsoleRenderer(show_all=True).render(session)
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {"energy_poll_interval": 0.01},
+        {"energy_on_change": True},
+        {"thread_cpu_weighting": True},
+        {"cgroup_apportioning": True},
+        {"record_frequency": True},
+        {"sampler": "signal"},
+    ],
+)
+def test_sample_buffer_incompatible_options(fake_rapl, make_profiler, options):
+    with pytest.raises(ValueError):
+        make_profiler(sample_buffer_size=16, **options)
@@ -0,0 +1,126 @@
+import signal
+import sys
+import threading
+import time
+
+import pytest
+
+from joulehunter import renderers
+from joulehunter.signal_sampler import get_signal_sampler
+
+from .util import first, walk_frames
+
+pytestmark = pytest.mark.skipif(
+    not hasattr(signal, "setitimer"), reason="needs setitimer")
+
+
+class StackRecorder:
+    def __init__(self):
+        self.stacks = []
+
+    def sample(self, stack, time, async_state):
+        self.stacks.append(stack)
+
+
+def spin(duration):
+    # no calls in the loop, so the setprofile sampler wouldn't see it
+    end = time.process_time() + duration
+    i = 0
+    while True:
+        i += 1
+        if i % 100000 == 0 and time.process_time() > end:
+            return
+
+
+def test_samples_interrupted_frame():
+    sampler = get_signal_sampler()
+    recorder = StackRecorder()
+
+    sampler.subscribe(recorder.sample, desired_interval=0.001, use_async_context=False)
+    assert sampler.current_sampling_interval == 0.001
+    assert sys.getprofile() is None
+    try:
+        spin(0.1)
+    finally:
+        sampler.unsubscribe(recorder.sample)
+
+    assert len(recorder.stacks) > 10
+    spin_stacks = [stack for stack in recorder.stacks if stack[-1].startswith("spin\x00")]
+    assert len(spin_stacks) > len(recorder.stacks) / 2
+    assert "test_samples_interrupted_frame" in spin_stacks[0][-2]
+
+
+def test_restores_handler():
+    sampler = get_signal_sampler()
+    recorder = StackRecorder()
+
+    def previous_handler(signum, frame):
+        pass
+
+    signal.signal(signal.SIGPROF, previous_handler)
+    try:
+        sampler.subscribe(recorder.sample, desired_interval=0.001, use_async_context=False)
+        assert signal.getsignal(signal.SIGPROF) == sampler._handle_signal
+        sampler.unsubscribe(recorder.sample)
+
+        assert signal.getsignal(signal.SIGPROF) is previous_handler
+        assert signal.getitimer(signal.ITIMER_PROF) == (0.0, 0.0)
+    finally:
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+
+    with pytest.raises(sampler.SubscriberNotFound):
+        sampler.unsubscribe(recorder.sample)
+
+
+def test_main_thread_only():
+    sampler = get_signal_sampler()
+    recorder = StackRecorder()
+    errors = []
+
+    def subscribe():
+        try:
+            sampler.subscribe(recorder.sample, desired_interval=0.001, use_async_context=False)
+        except RuntimeError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=subscribe)
+    thread.start()
+    thread.join()
+
+    assert len(errors) == 1
+    assert sampler.subscribers == []
+
+    with pytest.raises(ValueError):
+        sampler.subscribe(recorder.sample, desired_interval=0.001, use_async_context=True)
+
+
+def test_profiler(make_profiler):
+    profiler = make_profiler(sampler="signal", backend="model")
+    assert profiler.sampler == "signal"
+
+    with profiler:
+        spin(0.1)
+
+    session = profiler.last_session
+    assert session
+    root_frame = session.root_frame()
+    assert root_frame
+    spin_frame = first(f for f in walk_frames(root_frame) if f.function == "spin")
+    assert spin_frame
+    assert spin_frame.time() > root_frame.time() / 2
+    assert "spin" in renderers.ConsoleRenderer().render(session)
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {"sampler": "interrupts"},
+        {"sampler": "signal", "energy_interval": 0.01},
+        {"sampler": "signal", "energy_on_change": True},
+        {"sampler": "signal", "sample_buffer_size": 16},
+        {"sampler": "signal", "async_mode": "enabled"},
+    ],
+)
+def test_profiler_incompatible_options(make_profiler, options):
+    with pytest.raises(ValueError):
+        make_profiler(backend="model", **options)
@@ -4,7 +4,7 @@ import time
 
 import pytest
 
-from joulehunter import stack_sampler
+from joulehunter import energy, stack_sampler
 
 from .util import do_nothing
 
@@ -45,6 +45,29 @@ def test_get_samples():
     assert len(sampler.subscribers) == 0
 
 
+def test_default_interval_uses_monotonic_clock(monkeypatch):
+    timer_types = []
+    setstatprofile = stack_sampler.setstatprofile
+
+    def recording_setstatprofile(target, *args, **kwargs):
+        if target is not None:
+            timer_types.append(kwargs["timer_type"])
+        return setstatprofile(target, *args, **kwargs)
+
+    monkeypatch.setattr(stack_sampler, "setstatprofile", recording_setstatprofile)
+    # a typical coarse clock, too coarse for the default 1ms interval
+    monkeypatch.setattr(stack_sampler, "COARSE_CLOCK_RESOLUTION", 0.004)
+
+    sampler = stack_sampler.get_stack_sampler()
+    counter = SampleCounter()
+    for interval in (0.001, 0.01):
+        sampler.subscribe(counter.sample, desired_interval=interval, use_async_context=False)
+        do_nothing()
+        sampler.unsubscribe(counter.sample)
+
+    assert timer_types == ["monotonic", "walltime_coarse"]
+
+
 def test_multiple_samplers():
     sampler = stack_sampler.get_stack_sampler()
     counter_1 = SampleCounter()
@@ -118,3 +141,63 @@ def test_multiple_contexts():
     assert sys.getprofile() is None
 
     assert len(sampler.subscribers) == 0
+
+
+def test_energy_interval_requires_energy_counter():
+    sampler = stack_sampler.get_stack_sampler()
+    counter = SampleCounter()
+
+    with pytest.raises(ValueError):
+        sampler.subscribe(
+            counter.sample,
+            desired_interval=None,
+            use_async_context=False,
+            desired_energy_interval=0.001,
+        )
+
+    assert len(sampler.subscribers) == 0
+
+
+def test_energy_on_change():
+    sampler = stack_sampler.get_stack_sampler()
+    # the counter only changes every 5 reads, like RAPL's ~1ms updates
+    backend = energy.ScriptedBackend(script=lambda dirnames, read_count: read_count // 5 * 1000)
+    counter = energy.Energy(["scripted:0"], backend)
+    samples = []
+
+    def sample(stack, energy, async_state):
+        samples.append(energy)
+
+    sampler.subscribe(
+        sample, desired_interval=0.0001, use_async_context=False,
+        energy_counter=counter, energy_on_change=True,
+    )
+    start = time.time()
+    while time.time() < start + 1 and len(samples) < 20:
+        do_nothing()
+    flushed_sample_count = len(samples)
+    sampler.unsubscribe(sample)
+
+    assert flushed_sample_count >= 20
+    # each change is shared between the samples since the previous one,
+    # instead of most samples getting nothing
+    assert all(energy > 0 for energy in samples[:flushed_sample_count])
+    assert sum(samples) == pytest.approx(round(sum(samples), 3))
+
+
+def test_build_call_stack_shares_identifiers():
+    frame = sys._getframe()
+    stack_1 = stack_sampler.build_call_stack(frame, "line", None)
+    stack_2 = stack_sampler.build_call_stack(frame, "line", None)
+
+    assert stack_1 == stack_2
+    # each frame's identifier is built once, then reused
+    assert all(a is b for a, b in zip(stack_1, stack_2))
+    assert stack_1[-1] == "test_build_call_stack_shares_identifiers\x00%s\x00%i" % (
+        __file__, test_build_call_stack_shares_identifiers.__code__.co_firstlineno)
+    assert stack_1[0].split("\x00")[1] == "<thread>"
+
+    # code objects compiled later get their own identifiers
+    namespace = {}
+    exec(compile("def f():\n    import sys\n    return sys._getframe()\n", "<f>", "exec"), namespace)
+    assert stack_sampler.build_call_stack(namespace["f"](), "line", None)[-1] == "f\x00<f>\x001"
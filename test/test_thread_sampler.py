@@ -0,0 +1,152 @@
+import os
+import threading
+import time
+
+import pytest
+
+from joulehunter import processors
+from joulehunter.stack_sampler import identifier_of_thread
+from joulehunter.thread_sampler import (
+    ALL_THREADS_FRAME_IDENTIFIER,
+    TASK_SCHEDSTAT_PATH,
+    get_thread_sampler,
+)
+
+from .util import busy_wait, first, walk_frames
+
+needs_schedstat = pytest.mark.skipif(
+    not hasattr(threading, "get_native_id")
+    or not os.path.exists(TASK_SCHEDSTAT_PATH % threading.get_native_id()),
+    reason="needs /proc/self/task/<tid>/schedstat",
+)
+
+
+class StackRecorder:
+    def __init__(self):
+        self.samples = []
+
+    def sample(self, stack, time, async_state):
+        self.samples.append((stack, time))
+
+
+def spin(stop_spinning):
+    while not stop_spinning.is_set():
+        pass
+
+
+class SpinningThread:
+    """
+    A thread that spins until the end of the ``with`` block.
+    """
+
+    def __init__(self):
+        self.stop_spinning = threading.Event()
+        self.thread = threading.Thread(target=spin, args=(self.stop_spinning,), name="spinner")
+
+    def __enter__(self):
+        self.thread.start()
+        return self.thread
+
+    def __exit__(self, *args):
+        self.stop_spinning.set()
+        self.thread.join()
+
+
+def test_samples_other_threads():
+    sampler = get_thread_sampler()
+    recorder = StackRecorder()
+
+    with SpinningThread() as thread:
+        sampler.subscribe(recorder.sample, desired_interval=0.001, use_async_context=False)
+        try:
+            time.sleep(0.2)
+        finally:
+            sampler.unsubscribe(recorder.sample)
+        sample_count = len(recorder.samples)
+        time.sleep(0.01)
+        assert len(recorder.samples) == sample_count
+
+    assert sampler._thread is None
+    assert not any(t.name == "joulehunter-thread-sampler" for t in threading.enumerate())
+
+    stacks = [stack for stack, _ in recorder.samples]
+    assert all(stack[0] == ALL_THREADS_FRAME_IDENTIFIER for stack in stacks)
+    spinner_stacks = [
+        stack for stack in stacks if stack[1] == identifier_of_thread("spinner", thread.ident)
+    ]
+    assert spinner_stacks
+    assert any(identifier.startswith("spin\x00") for identifier in spinner_stacks[-1])
+    # the sampler never samples itself
+    assert not any("joulehunter-thread-sampler" in stack[1] for stack in stacks)
+
+    with pytest.raises(sampler.SubscriberNotFound):
+        sampler.unsubscribe(recorder.sample)
+
+
+@needs_schedstat
+def test_shares_energy_by_cpu_time(make_profiler):
+    profiler = make_profiler(sampler="threads", backend="model")
+
+    with SpinningThread():
+        with profiler:
+            # the profiled thread sleeps while the other one spins
+            time.sleep(0.3)
+
+    session = profiler.last_session
+    assert session
+    # the samples of the threads alternate, so each thread is split
+    root_frame = processors.aggregate_repeated_calls(session.root_frame(), options={})
+    assert root_frame
+    assert root_frame.identifier == ALL_THREADS_FRAME_IDENTIFIER
+    assert root_frame.time() > 0
+    assert root_frame.wall_time() == pytest.approx(session.duration, rel=0.2)
+
+    spin_frame = first(f for f in walk_frames(root_frame) if f.function == "spin")
+    assert spin_frame
+    assert spin_frame.time() > 0.8 * root_frame.time()
+
+
+@needs_schedstat
+def test_busy_threads(make_profiler):
+    profiler = make_profiler(sampler="threads", backend="model")
+
+    with SpinningThread():
+        with profiler:
+            busy_wait(0.3)
+
+    session = profiler.last_session
+    assert session
+    root_frame = processors.aggregate_repeated_calls(session.root_frame(), options={})
+    assert root_frame
+    spin_frame = first(f for f in walk_frames(root_frame) if f.function == "spin")
+    busy_wait_frame = first(f for f in walk_frames(root_frame) if f.function == "busy_wait")
+    assert spin_frame and busy_wait_frame
+    # both threads are busy, so both get a share of the energy, depending on
+    # how long each held the GIL
+    assert spin_frame.time() > 0.2 * root_frame.time()
+    assert busy_wait_frame.time() > 0.2 * root_frame.time()
+    assert spin_frame.time() + busy_wait_frame.time() == pytest.approx(
+        root_frame.time(), rel=0.1)
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {"energy_interval": 0.01},
+        {"energy_on_change": True},
+        {"sample_buffer_size": 16},
+        {"async_mode": "enabled"},
+        {"energy_poll_interval": 0.01},
+        {"thread_cpu_weighting": True},
+        {"cgroup_apportioning": True},
+        {"record_frequency": True},
+        # the samples' energy is shared between the threads, so there's a
+        # single domain
+        {"domains": ["0", "0/dram"]},
+        {"package": "all"},
+    ],
+)
+def test_profiler_incompatible_options(fake_rapl, make_profiler, options):
+    fake_rapl.add_domain(["intel-rapl:1"], "package-1")
+    with pytest.raises(ValueError):
+        make_profiler(sampler="threads", **options)
@@ -4,9 +4,9 @@ from test.fake_time_util import fake_time
 
 import pytest
 
-from joulehunter import Profiler
+from joulehunter import Profiler, energy
 
-from .util import do_nothing
+from .util import busy_wait, do_nothing
 
 
 def test_profiler_access_from_multiple_threads():
@@ -46,3 +46,32 @@ def test_profiler_access_from_multiple_threads():
 
     # the above stop failed. actually stop the profiler
     profiler.stop()
+
+
+def test_thread_cpu_weighting(make_profiler):
+    # the process uses 1 J per second of CPU time
+    profiler = make_profiler(thread_cpu_weighting=True, backend=energy.ModelBackend(watts=1.0))
+
+    stop_spinning = threading.Event()
+
+    def spin():
+        while not stop_spinning.is_set():
+            pass
+
+    thread = threading.Thread(target=spin)
+    thread.start()
+    try:
+        profiler.start()
+        start_thread_time = time.thread_time()
+        busy_wait(0.3)
+        thread_time = time.thread_time() - start_thread_time
+        session = profiler.stop()
+    finally:
+        stop_spinning.set()
+        thread.join()
+
+    # the two busy threads share the CPU, so the profiled thread is only
+    # charged with the energy of its own CPU time
+    root_frame = session.root_frame()
+    assert root_frame
+    assert root_frame.time() == pytest.approx(thread_time, rel=0.3)